@@ -1,36 +1,105 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
 import os
 from cfenv import AppEnv
 from sap import xssec
 import functools
-from retrieval import HybridRetriever
+from instrumentation import configure_logging, get_instrumentation
+from startup import LazyInitializer
+from tenants import TENANT_ID_PATTERN, UnknownTenantError
+from llm_scheduler import LLMTimeoutError
 
-local_testing = False
+local_testing = os.environ.get('LOCAL_TESTING', 'false').lower() == 'true'
+
+configure_logging()
 
 app = Flask(__name__)
 env = AppEnv()
 
-# Instantiate once, reuse for performance
-retriever = HybridRetriever()
+def create_retriever():
+    # Imported here: retrieval pulls in langchain, rdflib and the AI Core SDK,
+    # and importing this module must stay fast enough to answer health checks at once
+    from retrieval import HybridRetriever
+    return HybridRetriever()
+
+def warm_up_retriever(retriever):
+    if os.environ.get('PREWARM', 'true').lower() == 'true':
+        return retriever.warm_up()
+
+# One retriever per worker process, created on first use or by start_warmup() once the
+# worker runs, so that it is never shared across a fork by a pre-loading server
+retriever_initializer = LazyInitializer(create_retriever, warm_up=warm_up_retriever)
+
+def get_retriever():
+    return retriever_initializer.get()
+
+def start_warmup():
+    """
+    Creates and warms up the retriever in a background thread.
+    """
+    retriever_initializer.start()
 
 port = int(os.environ.get('PORT', 3000))
 if not local_testing:
     uaa_service = env.get_service(name='hana-ve-kge_YOUR_NUMBER-uaa').credentials
 
+def is_authorized(authorization_header):
+    """
+    Checks the bearer token in the authorization header for the uaa.resource scope.
+    """
+    if local_testing:
+        return True
+    if not authorization_header:
+        return False
+
+    access_token = authorization_header[7:]
+    security_context = xssec.create_security_context(access_token, uaa_service)
+    return security_context.check_scope('uaa.resource')
+
+def format_sse(event, data):
+    """
+    Formats one server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streamed responses (server-sent events, NDJSON) must reach the client unbuffered and uncached
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+max_batch_size = int(os.environ.get('ASK_BATCH_MAX_SIZE', 1000))
+
+def parse_batch(data):
+    """
+    Returns the questions of a /ask/batch request body and an error message, or None if it is valid.
+    """
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return None, 'Please provide a non-empty "questions" list of strings in the request body.'
+    if len(questions) > max_batch_size:
+        return None, f'A batch can contain at most {max_batch_size} questions.'
+    return questions, None
+
+def parse_tenant(data):
+    """
+    Returns the optional "tenant" of a request body and an error message, or None if it is valid.
+    Requests without a tenant are answered from the default graph and vector table.
+    """
+    tenant = data.get('tenant') if isinstance(data, dict) else None
+    if tenant is not None and (not isinstance(tenant, str) or not TENANT_ID_PATTERN.fullmatch(tenant)):
+        return None, 'The "tenant" field must consist of at most 64 letters, digits or underscores.'
+    return tenant, None
+
+def format_ndjson(data):
+    """
+    Formats one newline-delimited JSON record.
+    """
+    return json.dumps(data) + "\n"
+
 # Authorization Decorator
 def require_auth(f):
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
-        if not local_testing:
-            if 'authorization' not in request.headers:
-                return jsonify({"error": "You are not authorized to access this resource"}), 403
-            
-            access_token = request.headers.get('authorization')[7:]
-            security_context = xssec.create_security_context(access_token, uaa_service)
-            is_authorized = security_context.check_scope('uaa.resource')
-
-            if not is_authorized:
-                return jsonify({"error": "You are not authorized to access this resource"}), 403
+        if not is_authorized(request.headers.get('authorization')):
+            return jsonify({"error": "You are not authorized to access this resource"}), 403
 
         return f(*args, **kwargs)  # Call the original function if authorized
 
@@ -46,15 +115,82 @@ def ask_question():
         return jsonify({'error': 'Please provide a "question" field in the request body.'}), 400
 
     question = data['question']
+    tenant, error = parse_tenant(data)
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
-        answer = retriever.hybrid_retrieve_and_answer(question)
+        with get_retriever().for_tenant(tenant) as retriever:
+            answer = retriever.hybrid_retrieve_and_answer(question)
         return jsonify({
             "question": question,
             "answer": answer
         })
+    except UnknownTenantError as e:
+        return jsonify({'error': str(e)}), 404
+    except LLMTimeoutError as e:
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ask/stream', methods=['POST'])
+@require_auth
+def ask_question_stream():
+    data = request.get_json()
+
+    if not data or 'question' not in data:
+        return jsonify({'error': 'Please provide a "question" field in the request body.'}), 400
+
+    question = data['question']
+    tenant, error = parse_tenant(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    def generate():
+        try:
+            # The tenant's resources stay leased until the last event has been sent
+            with get_retriever().for_tenant(tenant) as retriever:
+                for event, payload in retriever.hybrid_retrieve_and_stream(question):
+                    if event == "done":
+                        payload = {"question": question, **payload}
+                    yield format_sse(event, payload)
+        except Exception as e:
+            yield format_sse("error", {"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+@app.route('/ask/batch', methods=['POST'])
+@require_auth
+def ask_batch():
+    data = request.get_json()
+    questions, error = parse_batch(data)
+    tenant, tenant_error = parse_tenant(data)
+    if error or tenant_error:
+        return jsonify({'error': error or tenant_error}), 400
+
+    def generate():
+        try:
+            with get_retriever().for_tenant(tenant) as retriever:
+                for result in retriever.answer_many(questions):
+                    yield format_ndjson(result)
+        except Exception as e:
+            yield format_ndjson({'error': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=STREAM_HEADERS)
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    status = retriever_initializer.status()
+    return jsonify(status), 200 if retriever_initializer.ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(get_instrumentation().render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    start_warmup()
     app.run(host='0.0.0.0', port=port)
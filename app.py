@@ -1,6 +1,8 @@
 from retrieval import HybridRetriever
+from instrumentation import configure_logging
 
 if __name__ == "__main__":
+    configure_logging()
     retriever = HybridRetriever()
 
     question = "I want to see all suppliers that are facing financial instability and are connected to regions with high geopolitical risks. Specify what issues are observed."
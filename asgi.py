@@ -0,0 +1,223 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from quart import Quart, Response, request, jsonify
+from api import (
+    is_authorized, get_retriever, start_warmup, retriever_initializer, format_sse, format_ndjson, parse_batch,
+    parse_tenant, STREAM_HEADERS
+)
+from instrumentation import get_instrumentation
+from tenants import UnknownTenantError
+from llm_scheduler import LLMTimeoutError
+
+app = Quart(__name__)
+
+class AdmissionLimiter:
+    """
+    Bounds the number of questions processed concurrently and the number waiting for a slot.
+    Requests beyond both limits are rejected immediately instead of piling up.
+    """
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._active = 0
+
+    async def acquire(self):
+        """
+        Takes a slot, waiting in the queue if needed. Returns False right away if the queue is
+        full and the request should be rejected. The check and the queueing happen without an
+        await in between, so a burst cannot pass the check before any of it is counted.
+        """
+        if self._active >= self.max_concurrency and self._waiting >= self.max_queue:
+            return False
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        return True
+
+    def release(self):
+        self._active -= 1
+        self._semaphore.release()
+
+class SlotBody:
+    """
+    Response body that hands back an admission slot taken by the handler once the body is
+    finished or closed, also if the server closes it before sending anything.
+    """
+    def __init__(self, body, limiter):
+        self.body = body
+        self.limiter = limiter
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.body.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self.limiter.release()
+        await self.body.aclose()
+
+limiter = AdmissionLimiter(
+    max_concurrency=int(os.environ.get('ASK_MAX_CONCURRENCY', 32)),
+    max_queue=int(os.environ.get('ASK_MAX_QUEUE', 64))
+)
+
+@app.before_serving
+async def create_retriever():
+    # Build the retriever in the background, so that health checks are answered right away
+    start_warmup()
+
+async def aget_retriever():
+    """
+    Returns the retriever, waiting for it off the event loop while it is still being created.
+    """
+    retriever = retriever_initializer.peek()
+    return retriever if retriever is not None else await asyncio.to_thread(get_retriever)
+
+async def ais_authorized(authorization_header):
+    """
+    Async variant of is_authorized. Validating a token may fetch the signing keys from XSUAA,
+    so it runs off the event loop.
+    """
+    return await asyncio.to_thread(is_authorized, authorization_header)
+
+@asynccontextmanager
+async def aretriever_for_tenant(tenant):
+    """
+    Async variant of HybridRetriever.for_tenant. A tenant's first request creates its
+    resources off the event loop.
+    """
+    retriever = await aget_retriever()
+    if tenant is None:
+        yield retriever
+        return
+    view = await asyncio.to_thread(retriever.acquire_tenant, tenant)
+    try:
+        yield view
+    finally:
+        # Releasing may close the connection of an evicted tenant
+        await asyncio.to_thread(retriever.release_tenant, view)
+
+@app.route('/ask', methods=['POST'])
+async def ask_question():
+    if not await ais_authorized(request.headers.get('authorization')):
+        return jsonify({"error": "You are not authorized to access this resource"}), 403
+
+    data = await request.get_json()
+
+    if not data or 'question' not in data:
+        return jsonify({'error': 'Please provide a "question" field in the request body.'}), 400
+
+    question = data['question']
+    tenant, error = parse_tenant(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    if not await limiter.acquire():
+        get_instrumentation().increment("requests_rejected_total")
+        return jsonify({'error': 'Too many concurrent questions, please retry later.'}), 429, {'Retry-After': '1'}
+
+    try:
+        async with aretriever_for_tenant(tenant) as retriever:
+            answer = await retriever.ahybrid_retrieve_and_answer(question)
+        return jsonify({
+            "question": question,
+            "answer": answer
+        })
+    except UnknownTenantError as e:
+        return jsonify({'error': str(e)}), 404
+    except LLMTimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        limiter.release()
+
+@app.route('/ask/stream', methods=['POST'])
+async def ask_question_stream():
+    if not await ais_authorized(request.headers.get('authorization')):
+        return jsonify({"error": "You are not authorized to access this resource"}), 403
+
+    data = await request.get_json()
+
+    if not data or 'question' not in data:
+        return jsonify({'error': 'Please provide a "question" field in the request body.'}), 400
+
+    question = data['question']
+    tenant, error = parse_tenant(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    if not await limiter.acquire():
+        get_instrumentation().increment("requests_rejected_total")
+        return jsonify({'error': 'Too many concurrent questions, please retry later.'}), 429, {'Retry-After': '1'}
+
+    async def generate():
+        # The slot and the tenant's resources are held until the last event has been sent
+        try:
+            async with aretriever_for_tenant(tenant) as retriever:
+                async for event, payload in retriever.ahybrid_retrieve_and_stream(question):
+                    if event == "done":
+                        payload = {"question": question, **payload}
+                    yield format_sse(event, payload).encode()
+        except Exception as e:
+            yield format_sse("error", {"error": str(e)}).encode()
+
+    response = Response(SlotBody(generate(), limiter), mimetype='text/event-stream', headers=STREAM_HEADERS)
+    # Answers can take longer than Quart's default 60 s limit for streamed bodies
+    response.timeout = float(os.environ.get('WEB_TIMEOUT', 120))
+    return response
+
+@app.route('/ask/batch', methods=['POST'])
+async def ask_batch():
+    if not await ais_authorized(request.headers.get('authorization')):
+        return jsonify({"error": "You are not authorized to access this resource"}), 403
+
+    data = await request.get_json()
+    questions, error = parse_batch(data)
+    tenant, tenant_error = parse_tenant(data)
+    if error or tenant_error:
+        return jsonify({'error': error or tenant_error}), 400
+
+    if not await limiter.acquire():
+        get_instrumentation().increment("requests_rejected_total")
+        return jsonify({'error': 'Too many concurrent questions, please retry later.'}), 429, {'Retry-After': '1'}
+
+    async def generate():
+        # A batch holds one slot; its own concurrency is bounded by BATCH_MAX_CONCURRENCY
+        try:
+            async with aretriever_for_tenant(tenant) as retriever:
+                async for result in retriever.aanswer_many(questions):
+                    yield format_ndjson(result).encode()
+        except Exception as e:
+            yield format_ndjson({'error': str(e)}).encode()
+
+    response = Response(SlotBody(generate(), limiter), mimetype='application/x-ndjson', headers=STREAM_HEADERS)
+    # A batch of hundreds of questions runs far longer than a single answer
+    response.timeout = None
+    return response
+
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    return jsonify(retriever_initializer.status()), 200 if retriever_initializer.ready else 503
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(get_instrumentation().render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,154 @@
+"""
+Cost of handling large SPARQL CSV results: pseudonymizing them and trimming them to the
+context budget, for the previous row-by-row code and the current columnar code.
+
+Results have the supplier template's columns and --rows rows (default 100k). In the "distinct"
+shape every row is another supplier; in the "repeated" shape --suppliers suppliers repeat, as
+in joins that return one row per supplier and related value. Peak memory is measured with
+tracemalloc on top of the result string itself.
+
+Usage: python benchmarks/bench_kg_csv.py [--rows 100000] [--suppliers 2000] [--runs 3]
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from pseudonymization import Pseudonymizer, SENSITIVE_FIELDS, RAG_NAMESPACE
+from context_assembly import ContextAssembler, kg_entities
+
+COLUMNS = ("supplierName", "supplierType", "supplierId", "address", "city", "email", "phone", "website",
+           "country", "risk")
+CHUNK_TEXTS = [
+    "Supplier_17 reported delivery delays in Germany during the last quarter.",
+    "Audits at supplier 42 and in North Korea found compliance violations.",
+]
+
+def make_result(rows, suppliers=None):
+    """
+    Builds a SPARQL CSV result. With suppliers, supplier values repeat every that many rows.
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(COLUMNS)
+    for row in range(rows):
+        key = row % suppliers if suppliers else row
+        writer.writerow((
+            f"{RAG_NAMESPACE}Supplier_{key}", ("Manufacturer", "Reseller")[key % 2], f"S{key}",
+            f"Street {key}, 1000 City", f"City {key % 300}", f"info@supplier{key}.com", f"+49 {key}",
+            f"http://supplier{key}.com", f"{RAG_NAMESPACE}Country_{key % 60}", ("High", "Medium", "Low")[key % 3]
+        ))
+    return output.getvalue()
+
+class LegacyPseudonymizer(Pseudonymizer):
+    """
+    The previous behaviour: DictReader, one pseudonymize_value call per sensitive cell, DictWriter.
+    """
+    def pseudonymize_kg_context(self, kg_context_csv):
+        pseudonymized_rows = []
+        csv_reader = csv.DictReader(StringIO(kg_context_csv))
+        for row in csv_reader:
+            for field in SENSITIVE_FIELDS:
+                row[field] = self.pseudonymize_value(field, row[field])
+            pseudonymized_rows.append(row)
+        output = StringIO()
+        csv_writer = csv.DictWriter(output, fieldnames=csv_reader.fieldnames)
+        csv_writer.writeheader()
+        csv_writer.writerows(pseudonymized_rows)
+        return output.getvalue()
+
+class LegacyContextAssembler(ContextAssembler):
+    """
+    The previous row selection: entity sets per row and one regex alternation of all entities.
+    """
+    def select_kg_rows(self, kg_context_csv, chunk_texts, budget):
+        reader = csv.reader(StringIO(kg_context_csv))
+        header = next(reader, None)
+        rows = list(reader)
+        row_entities = [kg_entities(row) for row in rows]
+        entities = set().union(*row_entities)
+        alternation = "|".join(re.escape(name) for name in sorted(entities, key=len, reverse=True))
+        mentioned = set(re.findall(rf"\b(?:{alternation})\b", "\n".join(chunk_texts).lower())) if entities else set()
+        order = sorted(range(len(rows)), key=lambda i: -len(row_entities[i] & mentioned))
+        rows = [rows[i] for i in order]
+
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(header)
+        used = self.counter.count(output.getvalue())
+        kept = 0
+        for row in rows:
+            line = StringIO()
+            csv.writer(line).writerow(row)
+            tokens = self.counter.count(line.getvalue())
+            if used + tokens > budget:
+                break
+            writer.writerow(row)
+            used += tokens
+            kept += 1
+        return output.getvalue(), used, len(rows) - kept
+
+def measure(func, runs):
+    """
+    Returns the median seconds of func() over runs, and the peak traced memory of one run in MB.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sorted(durations)[len(durations) // 2], peak / 1e6
+
+def streamed_size(result, chunk_rows):
+    """
+    Consumes the pseudonymized result piece by piece without joining it, like a writer would.
+    """
+    return sum(len(piece) for piece in Pseudonymizer().iter_pseudonymized_csv(result, chunk_rows))
+
+def main():
+    parser = argparse.ArgumentParser(description="Pseudonymization and trimming of large SPARQL CSV results.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--suppliers", type=int, default=2000, help="Distinct suppliers in the repeated shape.")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement; the median is reported.")
+    args = parser.parse_args()
+
+    # Character-based token estimates keep the trimming measurement independent of tiktoken downloads
+    legacy_assembler = LegacyContextAssembler()
+    assembler = ContextAssembler(counter=legacy_assembler.counter)
+    budget = int(assembler.token_budget * assembler.kg_share)
+
+    for shape, suppliers in (("distinct", None), ("repeated", args.suppliers)):
+        result = make_result(args.rows, suppliers)
+        print(f"\n{shape}: {args.rows} rows, {len(result) / 1e6:.1f} MB of CSV")
+        print(f"  {'step':<44}{'median ms':>10}{'peak MB':>10}")
+        cases = (
+            ("pseudonymize, row by row (previous)", lambda: LegacyPseudonymizer().pseudonymize_kg_context(result)),
+            ("pseudonymize, columnar", lambda: Pseudonymizer().pseudonymize_kg_context(result)),
+            ("pseudonymize, columnar, streamed (10k rows)", lambda: streamed_size(result, 10000)),
+            ("trim to budget, row by row (previous)",
+             lambda: legacy_assembler.select_kg_rows(result, CHUNK_TEXTS, budget)),
+            ("trim to budget, columnar", lambda: assembler.select_kg_rows(result, CHUNK_TEXTS, budget)),
+        )
+        for label, func in cases:
+            seconds, peak = measure(func, args.runs)
+            print(f"  {label:<44}{seconds * 1000:>10.0f}{peak:>10.1f}")
+
+        # Both versions must keep the rows in the same order; the current one gives up the
+        # last rows that fit to make room for the note on dropped rows
+        kept = assembler.select_kg_rows(result, CHUNK_TEXTS, budget)[0]
+        legacy_kept = legacy_assembler.select_kg_rows(result, CHUNK_TEXTS, budget)[0]
+        print(f"  same rows kept as before: {legacy_kept.startswith(kept)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Offline end-to-end benchmark of the hybrid retrieval pipeline.
+
+AI Core and HANA are replaced by the deterministic stand-ins in benchmarks/fakes.py, with
+configurable latencies, so the pipeline can be profiled without credentials. The same question
+mix is replayed through the threaded pipeline, the async pipeline and the Flask /ask and
+/ask/stream endpoints at several concurrency levels. Reported per mode and concurrency:
+throughput and p50/p95/p99 latency per stage, plus the time to the first event and the first
+answer token when streaming. A final sequential pass reports the peak Python memory allocated
+per stage.
+
+Usage: python benchmarks/bench_pipeline.py [--requests 48] [--concurrency 1,4,16] [--mode all]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOCAL_TESTING", "true")
+# Per-request stage timing lines would drown the report
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# The fakes have no proxy quota; pass LLM_REQUESTS_PER_MINUTE to measure the rate limiter
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+
+from retrieval import HybridRetriever
+from prompts import GRAPH_NAME
+from sparql_cache import SemanticQueryCache
+from instrumentation import Instrumentation, configure_logging
+from fakes import (
+    FakeChatModel, FakeEmbeddings, FakeHanaClient, NumpyVectorStore, build_fake_risk_view, synthetic_documents,
+    QUESTIONS
+)
+
+STAGES = ("embedding", "risk_view", "vector_search", "sparql_generation", "sparql_execution", "mention_lookup",
+          "final_answer", "restore", "first_event", "first_token", "total")
+
+def build_retriever(args, retriever_class=HybridRetriever, parallel=True):
+    embedding_model = FakeEmbeddings(latency=args.embedding_latency)
+    documents = synthetic_documents()
+    return retriever_class(
+        parallel=parallel,
+        embedding_model=embedding_model,
+        llm=FakeChatModel(latency={
+            "sparql": args.sparql_latency, "recovery": args.sparql_latency, "final": args.answer_latency
+        }, slow_every=args.llm_slow_every, slow_factor=args.llm_slow_factor, throttle_every=args.llm_throttle_every),
+        db=NumpyVectorStore(embedding_model, documents, latency=args.vector_latency),
+        hana_client=FakeHanaClient(latency=args.hana_latency, documents=documents),
+        # A threshold above 1 never matches, so every request generates its SPARQL
+        sparql_cache=SemanticQueryCache(threshold=0.95 if args.sparql_cache else 2.0),
+        instrumentation=Instrumentation()
+    )
+
+def run_threads(retriever, questions, concurrency):
+    def ask(question):
+        timings = {}
+        retriever.hybrid_retrieve_and_answer(question, timings=timings)
+        return timings
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(ask, questions))
+
+def run_async(retriever, questions, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def ask(question):
+            timings = {}
+            async with semaphore:
+                await retriever.ahybrid_retrieve_and_answer(question, timings=timings)
+            return timings
+
+        return await asyncio.gather(*(ask(question) for question in questions))
+
+    return asyncio.run(main())
+
+def run_api(retriever, questions, concurrency):
+    import api
+    api.retriever_initializer.set(retriever)
+
+    def ask(question):
+        start = time.perf_counter()
+        response = api.app.test_client().post("/ask", json={"question": question})
+        if response.status_code != 200:
+            raise RuntimeError(f"/ask returned {response.status_code}: {response.get_json()}")
+        return {"total": time.perf_counter() - start}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(ask, questions))
+
+def run_stream(retriever, questions, concurrency):
+    import api
+    api.retriever_initializer.set(retriever)
+
+    def ask(question):
+        start = time.perf_counter()
+        timings = {}
+        response = api.app.test_client().post("/ask/stream", json={"question": question}, buffered=False)
+        for chunk in response.iter_encoded():
+            elapsed = time.perf_counter() - start
+            timings.setdefault("first_event", elapsed)
+            if b"event: token" in chunk:
+                timings.setdefault("first_token", elapsed)
+            if b"event: error" in chunk:
+                raise RuntimeError(f"/ask/stream failed: {chunk.decode()}")
+        response.close()
+        timings["total"] = time.perf_counter() - start
+        return timings
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(ask, questions))
+
+MODES = {"threads": run_threads, "async": run_async, "api": run_api, "stream": run_stream}
+
+def report(mode, concurrency, results, elapsed):
+    print(f"\n{mode} | concurrency {concurrency} | {len(results)} requests | "
+          f"{len(results) / elapsed:.2f} req/s")
+    print(f"  {'stage':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage in STAGES:
+        values = [timings[stage] for timings in results if stage in timings]
+        if not values:
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        print(f"  {stage:<20}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+class MemoryProfilingRetriever(HybridRetriever):
+    """
+    Records the peak traced allocation of each stage. Only meaningful without parallel stages.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_memory = defaultdict(list)
+
+    def _timed(self, timings, stage, func, *args):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            return super()._timed(timings, stage, func, *args)
+        finally:
+            self.stage_memory[stage].append(tracemalloc.get_traced_memory()[1] - baseline)
+
+def profile_memory(args, questions):
+    retriever = build_retriever(args, MemoryProfilingRetriever, parallel=False)
+    tracemalloc.start()
+    try:
+        for question in questions:
+            retriever.hybrid_retrieve_and_answer(question)
+    finally:
+        tracemalloc.stop()
+    retriever.close()
+
+    print(f"\nmemory | sequential | {len(questions)} requests")
+    print(f"  {'stage':<20}{'mean KiB':>10}{'max KiB':>10}")
+    for stage in STAGES:
+        values = retriever.stage_memory.get(stage)
+        if values:
+            print(f"  {stage:<20}{np.mean(values) / 1024:>10.1f}{max(values) / 1024:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the hybrid retrieval pipeline.")
+    parser.add_argument("--requests", type=int, default=48, help="Requests per mode and concurrency level.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--mode", choices=("all",) + tuple(MODES), default="all")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--vector-latency", type=float, default=0.03)
+    parser.add_argument("--hana-latency", type=float, default=0.05)
+    parser.add_argument("--sparql-latency", type=float, default=0.8, help="Seconds per SPARQL generation call.")
+    parser.add_argument("--answer-latency", type=float, default=1.5, help="Seconds per final answer call.")
+    parser.add_argument("--llm-slow-every", type=int, default=0, help="Make every Nth LLM call slow.")
+    parser.add_argument("--llm-slow-factor", type=float, default=10.0, help="How much slower slow LLM calls are.")
+    parser.add_argument("--llm-throttle-every", type=int, default=0, help="Fail every Nth LLM call with a 429.")
+    parser.add_argument("--no-hedge", action="store_true", help="Do not hedge slow SPARQL generation calls.")
+    parser.add_argument("--sparql-cache", action="store_true", help="Enable the semantic SPARQL cache.")
+    parser.add_argument("--sparql-result-cache", action="store_true", help="Enable the SPARQL result cache.")
+    parser.add_argument("--no-sparql-templates", action="store_true",
+                        help="Generate every SPARQL query with the LLM instead of routing to templates.")
+    parser.add_argument("--risk-view", action="store_true",
+                        help="Answer risk-screening questions from a supplier risk view built beforehand.")
+    parser.add_argument("--skip-memory", action="store_true", help="Skip the sequential memory pass.")
+    args = parser.parse_args()
+    configure_logging()
+    if args.no_sparql_templates:
+        os.environ["SPARQL_TEMPLATES"] = "false"
+    if args.no_hedge:
+        os.environ["LLM_HEDGE"] = "false"
+    # Off by default: the repeated question mix would otherwise skip most SPARQL executions
+    os.environ["SPARQL_RESULT_CACHE"] = "true" if args.sparql_result_cache else "false"
+    if args.risk_view:
+        view_dir = tempfile.mkdtemp(prefix="risk_view_")
+        build_fake_risk_view(os.path.join(view_dir, GRAPH_NAME), FakeEmbeddings(latency=0), synthetic_documents())
+        os.environ["RISK_VIEW_DIR"] = view_dir
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.requests)]
+    modes = MODES if args.mode == "all" else {args.mode: MODES[args.mode]}
+
+    for mode, run in modes.items():
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            retriever = build_retriever(args)
+            start = time.perf_counter()
+            results = run(retriever, questions, concurrency)
+            report(mode, concurrency, results, time.perf_counter() - start)
+            retriever.close()
+
+    if not args.skip_memory:
+        profile_memory(args, questions[:len(QUESTIONS)])
+    if args.risk_view:
+        shutil.rmtree(view_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
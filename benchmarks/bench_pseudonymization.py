@@ -0,0 +1,87 @@
+"""
+Microbenchmark for restoring pseudonymized values in LLM responses.
+
+Compares the previous process-wide mapping, restored with one str.replace per mapping entry
+ever seen, with the request-scoped Pseudonymizer and its single-pass restore. The restore time
+per request should stay flat for the Pseudonymizer as the number of served requests grows.
+
+Usage: python benchmarks/bench_pseudonymization.py
+"""
+import csv
+import os
+import sys
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pseudonymization import Pseudonymizer, SENSITIVE_FIELDS, RAG_NAMESPACE
+
+ROWS_PER_REQUEST = 20
+CHECKPOINTS = (10, 100, 500, 1000)
+SAMPLES = 5
+
+def make_kg_context(request_id):
+    """
+    Builds a SPARQL CSV result with distinct suppliers per request, like real traffic does.
+    """
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=SENSITIVE_FIELDS + ("country", "risk"))
+    writer.writeheader()
+    for row in range(ROWS_PER_REQUEST):
+        key = f"{request_id}_{row}"
+        writer.writerow({
+            "supplierName": f"{RAG_NAMESPACE}Supplier_{key}",
+            "supplierId": f"S{key}",
+            "address": f"Street {key}",
+            "email": f"info@supplier{key}.com",
+            "phone": f"+49 {key}",
+            "website": f"http://supplier{key}.com",
+            "country": f"{RAG_NAMESPACE}Germany",
+            "risk": "Low"
+        })
+    return output.getvalue()
+
+def make_response(pseudonymized_csv):
+    """
+    Simulates an LLM answer mentioning every masked supplier name and email.
+    """
+    rows = csv.DictReader(StringIO(pseudonymized_csv))
+    return "\n".join(f"- {row['supplierName']} ({row['email']}) faces delays." for row in rows)
+
+class LegacyPseudonymizer(Pseudonymizer):
+    """
+    The previous behaviour: one mapping shared by all requests and a replace per entry.
+    """
+    def restore(self, response_text):
+        for field, mapping in self.mapping.items():
+            for original, pseudonymized in mapping.items():
+                clean_original = original.replace(RAG_NAMESPACE, "")
+                response_text = response_text.replace(pseudonymized, clean_original)
+        return response_text
+
+def run(label, make_pseudonymizer):
+    print(f"\n{label}")
+    print(f"{'requests served':>16} {'restore time per request':>26}")
+    shared = LegacyPseudonymizer()
+    served = 0
+    for checkpoint in CHECKPOINTS:
+        # Serve requests until the checkpoint so that shared state can build up
+        while served < checkpoint:
+            pseudonymizer = make_pseudonymizer(shared)
+            pseudonymizer.restore(make_response(pseudonymizer.pseudonymize_kg_context(make_kg_context(served))))
+            served += 1
+
+        durations = []
+        for sample in range(SAMPLES):
+            pseudonymizer = make_pseudonymizer(shared)
+            response = make_response(pseudonymizer.pseudonymize_kg_context(make_kg_context(f"s{sample}")))
+            start = time.perf_counter()
+            pseudonymizer.restore(response)
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        print(f"{checkpoint:>16} {durations[len(durations) // 2] * 1e6:>23.1f} us")
+
+if __name__ == "__main__":
+    run("Process-wide mapping, str.replace per entry (previous)", lambda shared: shared)
+    run("Request-scoped Pseudonymizer, single-pass regex restore", lambda shared: Pseudonymizer())
@@ -0,0 +1,125 @@
+"""
+Startup cost of a worker process: module import times, time to the first /healthz answer
+and, with --live, time until the retriever is created and warmed up.
+
+Every measurement runs in a fresh interpreter, so that nothing is imported yet. Import times
+come from `python -X importtime` (cumulative time of the module including its imports).
+--live needs the HANA and AI Core configuration in config/.
+
+Usage: python benchmarks/bench_startup.py [--runs 3] [--live]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = (
+    "numpy",
+    "hdbcli.dbapi",
+    "langchain_core.language_models",
+    "langchain.prompts",
+    "langchain_hana",
+    "gen_ai_hub.proxy.langchain.openai",
+    "ai_core_sdk.ai_core_v2_client",
+    "rdflib.plugins.sparql",
+    "tiktoken",
+    "retrieval",
+    "api",
+    "asgi",
+)
+
+HEALTHZ_SCRIPTS = {
+    "api": "import api\nprint(api.app.test_client().get('/healthz').status_code)",
+    "asgi": (
+        "import asyncio, asgi\n"
+        "async def main():\n"
+        "    return (await asgi.app.test_client().get('/healthz')).status_code\n"
+        "print(asyncio.run(main()))"
+    ),
+}
+
+LIVE_SCRIPT = """
+import json, time
+import api
+api.start_warmup()
+while api.retriever_initializer.status()["state"] not in ("ready", "failed"):
+    time.sleep(0.01)
+print(json.dumps(api.retriever_initializer.status()))
+"""
+
+def child_env():
+    env = dict(os.environ, LOCAL_TESTING="true", LOG_LEVEL="WARNING")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+def import_time(module):
+    """
+    Returns the cumulative import time of module in seconds, or the error if it cannot be imported.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        return completed.stderr.strip().splitlines()[-1]
+    for line in reversed(completed.stderr.splitlines()):
+        # "import time:   self [us] | cumulative | imported package"
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+    return "not found in -X importtime output"
+
+def wall_time(script):
+    """
+    Runs script in a fresh interpreter. Returns the wall-clock time and its last output line.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=child_env(),
+                               capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    output = (completed.stdout.strip() or completed.stderr.strip()).splitlines()
+    return elapsed, output[-1] if output else ""
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup cost of a worker process.")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement; the median is reported.")
+    parser.add_argument("--live", action="store_true", help="Also create and warm up the real retriever.")
+    args = parser.parse_args()
+
+    print("Import time (cumulative, median)")
+    for module in MODULES:
+        results = [import_time(module) for _ in range(args.runs)]
+        errors = [r for r in results if isinstance(r, str)]
+        if errors:
+            print(f"  {module:<38}unavailable: {errors[0]}")
+        else:
+            print(f"  {module:<38}{np.median(results) * 1000:>9.0f} ms")
+
+    baseline = np.median([wall_time("pass")[0] for _ in range(args.runs)])
+    print(f"\nTime to first /healthz answer, from process start (interpreter alone: {baseline * 1000:.0f} ms)")
+    for name, script in HEALTHZ_SCRIPTS.items():
+        runs = [wall_time(script) for _ in range(args.runs)]
+        status = runs[-1][1]
+        print(f"  {name:<38}{np.median([r[0] for r in runs]) * 1000:>9.0f} ms   (status {status})")
+
+    if args.live:
+        print("\nTime until ready (retriever created and warmed up)")
+        elapsed, output = wall_time(LIVE_SCRIPT)
+        try:
+            status = json.loads(output)
+        except ValueError:
+            print(f"  failed: {output}")
+            return
+        print(f"  {'total':<38}{elapsed * 1000:>9.0f} ms   (state {status['state']})")
+        if status["error"]:
+            print(f"  error: {status['error']}")
+        for step, seconds in status["timings"].items():
+            print(f"  {step:<38}{seconds * 1000:>9.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Recall@k and latency of the local IVF vector replica against exact nearest neighbours.
+
+By default the benchmark runs offline on clustered synthetic vectors, with exact results from
+a full NumPy scan (the same ranking HANA's COSINE_SIMILARITY produces). With --hana, the
+replica is synced from the real vector table and compared with exact HANA searches, using
+perturbed stored vectors as queries so that no embedding model is needed.
+
+Usage: python benchmarks/bench_vector_replica.py [--rows 20000] [--k 25] [--hana]
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_replica import VectorReplica
+
+NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+def synthetic_vectors(rows, dim, clusters, spread, seed=0):
+    """
+    Topic-clustered unit vectors; a larger spread makes the clusters overlap more.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + spread * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def perturbed_queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(vectors[rng.choice(len(vectors), size=count, replace=False)], dtype=np.float32)
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def exact_numpy(vectors, ids):
+    def search(query, k):
+        scores = vectors @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [ids[row] for row in top[np.argsort(-scores[top])]]
+    return search
+
+def exact_hana(connection, table_name):
+    def search(query, k):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f'SELECT TOP {k} JSON_VALUE("METADATA", \'$.chunk_id\'), "CONTENT" FROM "{table_name}" '
+                f'ORDER BY COSINE_SIMILARITY("VECTOR", TO_REAL_VECTOR(?)) DESC',
+                (json.dumps(query.tolist()),)
+            )
+            # Rows without a chunk id are keyed by content hash, like the replica does
+            return [chunk_id or "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+                    for chunk_id, content in cursor.fetchall()]
+        finally:
+            cursor.close()
+    return search
+
+def timed(search, queries, k):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query, k))
+        latencies.append(time.perf_counter() - start)
+    return results, np.asarray(latencies)
+
+def report(name, latencies, recall=None):
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    recall_text = f"{recall:>10.3f}" if recall is not None else f"{'exact':>10}"
+    print(f"  {name:<22}{recall_text}{p50:>10.2f}{p95:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs. latency of the local vector replica.")
+    parser.add_argument("--rows", type=int, default=20000, help="Synthetic rows (offline mode).")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500, help="Synthetic topic clusters (offline mode).")
+    parser.add_argument("--spread", type=float, default=2.0, help="Synthetic cluster spread (offline mode).")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--hana", action="store_true", help="Sync from and compare with the HANA vector table.")
+    parser.add_argument("--table", default="SUPPLIERS_EMBED_ADA_YOUR_NUMBER")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.hana:
+            from database import connect
+            connection = connect()
+            replica = VectorReplica(directory, args.table,
+                                    connection_factory=lambda: contextlib.nullcontext(connection))
+            start = time.perf_counter()
+            replica.sync()
+            print(f"Synced {len(replica._state[2])} rows from {args.table} in {time.perf_counter() - start:.1f} s")
+            exact = exact_hana(connection, args.table)
+            exact_name = "exact (HANA)"
+        else:
+            vectors = synthetic_vectors(args.rows, args.dim, args.clusters, args.spread)
+            ids = [f"chunk-{i}" for i in range(args.rows)]
+            replica = VectorReplica(directory, "synthetic")
+            start = time.perf_counter()
+            replica.rebuild(ids, [Document(page_content=i) for i in ids], vectors, version="synthetic")
+            print(f"Built replica with {args.rows} rows in {time.perf_counter() - start:.1f} s")
+            exact = exact_numpy(vectors, ids)
+            exact_name = "exact (NumPy scan)"
+
+        queries = perturbed_queries(replica._state[0], min(args.queries, len(replica._state[2])))
+        k = min(args.k, len(replica._state[2]))
+        truth, latencies = timed(exact, queries, k)
+
+        print(f"\n{len(queries)} queries, k={k}, {len(replica._state[1].centroids)} IVF cells")
+        print(f"  {'search':<22}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        report(exact_name, latencies)
+        for nprobe in NPROBES:
+            results, latencies = timed(lambda query, k: replica.search(query, k, nprobe)[0], queries, k)
+            recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)])
+            report(f"replica nprobe={nprobe}", latencies, recall)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Deterministic local stand-ins for AI Core and HANA, used by the benchmarks.
+
+- FakeEmbeddings: hash-seeded unit vectors, no network.
+- FakeChatModel: a chat model that replays canned SPARQL and answers, with configurable latency,
+  token streaming, and optional slow calls and throttling errors.
+- NumpyVectorStore: in-process cosine index standing in for HanaDB.
+- FakeHanaClient: rdflib graph loaded from sources/*.csv standing in for SPARQL_EXECUTE.
+- build_fake_risk_view: the supplier risk view of sources/*.csv and the synthetic documents.
+"""
+import asyncio
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+import numpy as np
+import rdflib
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from kge_exercise_generate_kg import iter_triples, clean_uri
+from entity_mentions import mention_triples
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUPPLIERS_CSV = os.path.join(BASE_PATH, "sources", "suppliers.csv")
+COUNTRY_STATUS_CSV = os.path.join(BASE_PATH, "sources", "country_status.csv")
+
+SELECT_ALL = """PREFIX rag: <http://sap.com/rag/>
+SELECT ?supplierName ?supplierId ?address ?email ?phone ?website ?country ?risk
+FROM <rag_suppliers_YOUR_NUMBER>
+WHERE {{
+    ?supplierName rag:locatedIn ?country .
+    ?supplierName rag:hasSupplierId ?supplierId .
+    ?supplierName rag:hasAddress ?address .
+    ?supplierName rag:hasEmail ?email .
+    ?supplierName rag:hasPhone ?phone .
+    ?supplierName rag:hasWebsite ?website .
+    ?country rag:hasGeopoliticalRisk ?risk .
+    {filter}
+}}"""
+
+# (keywords that must all appear in the question, canned SPARQL), first match wins
+CANNED_SPARQL = [
+    (("high", "risk"), SELECT_ALL.format(filter='FILTER(?risk = "High")')),
+    (("low", "risk"), SELECT_ALL.format(filter='FILTER(?risk = "Low")')),
+    (("manufacturer",), SELECT_ALL.format(
+        filter='?supplierName rag:hasSupplierType ?supplierType . FILTER(?supplierType = "Manufacturer")'
+    )),
+    (("reseller",), SELECT_ALL.format(
+        filter='?supplierName rag:hasSupplierType ?supplierType . FILTER(?supplierType = "Reseller")'
+    )),
+]
+DEFAULT_SPARQL = SELECT_ALL.format(filter="")
+
+QUESTIONS = [
+    "I want to see all suppliers that are facing financial instability and are connected to regions with high geopolitical risks. Specify what issues are observed.",
+    "Which suppliers are located in high-risk countries?",
+    "Which manufacturers have delivery delays?",
+    "List resellers and their quality issues.",
+    "Which suppliers in low risk countries report compliance problems?",
+    "What challenges do our suppliers face?",
+]
+
+ISSUES = [
+    "financial instability", "delivery delays", "quality issues",
+    "compliance violations", "capacity constraints", "logistics disruptions"
+]
+
+QUESTION_PATTERN = re.compile(r"user question:\s*'(.*?)'\s*\n", re.DOTALL)
+SUPPLIER_PLACEHOLDER_PATTERN = re.compile(r"MASKED_SUPPLIERNAME_\d+")
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings: every text maps to a fixed random unit vector seeded by its hash.
+    """
+    def __init__(self, dim=1536, latency=0.05):
+        self.dim = dim
+        self.latency = latency
+
+    def _vector(self, text):
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+def _fake_completion(prompt_text):
+    """
+    Picks the canned reply for a rendered prompt.
+    Returns the reply text and the prompt kind used to look up the latency.
+    """
+    if "caused an execution error" in prompt_text:
+        return DEFAULT_SPARQL, "recovery"
+    if "Generate a SPARQL query" in prompt_text:
+        match = QUESTION_PATTERN.search(prompt_text)
+        question = match.group(1).lower() if match else ""
+        for keywords, query in CANNED_SPARQL:
+            if all(keyword in question for keyword in keywords):
+                return query, "sparql"
+        return DEFAULT_SPARQL, "sparql"
+
+    # Final answer: mention the first few masked suppliers so that restore has work to do
+    suppliers = list(dict.fromkeys(SUPPLIER_PLACEHOLDER_PATTERN.findall(prompt_text)))[:10]
+    lines = [f"- {supplier}: issues observed according to the supplier reports." for supplier in suppliers]
+    return "\n".join(lines) or "Information not available.", "final"
+
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+class FakeRateLimitError(RuntimeError):
+    """
+    Like the proxy's 429 Too Many Requests.
+    """
+    status_code = 429
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stands in for ChatOpenAI in `prompt | llm` chains.
+
+    latency maps the prompt kind ("sparql", "recovery", "final") to the seconds a full
+    completion takes. When streamed, the first token arrives after time_to_first_token
+    seconds and the remaining time is spread evenly over the other tokens. Every
+    slow_every-th call takes slow_factor times as long, and every throttle_every-th call
+    fails with a FakeRateLimitError, to simulate a congested proxy.
+    """
+    latency: dict = {"sparql": 0.8, "recovery": 0.8, "final": 1.5}
+    time_to_first_token: float = 0.25
+    slow_every: int = 0
+    slow_factor: float = 10.0
+    throttle_every: int = 0
+    _calls: itertools.count = PrivateAttr(default_factory=lambda: itertools.count(1))
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _respond(self, messages):
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        text, kind = _fake_completion(prompt_text)
+        call = next(self._calls)
+        if self.throttle_every and call % self.throttle_every == 0:
+            raise FakeRateLimitError("429 Too Many Requests")
+        delay = self.latency[kind] * (self.slow_factor if self.slow_every and call % self.slow_every == 0 else 1)
+        usage = {
+            "input_tokens": len(prompt_text) // 4,
+            "output_tokens": len(text) // 4,
+            "total_tokens": (len(prompt_text) + len(text)) // 4
+        }
+        return text, usage, delay
+
+    def _token_delays(self, tokens, delay):
+        first = min(self.time_to_first_token, delay)
+        rest = (delay - first) / max(len(tokens) - 1, 1)
+        return [first] + [rest] * (len(tokens) - 1)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage, delay = self._respond(messages)
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage, delay = self._respond(messages)
+        await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage, delay = self._respond(messages)
+        tokens = TOKEN_PATTERN.findall(text) or [text]
+        for i, (token, pause) in enumerate(zip(tokens, self._token_delays(tokens, delay))):
+            time.sleep(pause)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=token, usage_metadata=usage if i == len(tokens) - 1 else None
+            ))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage, delay = self._respond(messages)
+        tokens = TOKEN_PATTERN.findall(text) or [text]
+        for i, (token, pause) in enumerate(zip(tokens, self._token_delays(tokens, delay))):
+            await asyncio.sleep(pause)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=token, usage_metadata=usage if i == len(tokens) - 1 else None
+            ))
+
+def synthetic_documents(chunks_per_supplier=3):
+    """
+    Builds deterministic supplier report chunks from sources/suppliers.csv.
+    """
+    import pandas as pd
+    suppliers = pd.read_csv(SUPPLIERS_CSV, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    documents = []
+    for row in suppliers.itertuples(index=False):
+        for chunk in range(chunks_per_supplier):
+            issue = ISSUES[_seed(f"{row.SUPPLIER_NAME}{chunk}") % len(ISSUES)]
+            text = (
+                f"Supplier {row.SUPPLIER_NAME} ({row.SUPPLIER_TYPE}, {row.SUPPLIER_CITY}, {row.SUPPLIER_COUNTRY}) "
+                f"performance review part {chunk + 1}: {issue} were observed during the last quarter. "
+                f"The account team recommends closer monitoring of {clean_uri(row.SUPPLIER_NAME)}."
+            )
+            documents.append(Document(
+                page_content=text,
+                metadata={"source": "synthetic", "page": chunk, "supplier": row.SUPPLIER_NAME,
+                          "chunk_id": f"synthetic-{len(documents)}",
+                          "suppliers": [clean_uri(row.SUPPLIER_NAME)],
+                          "countries": [clean_uri(row.SUPPLIER_COUNTRY)] if row.SUPPLIER_COUNTRY else []}
+            ))
+    return documents
+
+class NumpyVectorStore:
+    """
+    In-process cosine similarity index with the HanaDB search interface used by the retriever.
+    """
+    def __init__(self, embedding, documents, latency=0.03):
+        self.embedding = embedding
+        self.documents = list(documents)
+        self.latency = latency
+        matrix = np.asarray(embedding.embed_documents([d.page_content for d in self.documents]), dtype=np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        time.sleep(self.latency)
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = self.matrix @ (query / np.linalg.norm(query))
+        if filter:
+            # Only the chunk_id $in filter used by the mention lookup
+            chunk_ids = set(filter["chunk_id"]["$in"])
+            allowed = np.array([d.metadata.get("chunk_id") in chunk_ids for d in self.documents])
+            scores = np.where(allowed, scores, -np.inf)
+            k = min(k, int(allowed.sum()))
+        top = np.argsort(-scores)[:k]
+        return [self.documents[i] for i in top]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k=k, filter=filter)
+
+class FakeHanaClient:
+    """
+    Answers SPARQL_EXECUTE calls from an rdflib graph holding the same triples that
+    kge_exercise_generate_kg.py loads into HANA, plus the rag:mentionedIn triples of the
+    given documents. Results are returned as CSV, like HANA does.
+    """
+    FROM_PATTERN = re.compile(r"^\s*FROM\s+<[^>]*>\s*$", re.MULTILINE | re.IGNORECASE)
+
+    def __init__(self, latency=0.05, documents=()):
+        self.latency = latency
+        self.graph = rdflib.Graph()
+        turtle = "@prefix rag: <http://sap.com/rag/> .\n" + "\n".join(
+            list(iter_triples(SUPPLIERS_CSV, COUNTRY_STATUS_CSV)) + list(mention_triples(documents))
+        )
+        self.graph.parse(data=turtle, format="turtle")
+        self._lock = threading.Lock()
+
+    def execute_raw_sparql(self, sparql_query):
+        time.sleep(self.latency)
+        # All triples live in the default graph of the local store
+        query = self.FROM_PATTERN.sub("", sparql_query)
+        try:
+            with self._lock:
+                result = self.graph.query(query)
+                csv_text = result.serialize(format="csv").decode("utf-8")
+        except Exception as e:
+            raise RuntimeError(f"SPARQL_EXECUTE failed: {e}")
+        return csv_text.replace("\r\n", "\n"), "{}"
+
+    def close(self):
+        pass
+
+def build_fake_risk_view(directory, embedding, documents):
+    """
+    Writes the supplier risk view that kge_exercise_build_risk_view.py would build from
+    sources/*.csv and the given documents, for a graph without a version stamp.
+    """
+    from kge_exercise_build_risk_view import build_profiles
+    from risk_view import write_risk_view
+
+    chunks_by_supplier = {}
+    for document in documents:
+        for supplier in document.metadata.get("suppliers", []):
+            chunks_by_supplier.setdefault(supplier, []).append(document.metadata["chunk_id"])
+    profiles = [{"row": row, "chunks": chunks_by_supplier.get(name, [])}
+                for name, row in build_profiles(SUPPLIERS_CSV, COUNTRY_STATUS_CSV).items()]
+    chunk_ids = [document.metadata["chunk_id"] for document in documents]
+    vectors = embedding.embed_documents([document.page_content for document in documents])
+    write_risk_view(directory, profiles, chunk_ids, documents, vectors, {"graph_version": ""})
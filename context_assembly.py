@@ -0,0 +1,280 @@
+import csv
+import logging
+import re
+from io import StringIO
+from pseudonymization import iter_lines
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+WORD_PATTERN = re.compile(r"\w+")
+# KG rows are masked this many at a time while they are selected; the rows past the budget
+# are mostly left alone
+MASK_CHUNK_ROWS = 256
+
+class TokenCounter:
+    """
+    Counts prompt tokens locally with tiktoken, or estimates them (~4 characters per token)
+    if tiktoken is not installed or its encoding files cannot be loaded.
+    """
+    def __init__(self, model="gpt-4o"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # tiktoken downloads encodings on first use, which fails without network access
+                logger.warning("Could not load tiktoken encoding, estimating token counts instead: %s", e)
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+def kg_entities(row):
+    """
+    Returns the lowercase names of the rag: entities in a SPARQL result row,
+    both with underscores (IRI form) and with spaces (text form).
+    """
+    names = set()
+    for value in row:
+        if value.startswith(RAG_NAMESPACE):
+            name = value[len(RAG_NAMESPACE):].lower()
+            names.add(name)
+            names.add(name.replace("_", " "))
+    return names
+
+def csv_line(row):
+    """
+    Formats one row as a CSV line, line break included.
+    """
+    line = StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue()
+
+def omitted_rows_note(count):
+    """
+    Returns the note appended to the KG context when count rows did not fit, or "".
+    """
+    return f"\n({count} more rows omitted)" if count else ""
+
+def mention_pattern(entities):
+    """
+    Compiles a pattern matching any of the entity names as a whole word, or returns None.
+    """
+    if not entities:
+        return None
+    # Longest names first, so "north korea" wins over "north"
+    alternation = "|".join(re.escape(name) for name in sorted(entities, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternation})\b")
+
+def find_mentions(entities, text, pattern=None):
+    """
+    Returns the entities that occur in the lowercase text as whole words.
+    Pass the mention_pattern of the entities to avoid compiling it again.
+    """
+    pattern = pattern or mention_pattern(entities)
+    return set(pattern.findall(text)) if pattern is not None else set()
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings of the same items into one score per item: the sum of
+    1 / (k + rank) over the rankings that contain it, with ranks starting at 1.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return scores
+
+class ContextAssembler:
+    """
+    Fits the final-answer context into a fixed token budget.
+
+    KG rows get up to kg_share of the budget. Rows about entities that the vector chunks also
+    mention come first, and rows that do not fit are dropped. Vector chunks get the rest of the
+    budget. Their vector search order and their order by KG entity mentions are fused with
+    reciprocal-rank fusion. If at least min_entity_chunks chunks mention a KG entity, chunks
+    that mention none are left out. The rest are deduplicated and added in fused order until
+    max_chunks are selected or the budget is used up.
+    """
+    def __init__(self, token_budget=6000, kg_share=0.6, duplicate_threshold=0.8, counter=None,
+                 max_chunks=8, min_entity_chunks=3, rrf_k=60):
+        self.token_budget = token_budget
+        self.kg_share = kg_share
+        self.duplicate_threshold = duplicate_threshold
+        self.counter = counter or TokenCounter()
+        self.max_chunks = max_chunks
+        self.min_entity_chunks = min_entity_chunks
+        self.rrf_k = rrf_k
+
+    def _is_duplicate(self, words, selected_words):
+        for other in selected_words:
+            union = len(words | other)
+            if union and len(words & other) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    def select_kg_rows(self, kg_context_csv, chunk_texts, budget, pseudonymizer=None):
+        """
+        Returns the KG CSV trimmed to the budget, the tokens it uses, the number of dropped rows
+        and the rag: entities of the kept rows.
+
+        With a pseudonymizer, the sensitive columns of the returned CSV are masked, and tokens
+        are counted on the masked rows that the LLM receives. Rows are masked column by column
+        in chunks as the selection goes, so a large result is not masked beyond the budget.
+        The note on dropped rows (see omitted_rows_note) counts towards the budget too; rows
+        are given up to make room for it.
+        """
+        if not kg_context_csv:
+            return "", 0, 0, set()
+        reader = csv.reader(iter_lines(kg_context_csv))
+        header = next(reader, None)
+        if header is None:
+            return "", 0, 0, set()
+        rows = [row for row in reader if row]
+
+        # Rows whose entities also appear in the documents are the most useful to the LLM
+        order = self._order_by_mentions(rows, "\n".join(chunk_texts))
+        if order is not None:
+            rows = [rows[i] for i in order]
+
+        header_line = csv_line(header)
+        used = self.counter.count(header_line)
+        lines, line_tokens = [], []
+        if pseudonymizer is not None:
+            masked_rows = pseudonymizer.iter_pseudonymized_rows(header, rows, MASK_CHUNK_ROWS)
+        else:
+            masked_rows = rows
+        for row in masked_rows:
+            line = csv_line(row)
+            tokens = self.counter.count(line)
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            line_tokens.append(tokens)
+            used += tokens
+        while len(lines) < len(rows):
+            note_tokens = self.counter.count(omitted_rows_note(len(rows) - len(lines)))
+            if used + note_tokens <= budget or not lines:
+                used += note_tokens
+                break
+            lines.pop()
+            used -= line_tokens.pop()
+
+        entities = set()
+        for row in rows[:len(lines)]:
+            entities |= kg_entities(row)
+        return header_line + "".join(lines), used, len(rows) - len(lines), entities
+
+    @staticmethod
+    def _order_by_mentions(rows, text):
+        """
+        Returns the row positions ordered by the number of their rag: entities that the text
+        mentions (ties keep the result order), or None if it mentions none of them.
+
+        Works column by column, so each distinct entity is checked once however many rows
+        repeat it. The check is a set lookup in the word n-grams of the text, which is short
+        compared to a large result.
+        """
+        if len(set(map(len, rows))) == 1:
+            columns = list(zip(*rows))
+        else:
+            # Ragged rows: build the columns with empty values for the missing cells
+            columns = [[row[j] if j < len(row) else "" for row in rows] for j in range(max(map(len, rows), default=0))]
+        names = {}
+        for column in columns:
+            for value in dict.fromkeys(column):
+                if value.startswith(RAG_NAMESPACE):
+                    names.setdefault(value[len(RAG_NAMESPACE):].lower(), value)
+        if not names:
+            return None
+
+        # IRI names are words joined by underscores; the text may use underscores or spaces
+        words = WORD_PATTERN.findall(text.lower())
+        longest = max(name.count("_") for name in names) + 1
+        grams = {" ".join(words[i:i + n]) for n in range(1, longest + 1) for i in range(len(words) - n + 1)}
+        mentioned = {value for name, value in names.items() if name in grams or name.replace("_", " ") in grams}
+        if not mentioned:
+            return None
+        scores = [0] * len(rows)
+        for column in columns:
+            if not mentioned.isdisjoint(column):
+                scores = [score + (value in mentioned) for score, value in zip(scores, column)]
+        return sorted(range(len(rows)), key=lambda i: -scores[i])
+
+    @staticmethod
+    def _chunk_mentions(doc, entities, pattern):
+        """
+        Returns the entities the chunk mentions, from its ingest-time mention metadata if it has
+        any, otherwise by matching its text.
+        """
+        indexed = doc.metadata.get("suppliers"), doc.metadata.get("countries")
+        if indexed[0] is None and indexed[1] is None:
+            return find_mentions(entities, doc.page_content.lower(), pattern)
+        return {name.lower() for names in indexed for name in names or ()} & entities
+
+    def rank_chunks(self, vector_context, entities):
+        """
+        Returns the positions of the chunks in fused order, leaving out chunks without KG
+        entity mentions if enough chunks have some.
+        """
+        pattern = mention_pattern(entities)
+        mentions = [len(self._chunk_mentions(doc, entities, pattern)) for doc in vector_context]
+        vector_ranking = range(len(vector_context))
+        # Most mentions first; ties keep the vector search order
+        entity_ranking = sorted((i for i in vector_ranking if mentions[i]), key=lambda i: -mentions[i])
+
+        scores = reciprocal_rank_fusion([vector_ranking, entity_ranking], k=self.rrf_k)
+        candidates = entity_ranking if len(entity_ranking) >= self.min_entity_chunks else vector_ranking
+        return sorted(candidates, key=lambda i: (-scores[i], i))
+
+    def select_chunks(self, vector_context, entities, budget):
+        """
+        Returns the deduplicated, ranked chunks that fit into the budget and the tokens they use.
+        """
+        selected, selected_words, used = [], [], 0
+        for i in self.rank_chunks(vector_context, entities):
+            if len(selected) >= self.max_chunks:
+                break
+            doc = vector_context[i]
+            words = set(WORD_PATTERN.findall(doc.page_content.lower()))
+            if self._is_duplicate(words, selected_words):
+                continue
+            tokens = self.counter.count(doc.page_content)
+            if used + tokens > budget:
+                continue
+            selected.append(doc)
+            selected_words.append(words)
+            used += tokens
+        return selected, used
+
+    def assemble(self, vector_context, kg_context_csv, pseudonymizer=None):
+        """
+        Returns the selected vector chunks, the KG text and statistics about the selection.
+        The KG text is the trimmed CSV, masked with the pseudonymizer if one is given, followed
+        by the note on dropped rows.
+        """
+        chunk_texts = [doc.page_content for doc in vector_context]
+        kg_csv, kg_tokens, dropped_rows, entities = self.select_kg_rows(
+            kg_context_csv, chunk_texts, int(self.token_budget * self.kg_share), pseudonymizer
+        )
+        chunks, chunk_tokens = self.select_chunks(vector_context, entities, self.token_budget - kg_tokens)
+
+        stats = {
+            "kg_tokens": kg_tokens,
+            "kg_rows_dropped": dropped_rows,
+            "vector_tokens": chunk_tokens,
+            "vector_chunks": len(chunks),
+            "vector_chunks_dropped": len(vector_context) - len(chunks)
+        }
+        return chunks, kg_csv + omitted_rows_note(dropped_rows), stats
@@ -1,40 +1,235 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
 from hdbcli import dbapi
 from config import load_hana_config
+from instrumentation import log_payload
+
+logger = logging.getLogger(__name__)
 
 hana_env = load_hana_config()
 
-class HanaClient:
-    def __init__(self):
-        self.connection = dbapi.connect(
-            address=hana_env['url'],
-            port=hana_env['port'],
-            user=hana_env['user'],
-            password=hana_env['pwd']
+def connect():
+    """
+    Opens a new dbapi connection using the HANA configuration.
+    """
+    return dbapi.connect(
+        address=hana_env['url'],
+        port=hana_env['port'],
+        user=hana_env['user'],
+        password=hana_env['pwd']
+    )
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+class HanaConnectionPool:
+    """
+    Thread-safe pool of HANA connections.
+
+    Connections are opened lazily up to max_size, kept open between requests and
+    health-checked before being handed out again after idling.
+    """
+    def __init__(self, min_size=None, max_size=None, checkout_timeout=None, health_check_interval=None):
+        self.min_size = int(min_size if min_size is not None else hana_env.get('pool_min_size', 1))
+        self.max_size = int(max_size if max_size is not None else hana_env.get('pool_max_size', 8))
+        self.checkout_timeout = float(
+            checkout_timeout if checkout_timeout is not None else hana_env.get('pool_checkout_timeout', 30)
+        )
+        # Connections idle for longer than this are pinged before reuse
+        self.health_check_interval = float(
+            health_check_interval if health_check_interval is not None
+            else hana_env.get('pool_health_check_interval', 60)
         )
-        self.cursor = self.connection.cursor()
+        if self.min_size > self.max_size:
+            raise ValueError("pool_min_size must not exceed pool_max_size")
+
+        self._condition = threading.Condition()
+        self._idle = []  # list of (connection, last_used) tuples
+        self._size = 0
+        self._closed = False
+
+        for _ in range(self.min_size):
+            self._idle.append((connect(), time.monotonic()))
+            self._size += 1
+
+    def _is_healthy(self, connection):
+        """
+        Checks that a connection is still usable.
+        """
+        try:
+            if not connection.isconnected():
+                return False
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM DUMMY")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a connection, waiting up to timeout seconds for one to become free.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout}s waiting for a HANA connection (max_size={self.max_size})"
+                    )
+                self._condition.wait(remaining)
+
+        try:
+            if connection is None:
+                return connect()
+            if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(connection):
+                logger.warning("Replacing stale HANA connection")
+                self._discard(connection)
+                return connect()
+            return connection
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        Returns a connection to the pool. Broken connections are discarded instead.
+        """
+        if not discard and not connection.isconnected():
+            discard = True
+        with self._condition:
+            if discard or self._closed:
+                self._size -= 1
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that checks out a connection and returns it afterwards.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except dbapi.Error:
+            # Let the pool verify the connection before it is reused
+            self.release(connection, discard=not self._is_healthy(connection))
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    @contextmanager
+    def cursor(self, timeout=None):
+        """
+        Context manager yielding a fresh cursor on a pooled connection.
+        """
+        with self.connection(timeout) as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close(self):
+        """
+        Closes all idle connections. Checked-out connections are closed when released.
+        """
+        with self._condition:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._size -= 1
+                self._discard(connection)
+            self._idle = []
+            self._condition.notify_all()
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = HanaConnectionPool()
+        return _shared_pool
+
+class HanaClient:
+    def __init__(self, pool=None):
+        # Without a pool the client owns a single dedicated connection,
+        # which is what the one-off loader scripts expect.
+        self.pool = pool
+        self.connection = connect() if pool is None else None
+
+    @contextmanager
+    def cursor(self):
+        """
+        Yields a cursor that is only used for the duration of one call.
+        """
+        if self.pool is not None:
+            with self.pool.cursor() as cursor:
+                yield cursor
+        else:
+            cursor = self.connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
 
     def execute_raw_sparql(self, sparql_query):
 
-        print("Generated SPARQL Query:\n", sparql_query)  # optional debug
+        log_payload(logger, "Generated SPARQL Query:\n%s", sparql_query)
 
         try:
-            resp = self.cursor.callproc('SPARQL_EXECUTE', (
-                sparql_query,
-                'Accept: application/sparql-results+csv',
-                '?',
-                None
-            ))
+            with self.cursor() as cursor:
+                resp = cursor.callproc('SPARQL_EXECUTE', (
+                    sparql_query,
+                    'Accept: application/sparql-results+csv',
+                    '?',
+                    None
+                ))
             metadata = resp[3]
             results = resp[2]
-            
-            # Print results
-            print("Query Response:", results)
-            print("Response Metadata:", metadata)
+
+            log_payload(logger, "Query Response: %s\nResponse Metadata: %s", results, metadata)
 
             return results, metadata
         except Exception as e:
             raise RuntimeError(f"SPARQL_EXECUTE failed: {e}")
 
     def close(self):
+        # Pooled connections are owned by the pool and stay open for reuse
         if self.connection:
             self.connection.close()
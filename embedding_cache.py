@@ -0,0 +1,233 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from instrumentation import get_instrumentation
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk embedding store.
+
+    Vectors live in a memory-mapped float32 file (one row per key) and keys in a
+    line-oriented index file, where line i names row i. Appends take an exclusive
+    file lock, so several worker processes can share one directory. A writer that died
+    between writing vectors and keys leaves rows without a key (or a partial key line);
+    the next writer cuts both files back to the complete keys before appending.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, ".lock")
+
+        self._lock = threading.Lock()
+        self._index = {}
+        self._rows = 0
+        self._keys_offset = 0
+        self._matrix = None
+        self.dim = None
+        self._refresh()
+
+    def _refresh(self):
+        """
+        Picks up rows appended since the last refresh, possibly by another process.
+        """
+        if self.dim is None:
+            # Another process may have written the first rows since this store was opened
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        # Ignore a trailing partial line from a concurrent writer
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return
+        for line in data.decode().splitlines():
+            self._index[line] = self._rows
+            self._rows += 1
+        self._keys_offset += len(data)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+
+    def get(self, key):
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self._refresh()
+                row = self._index.get(key)
+            if row is None:
+                return None
+            return self._matrix[row].tolist()
+
+    def put_many(self, items):
+        """
+        Appends (key, vector) pairs that are not yet stored.
+        """
+        if not items:
+            return
+        with self._lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if self.dim is None:
+                    self.dim = len(items[0][1])
+                    with open(self.meta_path, "w") as f:
+                        json.dump({"dim": self.dim}, f)
+
+                new_items = OrderedDict((k, v) for k, v in items if k not in self._index)
+                if not new_items:
+                    return
+                vectors = np.asarray(list(new_items.values()), dtype=np.float32)
+                # Drop what a crashed writer left behind, so that line i keeps naming row i
+                self._truncate(self.keys_path, self._keys_offset)
+                self._truncate(self.vectors_path, self._rows * self.dim * 4)
+                # Vectors are written before keys, so a key is never visible without its row
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.keys_path, "a") as f:
+                    f.write("".join(f"{key}\n" for key in new_items))
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in Embeddings wrapper that caches vectors by a hash of the model name and text.
+
+    Lookups go to an in-memory LRU tier first and then to an optional DiskEmbeddingStore,
+    so only texts that were never embedded before reach the wrapped model.
+    """
+    def __init__(self, embedding, model_name="text-embedding-ada-002", max_memory_entries=10000, cache_dir=None):
+        self.embedding = embedding
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.disk = DiskEmbeddingStore(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, kind, text):
+        # Query and document embeddings may differ for some models, so keep them apart
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode()).hexdigest()
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+            return vector
+        return None
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _split(self, kind, texts):
+        """
+        Returns the cache keys, the cached vectors (None for misses) and the distinct missing texts.
+        """
+        keys = [self._key(kind, text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        missing = OrderedDict()
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing[key] = text
+        hits = len(texts) - sum(vector is None for vector in vectors)
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += hits
+        instrumentation = get_instrumentation()
+        instrumentation.increment("cache_requests_total", hits, cache="embedding", result="hit")
+        instrumentation.increment("cache_requests_total", len(missing), cache="embedding", result="miss")
+        return keys, vectors, missing
+
+    def _store(self, missing_keys, new_vectors):
+        for key, vector in zip(missing_keys, new_vectors):
+            self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.put_many(list(zip(missing_keys, new_vectors)))
+        return dict(zip(missing_keys, new_vectors))
+
+    def embed_documents(self, texts):
+        keys, vectors, missing = self._split("document", texts)
+        if missing:
+            computed = self._store(list(missing), self.embedding.embed_documents(list(missing.values())))
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        (key,), (vector,), missing = self._split("query", [text])
+        if vector is None:
+            vector = self._store([key], [self.embedding.embed_query(text)])[key]
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        Embeds several questions with one call to the wrapped model for all cache misses.
+        Vectors are cached as query embeddings, so embed_query finds them later.
+        """
+        keys, vectors, missing = self._split("query", texts)
+        if missing:
+            # ada-002 embeds queries and documents alike, and only the document call is batched
+            computed = self._store(list(missing), self.embedding.embed_documents(list(missing.values())))
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    async def _asplit(self, kind, texts):
+        # The disk tier reads and writes files, which must not block the event loop
+        if self.disk is None:
+            return self._split(kind, texts)
+        return await asyncio.to_thread(self._split, kind, texts)
+
+    async def _astore(self, missing_keys, new_vectors):
+        if self.disk is None:
+            return self._store(missing_keys, new_vectors)
+        return await asyncio.to_thread(self._store, missing_keys, new_vectors)
+
+    async def aembed_documents(self, texts):
+        keys, vectors, missing = await self._asplit("document", texts)
+        if missing:
+            new_vectors = await self.embedding.aembed_documents(list(missing.values()))
+            computed = await self._astore(list(missing), new_vectors)
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    async def aembed_query(self, text):
+        (key,), (vector,), missing = await self._asplit("query", [text])
+        if vector is None:
+            vector = (await self._astore([key], [await self.embedding.aembed_query(text)]))[key]
+        return vector
+
+    async def aembed_queries(self, texts):
+        keys, vectors, missing = await self._asplit("query", texts)
+        if missing:
+            new_vectors = await self.embedding.aembed_documents(list(missing.values()))
+            computed = await self._astore(list(missing), new_vectors)
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
@@ -0,0 +1,115 @@
+import csv
+import re
+from io import StringIO
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+CHUNK_NAMESPACE = f"{RAG_NAMESPACE}chunk/"
+WORD_PATTERN = re.compile(r"\w+")
+# Entity names as produced by clean_uri, matched with fullmatch (a "$" anchor would accept a
+# trailing newline); anything else is never put into a query
+ENTITY_NAME_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+MENTION_QUERY = """PREFIX rag: <http://sap.com/rag/>
+SELECT ?chunk (COUNT(?entity) AS ?mentions)
+FROM <{graph_name}>
+WHERE {{
+    VALUES ?entity {{ {entities} }}
+    ?entity rag:mentionedIn ?chunk .
+}}
+GROUP BY ?chunk
+ORDER BY DESC(?mentions)
+LIMIT {limit}"""
+
+def mentions_graph(graph_name):
+    """
+    Name of the graph holding the rag:mentionedIn triples of a KG. It is kept apart from the
+    KG itself, so that reloading the KG and re-ingesting the PDFs do not undo each other.
+    """
+    return f"{graph_name}_mentions"
+
+def chunk_iri(chunk_id):
+    return f"<{CHUNK_NAMESPACE}{chunk_id}>"
+
+class MentionMatcher:
+    """
+    Finds known entity names in a text as whole words, case-insensitively, in one pass.
+
+    Names are split into words and looked up as word n-grams in a dict, so the cost grows
+    with the length of the text rather than with the number of names. The longest name
+    starting at a word wins, e.g. "North Korea" over "North". aliases maps every spelling
+    to be matched (e.g. "Müller GmbH" and "Mller_GmbH") to the name it stands for.
+    """
+    def __init__(self, aliases):
+        self.by_words = {}
+        for alias, name in aliases.items():
+            words = tuple(WORD_PATTERN.findall(alias.lower()))
+            if words:
+                self.by_words.setdefault(words, name)
+        self.first_words = {words[0] for words in self.by_words}
+        self.max_words = max((len(words) for words in self.by_words), default=0)
+
+    def find(self, text):
+        """
+        Returns the names mentioned in the text, in order of first appearance.
+        """
+        words = WORD_PATTERN.findall(text.lower())
+        found = {}
+        i = 0
+        while i < len(words):
+            if words[i] in self.first_words:
+                for n in range(min(self.max_words, len(words) - i), 0, -1):
+                    name = self.by_words.get(tuple(words[i:i + n]))
+                    if name is not None:
+                        found.setdefault(name, None)
+                        i += n
+                        break
+                else:
+                    i += 1
+            else:
+                i += 1
+        return list(found)
+
+def mention_triples(chunks):
+    """
+    Yields one rag:mentionedIn triple line per entity in the "suppliers" and "countries"
+    metadata of each chunk.
+    """
+    for chunk in chunks:
+        chunk_id = chunk.metadata["chunk_id"]
+        for name in chunk.metadata.get("suppliers", []) + chunk.metadata.get("countries", []):
+            yield f"rag:{name} rag:mentionedIn {chunk_iri(chunk_id)} ."
+
+def kg_entity_names(kg_context_csv, limit=50):
+    """
+    Returns the local names of the rag: entities in a SPARQL CSV result, in order of
+    appearance, at most limit of them.
+    """
+    names = {}
+    for row in csv.reader(StringIO(kg_context_csv or "")):
+        for value in row:
+            if value.startswith(RAG_NAMESPACE):
+                name = value[len(RAG_NAMESPACE):]
+                if ENTITY_NAME_PATTERN.fullmatch(name):
+                    names.setdefault(name, None)
+                    if len(names) >= limit:
+                        return list(names)
+    return list(names)
+
+def find_mentioned_chunks(client, entities, graph_name, limit=200):
+    """
+    Returns the ids of the chunks that mention any of the entities, most mentions first.
+    """
+    entities = [name for name in entities if ENTITY_NAME_PATTERN.fullmatch(name)]
+    if not entities:
+        return []
+    results = client.execute_raw_sparql(MENTION_QUERY.format(
+        graph_name=mentions_graph(graph_name),
+        entities=" ".join(f"rag:{name}" for name in entities),
+        limit=int(limit)
+    ))[0]
+    chunk_ids = []
+    for row in csv.DictReader(StringIO(results)):
+        chunk = row.get("chunk", "")
+        if chunk.startswith(CHUNK_NAMESPACE):
+            chunk_ids.append(chunk[len(CHUNK_NAMESPACE):])
+    return chunk_ids
@@ -0,0 +1,30 @@
+import os
+
+# SERVING_MODE=async serves asgi:app on uvicorn workers (one event loop per worker),
+# SERVING_MODE=sync serves the Flask api:app on threaded workers.
+serving_mode = os.environ.get('SERVING_MODE', 'async')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+
+# Each worker holds its own retriever and connection pool; two fit into a 512MB instance
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+if serving_mode == 'async':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'api:app'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 16))
+
+# A question takes several seconds of LLM and database I/O
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+def post_worker_init(worker):
+    # Start creating the retriever as soon as a sync worker runs; the async app does
+    # the same in its before_serving hook
+    if serving_mode == 'sync':
+        import api
+        api.start_warmup()
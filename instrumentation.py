@@ -0,0 +1,131 @@
+import logging
+import os
+import random
+import threading
+
+# Latency buckets in seconds, used unless a histogram has its own buckets below
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+HISTOGRAM_BUCKETS = {
+    "sparql_result_rows": (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000),
+    "prompt_tokens": (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+    "llm_queue_depth": (0, 1, 2, 5, 10, 20, 50, 100, 200),
+}
+
+# Fraction of requests whose full payloads (queries, results, prompts) are logged at DEBUG level
+PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', 0.01))
+
+def configure_logging():
+    """
+    Sets up leveled logging for the service; LOG_LEVEL defaults to INFO.
+    """
+    logging.basicConfig(
+        level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+    )
+
+def log_payload(logger, message, *args):
+    """
+    Logs a large payload at DEBUG level, for a sample of calls only.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_SAMPLE_RATE:
+        logger.debug(message, *args)
+
+class Instrumentation:
+    """
+    Interface for recording pipeline metrics. This base class discards everything.
+    """
+    def observe(self, name, value, **labels):
+        """
+        Records a value in a histogram, e.g. a stage duration in seconds.
+        """
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds value to a counter, e.g. tokens or cache hits.
+        """
+
+    def render(self):
+        """
+        Returns the metrics in Prometheus text exposition format.
+        """
+        return ""
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Thread-safe in-process counters and histograms, rendered in Prometheus text format.
+    Every worker process keeps its own metrics.
+    """
+    def __init__(self, namespace="hybrid_retriever"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in pairs
+        )
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for (other, labels), value in sorted(counters.items()):
+                if other == name:
+                    lines.append(f"{metric}{self._format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{self.namespace}_{name}"
+            buckets = HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)
+            lines.append(f"# TYPE {metric} histogram")
+            for (other, labels), (counts, total, count) in sorted(histograms.items()):
+                if other != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{metric}_bucket{self._format_labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{metric}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{metric}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{metric}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+_instrumentation = PrometheusInstrumentation()
+
+def get_instrumentation():
+    return _instrumentation
+
+def set_instrumentation(instrumentation):
+    """
+    Replaces the process-wide instrumentation, e.g. with a no-op Instrumentation()
+    or an adapter to another metrics backend.
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
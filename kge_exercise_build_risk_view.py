@@ -0,0 +1,180 @@
+import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import time
+from langchain_core.documents import Document
+from database import HanaClient
+from kge_exercise_generate_kg import GRAPH_NAME, clean_uri
+from risk_view import read_risk_view, write_risk_view
+from sparql_result_cache import read_graph_version
+from tenants import tenant_names
+from vector_replica import parse_vector
+
+HANA_TABLE = "SUPPLIERS_EMBED_ADA_YOUR_NUMBER"
+RAG_NAMESPACE = "http://sap.com/rag/"
+RISK_VIEW_DIR = os.path.join(".cache", "risk_view")
+
+def file_digest(path):
+    """
+    SHA-256 of a file's contents, used to detect changed source CSVs.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def build_profiles(suppliers_path, country_status_path):
+    """
+    Returns the profile row of every supplier, keyed by its IRI name, with the values the
+    supplier SPARQL template returns for it: IRIs for the supplier and its country, and an
+    empty risk for countries without a status. Like the KG loader, the first row of a
+    supplier wins over later ones with the same name.
+    """
+    country_status = pd.read_csv(country_status_path, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    country_risk_map = dict(zip(country_status["COUNTRY"], country_status["RISK"]))
+    suppliers = pd.read_csv(suppliers_path, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+    profiles = {}
+    for row in suppliers.itertuples(index=False):
+        supplier_name = clean_uri(row.SUPPLIER_NAME)
+        country = clean_uri(row.SUPPLIER_COUNTRY)
+        if not supplier_name or supplier_name in profiles:
+            continue
+        profiles[supplier_name] = [
+            f"{RAG_NAMESPACE}{supplier_name}", row.SUPPLIER_TYPE, row.SUPPLIER_ID, row.SUPPLIER_ADDRESS,
+            row.SUPPLIER_CITY, row.SUPPLIER_EMAIL, row.SUPPLIER_PHONE, row.SUPPLIER_WEBSITE,
+            f"{RAG_NAMESPACE}{country}" if country else "", country_risk_map.get(row.SUPPLIER_COUNTRY, "")
+        ]
+    return profiles
+
+def fetch_chunk_mentions(connection, table_name):
+    """
+    Returns chunk id -> supplier names mentioned, for every chunk of the vector table that
+    mentions a supplier (see the mention indexing in kge_exercise_insert_embeddings.py).
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f'SELECT JSON_VALUE("METADATA", \'$.chunk_id\'), "METADATA" FROM "{table_name}" '
+            f'WHERE JSON_VALUE("METADATA", \'$.chunk_id\') IS NOT NULL'
+        )
+        mentions = {}
+        for chunk_id, metadata in cursor.fetchall():
+            suppliers = json.loads(metadata).get("suppliers") or []
+            if suppliers:
+                mentions[chunk_id] = suppliers
+        return mentions
+    finally:
+        cursor.close()
+
+def fetch_chunks(connection, table_name, chunk_ids, batch_size=500):
+    """
+    Returns chunk id -> (document, embedding) for the given chunks of the vector table.
+    """
+    chunks = {}
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            cursor.execute(
+                f'SELECT JSON_VALUE("METADATA", \'$.chunk_id\'), "CONTENT", "METADATA", "VECTOR" '
+                f'FROM "{table_name}" WHERE JSON_VALUE("METADATA", \'$.chunk_id\') IN '
+                f'({", ".join("?" * len(batch))})',
+                batch
+            )
+            for chunk_id, content, metadata, vector in cursor.fetchall():
+                chunks[chunk_id] = (Document(page_content=content, metadata=json.loads(metadata)),
+                                    parse_vector(vector))
+    finally:
+        cursor.close()
+    return chunks
+
+def build_risk_view(directory, suppliers_path, country_status_path, hana_client, table_name=HANA_TABLE,
+                    graph_name=GRAPH_NAME, max_chunks=20, full=False):
+    """
+    Builds or refreshes the supplier risk view served by risk_view.RiskView.
+
+    Every supplier gets a profile with its KG attributes, its country risk and up to
+    max_chunks report chunks that mention it, the most specific ones (fewest suppliers
+    mentioned) first. The view is only rebuilt if the CSVs, the chunk mentions or the graph
+    version changed since the last build, and only chunks that are not in the previous view
+    are fetched from the vector table; their embeddings are reused, never recomputed.
+    Run it after loading the KG and ingesting the PDFs, since both bump the graph version
+    and servers ignore a view built against another version.
+    """
+    start_time = time.time()
+    connection = hana_client.connection
+
+    # Step 1: Fingerprint the sources and skip the build if none of them changed
+    mentions = fetch_chunk_mentions(connection, table_name)
+    sources = {
+        "suppliers": file_digest(suppliers_path),
+        "country_status": file_digest(country_status_path),
+        "chunks": hashlib.sha256(json.dumps(sorted(mentions.items())).encode()).hexdigest(),
+        "max_chunks": max_chunks
+    }
+    graph_version = read_graph_version(hana_client, graph_name)
+    previous = None if full else read_risk_view(directory)
+    if (previous is not None and previous[0].get("sources") == sources
+            and previous[0].get("graph_version") == graph_version):
+        print(f"Risk view in {directory} is up to date")
+        return
+
+    # Step 2: Profiles from the CSVs, linked to the chunks that mention each supplier
+    rows = build_profiles(suppliers_path, country_status_path)
+    chunks_by_supplier = {}
+    for chunk_id, suppliers in sorted(mentions.items(), key=lambda item: (len(item[1]), item[0])):
+        for supplier in suppliers:
+            chunks_by_supplier.setdefault(supplier, []).append(chunk_id)
+    profiles = [{"row": row, "chunks": chunks_by_supplier.get(name, [])[:max_chunks]} for name, row in rows.items()]
+
+    # Step 3: Reuse the chunks of the previous view and fetch only the new ones
+    needed = sorted({chunk_id for profile in profiles for chunk_id in profile["chunks"]})
+    known = {}
+    if previous is not None:
+        _, _, old_ids, old_documents, old_vectors = previous
+        known = {chunk_id: (document, old_vectors[row])
+                 for row, (chunk_id, document) in enumerate(zip(old_ids, old_documents))}
+    missing = [chunk_id for chunk_id in needed if chunk_id not in known]
+    known.update(fetch_chunks(connection, table_name, missing))
+    chunk_ids = [chunk_id for chunk_id in needed if chunk_id in known]
+
+    # Step 4: Write the new view
+    changed = len(profiles)
+    if previous is not None:
+        old_profiles = {json.dumps(profile) for profile in previous[1]}
+        changed = sum(json.dumps(profile) not in old_profiles for profile in profiles)
+    write_risk_view(
+        directory, profiles, chunk_ids, [known[chunk_id][0] for chunk_id in chunk_ids],
+        [known[chunk_id][1] for chunk_id in chunk_ids],
+        {"graph": graph_name, "graph_version": graph_version, "sources": sources, "built_at": time.time()}
+    )
+    print(f"Risk view in {directory}: {len(profiles)} supplier profiles ({changed} changed), "
+          f"{len(chunk_ids)} chunks ({len(missing)} fetched) in {time.time() - start_time:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the precomputed supplier risk view.")
+    parser.add_argument("--suppliers", default="sources/suppliers.csv")
+    parser.add_argument("--country-status", default="sources/country_status.csv")
+    parser.add_argument("--graph", help=f"Graph the view belongs to (default: the tenant's graph, else {GRAPH_NAME}).")
+    parser.add_argument("--table",
+                        help=f"Vector table with the chunks (default: the tenant's table, else {HANA_TABLE}).")
+    parser.add_argument("--tenant", help="Build the view of this tenant (see TENANTS).")
+    parser.add_argument("--output", default=os.environ.get('RISK_VIEW_DIR', RISK_VIEW_DIR),
+                        help="Directory holding the views, one subdirectory per graph (default: RISK_VIEW_DIR).")
+    parser.add_argument("--max-chunks", type=int, default=20, help="Report chunks kept per supplier.")
+    parser.add_argument("--full", action="store_true", help="Rebuild even if the sources did not change.")
+    args = parser.parse_args()
+    tenant_graph, tenant_table = tenant_names(args.tenant) if args.tenant else (GRAPH_NAME, HANA_TABLE)
+    graph_name = args.graph or tenant_graph
+
+    hana_client = HanaClient()
+    try:
+        build_risk_view(os.path.join(args.output, graph_name), args.suppliers, args.country_status, hana_client,
+                        table_name=args.table or tenant_table, graph_name=graph_name, max_chunks=args.max_chunks,
+                        full=args.full)
+    finally:
+        hana_client.close()
@@ -1,17 +1,18 @@
 import pandas as pd
-import math
+import numpy as np
+import argparse
+import hashlib
+import os
 import re
-from database import HanaClient
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database import HanaClient, HanaConnectionPool
+from sparql_result_cache import bump_graph_version
+from tenants import tenant_names
 
-# Load data
-suppliers = pd.read_csv("sources/suppliers.csv", sep=";")
-country_status = pd.read_csv("sources/country_status.csv", sep=";")
-country_risk_map = dict(zip(country_status["COUNTRY"], country_status["RISK"]))
-
-# Batch parameters
-batch_size = 50
-total_suppliers = len(suppliers)
-num_batches = math.ceil(total_suppliers / batch_size)
+GRAPH_NAME = "rag_suppliers_YOUR_NUMBER"
+RAG_PREFIX = "PREFIX rag: <http://sap.com/rag/>\n\n"
+SNAPSHOT_DIR = os.path.join(".cache", "kg")
 
 # Function to clean and format URIs
 def clean_uri(text):
@@ -24,52 +25,199 @@ def clean_uri(text):
     text = re.sub(r'[^A-Za-z0-9_]', '', text)  # Remove everything except a-z, 0-9, _
     return text
 
-# Initialize HANA client
-hana_client = HanaClient()
-
-try:
-    for batch_idx in range(num_batches):
-        start_idx = batch_idx * batch_size
-        end_idx = min(start_idx + batch_size, total_suppliers)
-        batch = suppliers.iloc[start_idx:end_idx]
-        
-        # Start building batch SPARQL
-        sparql_insert = "PREFIX rag: <http://sap.com/rag/>\n\n"
-        sparql_insert += "INSERT DATA {\n"
-        sparql_insert += "  GRAPH <rag_suppliers_YOUR_NUMBER> {\n"
-        
-        for idx, row in batch.iterrows():
-            supplier_name = clean_uri(row["SUPPLIER_NAME"])
-            supplier_id = row["SUPPLIER_ID"]
-            country = clean_uri(row["SUPPLIER_COUNTRY"])
-            supplier_type = row["SUPPLIER_TYPE"]
-            address = row["SUPPLIER_ADDRESS"]
-            city = row["SUPPLIER_CITY"]
-            email = row["SUPPLIER_EMAIL"]
-            phone = row["SUPPLIER_PHONE"]
-            website = row["SUPPLIER_WEBSITE"]
-
-            sparql_insert += f"    rag:{supplier_name} rag:locatedIn rag:{country} .\n"
-            sparql_insert += f"    rag:{supplier_name} rag:hasSupplierType \"{supplier_type}\" .\n"
-            sparql_insert += f"    rag:{supplier_name} rag:hasSupplierId \"{supplier_id}\" .\n"
-            sparql_insert += f'    rag:{supplier_name} rag:hasAddress "{address}" .\n'
-            sparql_insert += f'    rag:{supplier_name} rag:locatedInCity "{city}" .\n'
-            sparql_insert += f'    rag:{supplier_name} rag:hasEmail "{email}" .\n'
-            sparql_insert += f'    rag:{supplier_name} rag:hasPhone "{phone}" .\n'
-            sparql_insert += f'    rag:{supplier_name} rag:hasWebsite "{website}" .\n'
-            
-            if row["SUPPLIER_COUNTRY"] in country_risk_map:
-                risk = country_risk_map[row["SUPPLIER_COUNTRY"]]
-                sparql_insert += f"    rag:{country} rag:hasGeopoliticalRisk \"{risk}\" .\n"
-
-        # Close SPARQL
-        sparql_insert += "  }\n}"
-        
-        # Execute batch SPARQL
-        hana_client.execute_raw_sparql(sparql_insert)
-        print(f"Batch {batch_idx+1}/{num_batches} uploaded successfully ✅")
-
-finally:
-    # Close the database connection
-    hana_client.close()
-    print("All batches uploaded! 🚀")
\ No newline at end of file
+def escape_literal(text):
+    """
+    Escapes a value for use inside a double-quoted SPARQL string literal.
+    """
+    return (
+        str(text)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\t", "\\t")
+    )
+
+def iter_triples(suppliers_path, country_status_path, chunksize=10000):
+    """
+    Streams the supplier CSV in chunks and yields one triple line per fact.
+    Duplicates (e.g. the risk of a country shared by many suppliers) are removed by the caller.
+    """
+    country_status = pd.read_csv(country_status_path, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    country_risk_map = dict(zip(country_status["COUNTRY"], country_status["RISK"]))
+
+    for chunk in pd.read_csv(suppliers_path, sep=";", dtype=str, keep_default_na=False,
+                             encoding="utf-8-sig", chunksize=chunksize):
+        for row in chunk.itertuples(index=False):
+            supplier_name = clean_uri(row.SUPPLIER_NAME)
+            country = clean_uri(row.SUPPLIER_COUNTRY)
+            if not supplier_name:
+                continue
+
+            subject = f"rag:{supplier_name}"
+            if country:
+                yield f"{subject} rag:locatedIn rag:{country} ."
+            yield f'{subject} rag:hasSupplierType "{escape_literal(row.SUPPLIER_TYPE)}" .'
+            yield f'{subject} rag:hasSupplierId "{escape_literal(row.SUPPLIER_ID)}" .'
+            yield f'{subject} rag:hasAddress "{escape_literal(row.SUPPLIER_ADDRESS)}" .'
+            yield f'{subject} rag:locatedInCity "{escape_literal(row.SUPPLIER_CITY)}" .'
+            yield f'{subject} rag:hasEmail "{escape_literal(row.SUPPLIER_EMAIL)}" .'
+            yield f'{subject} rag:hasPhone "{escape_literal(row.SUPPLIER_PHONE)}" .'
+            yield f'{subject} rag:hasWebsite "{escape_literal(row.SUPPLIER_WEBSITE)}" .'
+
+            if country and row.SUPPLIER_COUNTRY in country_risk_map:
+                risk = escape_literal(country_risk_map[row.SUPPLIER_COUNTRY])
+                yield f'rag:{country} rag:hasGeopoliticalRisk "{risk}" .'
+
+def triple_digest(triple):
+    """
+    64-bit digest of a triple line, used for deduplication and snapshot diffs.
+    """
+    return int.from_bytes(hashlib.blake2b(triple.encode(), digest_size=8).digest(), "little")
+
+def build_updates(triples, operation, graph_name, max_bytes):
+    """
+    Groups triple lines into INSERT DATA / DELETE DATA statements of at most max_bytes each.
+    """
+    header = f"{RAG_PREFIX}{operation} DATA {{\n  GRAPH <{graph_name}> {{\n"
+    footer = "  }\n}"
+    overhead = len(header.encode()) + len(footer.encode())
+
+    lines, size = [], overhead
+    for triple in triples:
+        line = f"    {triple}\n"
+        line_size = len(line.encode())
+        if lines and size + line_size > max_bytes:
+            yield header + "".join(lines) + footer, len(lines)
+            lines, size = [], overhead
+        lines.append(line)
+        size += line_size
+    if lines:
+        yield header + "".join(lines) + footer, len(lines)
+
+def send_updates(updates, pool, max_workers):
+    """
+    Sends statements concurrently, one pooled connection per worker, with a bounded
+    number of statements in flight. Returns the number of triples sent.
+    """
+    client = HanaClient(pool=pool)
+    sent = 0
+    in_flight = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for statement, count in updates:
+            in_flight.append((executor.submit(client.execute_raw_sparql, statement), count))
+            if len(in_flight) >= max_workers * 2:
+                future, count = in_flight.pop(0)
+                future.result()
+                sent += count
+        for future, count in in_flight:
+            future.result()
+            sent += count
+    return sent
+
+def triple_delta(digests, old_digests=None):
+    """
+    Compares the digests of the source triples, in source order, with those of the last
+    loaded snapshot. Returns keep (first occurrence of each triple), insert (kept triples that
+    are not in the snapshot), delete (snapshot triples no longer in the source, None without a
+    snapshot) and the unique digests in source order, which make up the new snapshot.
+    """
+    _, first_index = np.unique(digests, return_index=True)
+    first_index.sort()
+    keep = np.zeros(len(digests), dtype=bool)
+    keep[first_index] = True
+    unique = digests[first_index]
+    if old_digests is None:
+        return keep, keep, None, unique
+    return keep, keep & ~np.isin(digests, old_digests), ~np.isin(old_digests, unique), unique
+
+def snapshot_paths(graph_name):
+    base = os.path.join(SNAPSHOT_DIR, graph_name)
+    return base + ".npy", base + ".nt"
+
+def load_graph(suppliers_path, country_status_path, graph_name=GRAPH_NAME, full=False,
+               max_bytes=256 * 1024, max_workers=4, chunksize=10000):
+    """
+    Loads the supplier knowledge graph.
+
+    Without a previous snapshot (or with full=True) the snapshot is deleted, and the graph is
+    cleared and fully loaded. Otherwise only the difference to the last loaded snapshot is applied: triples that
+    disappeared are deleted and new ones are inserted. Whenever triples may have changed,
+    even if the load fails halfway, the graph version is bumped so that servers drop their
+    cached query results.
+    """
+    start_time = time.time()
+    digests_path, triples_path = snapshot_paths(graph_name)
+    pool = HanaConnectionPool(min_size=1, max_size=max_workers)
+    changed = False
+
+    try:
+        # Pass 1: digest every triple to find unique triples without keeping their text in memory
+        digests = np.fromiter(
+            (triple_digest(t) for t in iter_triples(suppliers_path, country_status_path, chunksize)),
+            dtype=np.uint64
+        )
+        delta = not full and os.path.exists(digests_path) and os.path.exists(triples_path)
+        keep, insert_mask, delete_mask, unique_digests = triple_delta(
+            digests, np.load(digests_path) if delta else None
+        )
+        if not delta:
+            # Without a snapshot, a run after a failed full load is a full load too
+            for path in (digests_path, triples_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            print(f"Full load: clearing graph <{graph_name}>")
+            changed = True
+            HanaClient(pool=pool).execute_raw_sparql(
+                f"{RAG_PREFIX}DELETE WHERE {{ GRAPH <{graph_name}> {{ ?s ?p ?o . }} }}"
+            )
+
+        # Delete triples that are no longer part of the source data
+        deleted = 0
+        if delta and delete_mask.any():
+            changed = True
+            with open(triples_path, encoding="utf-8") as f:
+                stale = (line.rstrip("\n") for line, stale in zip(f, delete_mask) if stale)
+                deleted = send_updates(build_updates(stale, "DELETE", graph_name, max_bytes), pool, max_workers)
+
+        # Pass 2: stream the triples again, insert new ones and write the new snapshot
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        tmp_triples_path = triples_path + ".tmp"
+        with open(tmp_triples_path, "w", encoding="utf-8") as snapshot:
+            def new_triples():
+                for i, triple in enumerate(iter_triples(suppliers_path, country_status_path, chunksize)):
+                    if keep[i]:
+                        snapshot.write(triple + "\n")
+                        if insert_mask[i]:
+                            yield triple
+            changed = changed or insert_mask.any()
+            inserted = send_updates(build_updates(new_triples(), "INSERT", graph_name, max_bytes), pool, max_workers)
+
+        # Only replace the snapshot once the graph reflects it
+        np.save(digests_path, unique_digests)
+        os.replace(tmp_triples_path, triples_path)
+    finally:
+        if changed:
+            version = bump_graph_version(HanaClient(pool=pool), graph_name)
+            print(f"Graph <{graph_name}> is now at version {version}")
+        pool.close()
+
+    elapsed = time.time() - start_time
+    print(f"Graph <{graph_name}>: {inserted} triples inserted, {deleted} deleted, "
+          f"{len(unique_digests)} unique triples in {elapsed:.2f}s "
+          f"({(inserted + deleted) / max(elapsed, 1e-9):.0f} triples/s) 🚀")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the supplier knowledge graph into HANA.")
+    parser.add_argument("--suppliers", default="sources/suppliers.csv")
+    parser.add_argument("--country-status", default="sources/country_status.csv")
+    parser.add_argument("--graph", help=f"Graph to load (default: the tenant's graph, else {GRAPH_NAME}).")
+    parser.add_argument("--tenant", help="Load the graph of this tenant (see TENANTS and TENANT_GRAPH_TEMPLATE).")
+    parser.add_argument("--full", action="store_true", help="Clear the graph and reload everything.")
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024, help="Maximum payload size per statement.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent connections.")
+    args = parser.parse_args()
+
+    graph_name = args.graph or (tenant_names(args.tenant)[0] if args.tenant else GRAPH_NAME)
+    load_graph(args.suppliers, args.country_status, graph_name=graph_name, full=args.full,
+               max_bytes=args.max_bytes, max_workers=args.workers)
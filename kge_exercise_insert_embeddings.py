@@ -2,24 +2,40 @@ from langchain_community.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_hana import HanaDB
 from gen_ai_hub.proxy.langchain.openai import OpenAIEmbeddings
-from gen_ai_hub.proxy.gen_ai_hub_proxy import GenAIHubProxyClient
-from ai_core_sdk.ai_core_v2_client import AICoreV2Client
 from database import HanaClient
-from config import load_aicore_config
+from embedding_cache import CachedEmbeddings
+from instrumentation import configure_logging
+from entity_mentions import MentionMatcher, chunk_iri, mention_triples, mentions_graph
+from kge_exercise_generate_kg import GRAPH_NAME, RAG_PREFIX, build_updates, clean_uri
+from llm_scheduler import is_retryable, retry_after
+from retrieval import create_proxy_client
+from sparql_result_cache import bump_graph_version
+from tenants import tenant_names
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
 import time
 
-# Start timer
-start_time = time.time()
+logger = logging.getLogger(__name__)
+
+# Define HANA table and schema
+HANA_TABLE = "SUPPLIERS_EMBED_ADA_YOUR_NUMBER"
 
 def extract_chunks_from_pdf_with_langchain(file_path: str, chunk_size: int = 500, chunk_overlap: int = 50):
     """
     Extracts text chunks from a PDF file using LangChain, preserving metadata like page number.
-    
+
     Args:
         file_path (str): Path to the PDF file.
         chunk_size (int): Maximum size of each text chunk.
         chunk_overlap (int): Overlap size between chunks.
-        
+
     Returns:
         List[Document]: List of LangChain Document objects with text and metadata.
     """
@@ -35,56 +51,275 @@ def extract_chunks_from_pdf_with_langchain(file_path: str, chunk_size: int = 500
 
     return chunks
 
-# Extract chunks from the PDF
-chunks = extract_chunks_from_pdf_with_langchain("sources/Supplier_Performance_Report_Detailed.pdf")
+def fingerprint_chunks(chunks, source):
+    """
+    Adds source, content_hash and a stable chunk_id to the metadata of each chunk.
 
-# Load configurations
-aicore_config = load_aicore_config()
+    The chunk_id is derived from source, page and content hash, so an unchanged chunk keeps
+    its id across runs and a changed chunk gets a new one.
 
-# Initialize HANA client
-hana_client = HanaClient()
+    Args:
+        chunks (List[Document]): Chunks of a single PDF.
+        source (str): Path of the PDF relative to the ingested directory.
 
-# Initialize AICore client and proxy
-ai_core_client = AICoreV2Client(
-    base_url=aicore_config['AICORE_BASE_URL'],
-    auth_url=aicore_config['AICORE_AUTH_URL'],
-    client_id=aicore_config['AICORE_CLIENT_ID'],
-    client_secret=aicore_config['AICORE_CLIENT_SECRET'],
-    resource_group=aicore_config['AICORE_RESOURCE_GROUP']
-)
+    Returns:
+        Dict[str, Document]: Chunks keyed by chunk_id.
+    """
+    fingerprinted = {}
+    for chunk in chunks:
+        page = chunk.metadata.get("page")
+        content_hash = hashlib.sha256(chunk.page_content.encode()).hexdigest()
+        chunk_id = hashlib.sha256(f"{source}\0{page}\0{content_hash}".encode()).hexdigest()
 
-# Initialize GenAIHub proxy client
-proxy_client = GenAIHubProxyClient(ai_core_client=ai_core_client)
+        # Identical text can repeat on a page; number the repeats to keep ids unique
+        base_id, occurrence = chunk_id, 1
+        while chunk_id in fingerprinted:
+            chunk_id = f"{base_id}-{occurrence}"
+            occurrence += 1
 
-# Initialize embedding model and LLM
-embedding_model = OpenAIEmbeddings(proxy_model_name='text-embedding-ada-002', proxy_client=proxy_client)
+        chunk.metadata.update({"source": source, "content_hash": content_hash, "chunk_id": chunk_id})
+        fingerprinted[chunk_id] = chunk
+    return fingerprinted
 
-# Define HANA table and schema
-HANA_TABLE = "SUPPLIERS_EMBED_ADA_YOUR_NUMBER"
+def load_existing_chunk_ids(connection, table_name):
+    """
+    Returns the chunk_ids stored in the vector table. Rows ingested before fingerprinting
+    was introduced have no chunk_id and show up as None.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f'SELECT JSON_VALUE("METADATA", \'$.chunk_id\') FROM "{table_name}"')
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def delete_stale_chunks(db, connection, stale_ids, batch_size=500):
+    """
+    Deletes chunks that no longer exist in the source documents.
+    """
+    if None in stale_ids:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f'DELETE FROM "{db.table_name}" WHERE JSON_VALUE("METADATA", \'$.chunk_id\') IS NULL')
+        finally:
+            cursor.close()
+
+    stale_ids = sorted(chunk_id for chunk_id in stale_ids if chunk_id is not None)
+    for start in range(0, len(stale_ids), batch_size):
+        db.delete(filter={"chunk_id": {"$in": stale_ids[start:start + batch_size]}})
+
+def load_entity_matchers(suppliers_path):
+    """
+    Builds one MentionMatcher for the suppliers and one for the countries of the KG.
+
+    Names are matched as written in the CSV and in their clean_uri form (with underscores
+    or spaces), and always resolve to the clean_uri form used for the KG nodes.
+
+    Args:
+        suppliers_path (str): The supplier CSV the KG is loaded from.
+
+    Returns:
+        Dict[str, MentionMatcher]: Matchers keyed by the metadata field they fill.
+    """
+    aliases = {"suppliers": {}, "countries": {}}
+    with open(suppliers_path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            for kind, raw in (("suppliers", row["SUPPLIER_NAME"]), ("countries", row["SUPPLIER_COUNTRY"])):
+                name = clean_uri(raw or "")
+                if name:
+                    for alias in (raw, name, name.replace("_", " ")):
+                        aliases[kind].setdefault(alias, name)
+    return {kind: MentionMatcher(names) for kind, names in aliases.items()}
+
+def annotate_mentions(chunks, matchers):
+    """
+    Stores the KG entities each chunk mentions in its metadata, e.g. "suppliers": ["VisionCam_DE"].
+    """
+    for chunk in chunks:
+        for kind, matcher in matchers.items():
+            chunk.metadata[kind] = matcher.find(chunk.page_content)
+
+def update_chunk_metadata(connection, table_name, chunks):
+    """
+    Rewrites the stored metadata of chunks that are already in the vector table.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(
+            f'UPDATE "{table_name}" SET "METADATA" = ? WHERE JSON_VALUE("METADATA", \'$.chunk_id\') = ?',
+            [(json.dumps(chunk.metadata), chunk.metadata["chunk_id"]) for chunk in chunks]
+        )
+    finally:
+        cursor.close()
+
+def delete_chunk_mentions(sparql_client, graph_name, chunk_ids, batch_size=500):
+    """
+    Deletes the rag:mentionedIn triples of the given chunks, or of all chunks if chunk_ids is None.
+    """
+    graph = mentions_graph(graph_name)
+    if chunk_ids is None:
+        sparql_client.execute_raw_sparql(f"DELETE WHERE {{ GRAPH <{graph}> {{ ?s ?p ?o . }} }}")
+        return
+    chunk_ids = sorted(chunk_id for chunk_id in chunk_ids if chunk_id is not None)
+    for start in range(0, len(chunk_ids), batch_size):
+        values = " ".join(chunk_iri(chunk_id) for chunk_id in chunk_ids[start:start + batch_size])
+        sparql_client.execute_raw_sparql(
+            f"{RAG_PREFIX}DELETE {{ GRAPH <{graph}> {{ ?entity rag:mentionedIn ?chunk . }} }}\n"
+            f"WHERE {{ GRAPH <{graph}> {{ VALUES ?chunk {{ {values} }} ?entity rag:mentionedIn ?chunk . }} }}"
+        )
+
+def insert_chunk_mentions(sparql_client, graph_name, chunks, max_bytes=256 * 1024):
+    """
+    Inserts the rag:mentionedIn triples of the chunks. Returns the number of triples.
+    """
+    inserted = 0
+    for statement, count in build_updates(mention_triples(chunks), "INSERT", mentions_graph(graph_name), max_bytes):
+        sparql_client.execute_raw_sparql(statement)
+        inserted += count
+    return inserted
+
+def embed_with_retry(embedding_model, texts, max_retries=6, base_delay=1.0, max_delay=60.0):
+    """
+    Embeds a batch of texts, backing off exponentially with jitter on the errors the LLM
+    scheduler retries (see llm_scheduler.is_retryable), and at least as long as Retry-After asks.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return embedding_model.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+            delay = max(delay, retry_after(e) or 0)
+            logger.warning("Embedding batch failed (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+def ingest_directory(pdf_directory, db, connection, embedding_model, batch_size=64, max_workers=4,
+                     matchers=None, sparql_client=None, graph_name=GRAPH_NAME, reindex_mentions=False):
+    """
+    Synchronizes the vector table with the PDFs in pdf_directory: new or changed chunks are
+    embedded in parallel batches and inserted, then chunks that disappeared are deleted. A
+    changed PDF thus keeps its old chunks until the new ones are stored, also if embedding fails.
+
+    With matchers and a sparql_client, the supplier and country mentions of each chunk are
+    stored in its metadata and as rag:mentionedIn triples in the mentions graph of graph_name.
+    reindex_mentions recomputes them for the unchanged chunks too, e.g. after the supplier
+    list changed or for chunks ingested before mentions were indexed.
+    """
+    start_time = time.time()
+
+    # Step 1: Chunk and fingerprint every PDF, and find the KG entities each chunk mentions
+    chunks = {}
+    pdf_files = sorted(glob.glob(os.path.join(pdf_directory, "**", "*.pdf"), recursive=True))
+    for file_path in pdf_files:
+        source = os.path.relpath(file_path, pdf_directory)
+        chunks.update(fingerprint_chunks(extract_chunks_from_pdf_with_langchain(file_path), source))
+    index_mentions = matchers is not None and sparql_client is not None
+    if index_mentions:
+        annotate_mentions(chunks.values(), matchers)
+
+    # Step 2: Diff against what is already stored
+    existing_ids = load_existing_chunk_ids(connection, db.table_name)
+    new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+    stale_ids = existing_ids - chunks.keys()
+    print(f"{len(pdf_files)} PDFs, {len(chunks)} chunks: {len(new_ids)} new, "
+          f"{len(stale_ids)} stale, {len(chunks) - len(new_ids)} unchanged")
+
+    # Step 3: Embed new chunks in batches on a bounded worker pool and insert them as they finish
+    embed_start = time.time()
+    batches = [new_ids[i:i + batch_size] for i in range(0, len(new_ids), batch_size)]
+    calls_before = embedding_model.misses
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(embed_with_retry, embedding_model, [chunks[i].page_content for i in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            db.add_texts(
+                [chunks[i].page_content for i in batch],
+                metadatas=[chunks[i].metadata for i in batch],
+                embeddings=future.result()
+            )
+    connection.commit()
+    embed_time = time.time() - embed_start
+    embedded = embedding_model.misses - calls_before
+    print(f"Inserted {len(new_ids)} chunks in {embed_time:.2f}s "
+          f"({len(new_ids) / max(embed_time, 1e-9):.1f} chunks/s, "
+          f"{embedded / max(embed_time, 1e-9):.1f} embeddings/s, {embedded} embedding calls)")
+
+    # Step 4: Delete only stale chunks, once their replacements are committed
+    delete_stale_chunks(db, connection, stale_ids)
+    connection.commit()
+
+    # Step 5: Keep the rag:mentionedIn triples in line with the stored chunks
+    if index_mentions:
+        if reindex_mentions:
+            unchanged = [chunk for chunk_id, chunk in chunks.items() if chunk_id in existing_ids]
+            update_chunk_metadata(connection, db.table_name, unchanged)
+            connection.commit()
+            delete_chunk_mentions(sparql_client, graph_name, None)
+            indexed = list(chunks.values())
+        else:
+            delete_chunk_mentions(sparql_client, graph_name, stale_ids)
+            indexed = [chunks[chunk_id] for chunk_id in new_ids]
+        triples = insert_chunk_mentions(sparql_client, graph_name, indexed)
+        if reindex_mentions or stale_ids or triples:
+            # Cached mention lookups on the servers are outdated now
+            bump_graph_version(sparql_client, graph_name)
+        print(f"Indexed {triples} entity mentions in {len(indexed)} chunks")
+
+    total_time = time.time() - start_time
+    print(f"Table {db.table_name} is up to date. Execution time: {total_time:.4f} seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally ingest a directory of PDFs into the HANA vector table.")
+    parser.add_argument("pdf_directory", nargs="?", default="sources")
+    parser.add_argument("--table", help=f"Vector table (default: the tenant's table, else {HANA_TABLE}).")
+    parser.add_argument("--tenant", help="Ingest into the table and graph of this tenant (see TENANTS).")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--suppliers", default="sources/suppliers.csv",
+                        help="Supplier CSV whose supplier and country names are indexed as mentions.")
+    parser.add_argument("--graph", help="Knowledge graph the mentions link to (default: the tenant's graph).")
+    parser.add_argument("--no-mentions", action="store_true", help="Do not index entity mentions.")
+    parser.add_argument("--reindex-mentions", action="store_true",
+                        help="Recompute the mentions of all chunks, not only of new ones.")
+    args = parser.parse_args()
+    tenant_graph, tenant_table = tenant_names(args.tenant) if args.tenant else (GRAPH_NAME, HANA_TABLE)
+    table_name = args.table or tenant_table
+    graph_name = args.graph or tenant_graph
 
-# Create a LangChain VectorStore interface for the HANA database
-db = HanaDB(
-    connection=hana_client.connection,
-    embedding=embedding_model,
-    table_name=HANA_TABLE,
-    content_column="CONTENT",
-    metadata_column="METADATA",
-    vector_column="VECTOR"
-)
+    configure_logging()
 
-# Delete already existing documents from the table
-db.delete(filter={})
+    # Initialize HANA client
+    hana_client = HanaClient()
 
-# Add the loaded document chunks
-db.add_documents(chunks)
+    # Initialize the GenAIHub proxy client
+    proxy_client = create_proxy_client()
 
-# Commit and close the database connection
-hana_client.connection.commit()
-hana_client.close()
+    # Initialize embedding model, cached on disk so unchanged chunks are not re-embedded on re-ingest
+    embedding_model = CachedEmbeddings(
+        OpenAIEmbeddings(proxy_model_name='text-embedding-ada-002', proxy_client=proxy_client),
+        model_name='text-embedding-ada-002',
+        cache_dir=os.environ.get('EMBEDDING_CACHE_DIR', '.cache/embeddings')
+    )
 
-# End the timer
-end_time = time.time()
+    # Create a LangChain VectorStore interface for the HANA database
+    db = HanaDB(
+        connection=hana_client.connection,
+        embedding=embedding_model,
+        table_name=table_name,
+        content_column="CONTENT",
+        metadata_column="METADATA",
+        vector_column="VECTOR"
+    )
 
-# Print execution time
-execution_time = end_time - start_time
-print(f"Table {HANA_TABLE} has been created successfully. Execution time: {execution_time:.4f} seconds")
\ No newline at end of file
+    try:
+        ingest_directory(args.pdf_directory, db, hana_client.connection, embedding_model,
+                         batch_size=args.batch_size, max_workers=args.workers,
+                         matchers=None if args.no_mentions else load_entity_matchers(args.suppliers),
+                         sparql_client=hana_client, graph_name=graph_name,
+                         reindex_mentions=args.reindex_mentions)
+    finally:
+        hana_client.close()
@@ -0,0 +1,499 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from instrumentation import get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Share of the remaining request budget a call may use. SPARQL calls leave the rest to the
+# final answer, which may use whatever is left.
+CALL_BUDGET_SHARES = {"sparql_generation": 0.5, "sparql_recovery": 0.5, "final_answer": 1.0}
+
+# Errors without an HTTP status that are worth another attempt
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                         "ServiceUnavailableError", "Timeout", "ConnectTimeout", "ReadTimeout"}
+
+_END = object()
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+def error_status(error):
+    """
+    Returns the HTTP status code carried by an LLM client error, or None.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_retryable(error):
+    """
+    Throttling (429), timeouts (408) and server errors (5xx) are retried; other errors are not.
+    """
+    status = error_status(error)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+def retry_after(error):
+    """
+    Returns the seconds the proxy asked to wait in a Retry-After header, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate tokens per second, at most capacity at once.
+
+    The rate adapts to throttling: a 429 halves it, down to a tenth of the configured rate,
+    and every successful call wins back a twentieth of the configured rate. Calls that were
+    already in flight fail together, so 429s within a second of a decrease are ignored.
+    Waiting callers reserve their token ahead, so they are served in arrival order.
+    """
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._throttled_at = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, deadline=None):
+        """
+        Takes a token and returns the seconds to wait before using it. Raises LLMTimeoutError,
+        without taking the token, if that wait would end after the deadline.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            if deadline is not None and now + delay > deadline:
+                raise LLMTimeoutError(f"LLM rate limit: no capacity within the deadline (waiting {delay:.1f}s)")
+            self._tokens -= 1
+            return delay
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available right away.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._throttled_at is not None and now - self._throttled_at < 1:
+                return
+            self._throttled_at = now
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+            rate = self.rate
+        logger.info("LLM proxy throttled, lowering the rate limit to %.2f calls/s", rate)
+
+    def recover(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class _StreamReader:
+    """
+    Reads a blocking stream on a worker thread into a queue, so that its consumer can wait
+    for every chunk with a timeout. After close() the worker stops at the next chunk.
+    """
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self._chunks = queue.Queue()
+        self._closed = threading.Event()
+
+    def run(self):
+        try:
+            # The consumer may have given up while this read waited for a worker
+            if not self._closed.is_set():
+                for chunk in self._iterable:
+                    if self._closed.is_set():
+                        return
+                    self._chunks.put((chunk, None))
+            self._chunks.put((_END, None))
+        except Exception as e:
+            self._chunks.put((None, e))
+        finally:
+            close = getattr(self._iterable, "close", None)
+            if close is not None:
+                close()
+
+    def next(self, deadline):
+        """
+        Returns the next chunk, or _END after the last one. Raises the error of the stream, or
+        queue.Empty if nothing arrived before the deadline.
+        """
+        chunk, error = self._chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+        if error is not None:
+            raise error
+        return chunk
+
+    def close(self):
+        self._closed.set()
+
+class LLMScheduler:
+    """
+    Shared gate for the LLM calls of a retriever.
+
+    Every call waits for a token of the rate limiter, runs on a bounded pool of
+    max_concurrency workers (sync) or on the event loop (async) and has a deadline: its
+    share of what is left of the request budget (see CALL_BUDGET_SHARES), and at most
+    call_timeout seconds. Throttling and server errors are retried with jittered exponential
+    backoff while the deadline allows. Hedged calls send a second request when the first
+    is slower than hedge_after seconds, or than the recent 95th percentile (at most twice
+    the median) of that call if hedge_after is None, and keep whichever answers first.
+    Streams are read on a separate pool of max_streams workers, one worker per stream, so
+    that long answers never hold the workers of other calls.
+    """
+    def __init__(self, requests_per_minute=600, burst=20, max_concurrency=32, call_timeout=30, request_budget=60,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, hedge_after=None, instrumentation=None,
+                 max_streams=None):
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.call_timeout = call_timeout
+        self.request_budget = request_budget
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.instrumentation = instrumentation or get_instrumentation()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-scheduler")
+        self.stream_executor = ThreadPoolExecutor(max_workers=max_streams or max_concurrency,
+                                                  thread_name_prefix="llm-stream")
+
+        self._lock = threading.Lock()
+        self._queued = 0  # calls waiting for a rate-limit token or a worker
+        self._latencies = {}  # call -> recent successful latencies
+
+    @classmethod
+    def from_environment(cls, instrumentation=None):
+        hedge_after = os.environ.get('LLM_HEDGE_AFTER')
+        max_streams = os.environ.get('LLM_MAX_STREAMS')
+        return cls(
+            requests_per_minute=float(os.environ.get('LLM_REQUESTS_PER_MINUTE', 600)),
+            burst=int(os.environ.get('LLM_BURST', 20)),
+            max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 32)),
+            call_timeout=float(os.environ.get('LLM_CALL_TIMEOUT', 30)),
+            request_budget=float(os.environ.get('LLM_REQUEST_BUDGET', 60)),
+            max_retries=int(os.environ.get('LLM_MAX_RETRIES', 3)),
+            hedge_after=float(hedge_after) if hedge_after else None,
+            instrumentation=instrumentation,
+            max_streams=int(max_streams) if max_streams else None
+        )
+
+    def request_deadline(self):
+        """
+        Returns the deadline of a request starting now, as a time.monotonic() value.
+        """
+        return time.monotonic() + self.request_budget
+
+    def call_deadline(self, call, deadline=None):
+        now = time.monotonic()
+        call_deadline = now + self.call_timeout
+        if deadline is not None:
+            call_deadline = min(call_deadline, now + (deadline - now) * CALL_BUDGET_SHARES.get(call, 1.0))
+        return call_deadline
+
+    def hedge_delay(self, call):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            latencies = sorted(self._latencies.get(call, ()))
+        if len(latencies) < 20:
+            return 2.0
+        # Twice the median caps the delay when more than 5% of the calls are slow
+        return min(latencies[int(len(latencies) * 0.95)], 2 * latencies[len(latencies) // 2])
+
+    def _enqueue(self, call):
+        with self._lock:
+            self._queued += 1
+            depth = self._queued
+        self.instrumentation.observe("llm_queue_depth", depth, call=call)
+        return time.monotonic()
+
+    def _dequeue(self, call, enqueued_at):
+        with self._lock:
+            self._queued -= 1
+        self.instrumentation.observe("llm_queue_wait_seconds", time.monotonic() - enqueued_at, call=call)
+
+    def _record(self, call, result, started_at=None):
+        self.instrumentation.increment("llm_attempts_total", call=call, result=result)
+        if result == "ok":
+            self.bucket.recover()
+            if started_at is not None:
+                with self._lock:
+                    self._latencies.setdefault(call, deque(maxlen=200)).append(time.monotonic() - started_at)
+        elif result == "throttled":
+            self.bucket.throttle()
+
+    def _backoff(self, call, attempt, error, call_deadline):
+        """
+        Returns the seconds to wait before retrying after error, or None if it must not be retried.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            self._record(call, "error")
+            return None
+        self._record(call, "throttled" if error_status(error) == 429 else "retry")
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        delay = max(delay, retry_after(error) or 0)
+        if time.monotonic() + delay >= call_deadline:
+            return None
+        logger.warning("LLM call %s failed (%s), retrying in %.2fs", call, error, delay)
+        return delay
+
+    def _reserve(self, call, call_deadline, enqueued_at):
+        """
+        Takes a rate-limit token and returns the seconds to wait before using it. A call that
+        would not get one before its deadline leaves the queue and is recorded as a timeout.
+        """
+        try:
+            return self.bucket.reserve(call_deadline)
+        except LLMTimeoutError:
+            self._dequeue(call, enqueued_at)
+            self._record(call, "timeout")
+            raise
+
+    def _timeout(self, call):
+        self._record(call, "timeout")
+        return LLMTimeoutError(f"LLM call {call} did not finish within its deadline")
+
+    def _submit(self, call, func, call_deadline, enqueued_at):
+        def run():
+            self._dequeue(call, enqueued_at)
+            # The caller gave up while the call was queued
+            if time.monotonic() >= call_deadline:
+                raise LLMTimeoutError(f"LLM call {call} expired in the queue")
+            return func()
+        return self.executor.submit(run)
+
+    def invoke(self, call, runnable, inputs, deadline=None, hedge=False):
+        """
+        Returns runnable.invoke(inputs), scheduled as described above.
+        """
+        call_deadline = self.call_deadline(call, deadline)
+        for attempt in range(self.max_retries + 1):
+            enqueued_at = self._enqueue(call)
+            time.sleep(self._reserve(call, call_deadline, enqueued_at))
+            started_at = time.monotonic()
+            try:
+                result = self._attempt(call, lambda: runnable.invoke(inputs), call_deadline, enqueued_at, hedge)
+            except LLMTimeoutError:
+                raise
+            except Exception as e:
+                delay = self._backoff(call, attempt, e, call_deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._record(call, "ok", started_at)
+            return result
+
+    def _attempt(self, call, func, call_deadline, enqueued_at, hedge):
+        futures = [self._submit(call, func, call_deadline, enqueued_at)]
+        if hedge:
+            done, _ = wait(futures, timeout=max(0.0, min(self.hedge_delay(call), call_deadline - time.monotonic())))
+            # Only hedge with spare capacity, so that hedging never adds to throttling
+            if not done and time.monotonic() < call_deadline and self.bucket.try_acquire():
+                futures.append(self._submit(call, func, call_deadline, self._enqueue(call)))
+        pending, error = set(futures), None
+        while pending:
+            remaining = call_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1:
+                        winner = "hedge" if future is futures[1] else "original"
+                        self.instrumentation.increment("llm_hedges_total", call=call, winner=winner)
+                    return future.result()
+                error = future.exception()
+        # Abandoned calls finish in the background; queued ones expire when they start
+        if pending or error is None:
+            raise self._timeout(call)
+        raise error
+
+    async def ainvoke(self, call, runnable, inputs, deadline=None, hedge=False):
+        """
+        Async variant of invoke. Abandoned calls are cancelled.
+        """
+        call_deadline = self.call_deadline(call, deadline)
+        for attempt in range(self.max_retries + 1):
+            enqueued_at = self._enqueue(call)
+            delay = self._reserve(call, call_deadline, enqueued_at)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._dequeue(call, enqueued_at)
+            started_at = time.monotonic()
+            try:
+                result = await self._aattempt(call, lambda: runnable.ainvoke(inputs), call_deadline, hedge)
+            except LLMTimeoutError:
+                raise
+            except Exception as e:
+                delay = self._backoff(call, attempt, e, call_deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._record(call, "ok", started_at)
+            return result
+
+    async def _aattempt(self, call, func, call_deadline, hedge):
+        tasks = [asyncio.ensure_future(func())]
+        try:
+            if hedge:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(0.0, min(self.hedge_delay(call), call_deadline - time.monotonic()))
+                )
+                if not done and time.monotonic() < call_deadline and self.bucket.try_acquire():
+                    tasks.append(asyncio.ensure_future(func()))
+            pending, error = set(tasks), None
+            while pending:
+                remaining = call_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            winner = "hedge" if task is tasks[1] else "original"
+                            self.instrumentation.increment("llm_hedges_total", call=call, winner=winner)
+                        return task.result()
+                    error = task.exception()
+            if pending or error is None:
+                raise self._timeout(call)
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream(self, call, runnable, inputs, deadline=None):
+        """
+        Yields the chunks of runnable.stream(inputs). The first chunk must arrive before the
+        call deadline, and every further chunk within call_timeout of the previous one.
+        Failures are only retried before the first chunk, so no text is ever sent twice.
+        """
+        call_deadline = self.call_deadline(call, deadline)
+        for attempt in range(self.max_retries + 1):
+            enqueued_at = self._enqueue(call)
+            time.sleep(self._reserve(call, call_deadline, enqueued_at))
+            self._dequeue(call, enqueued_at)
+            started_at = time.monotonic()
+            # Reads block on the network, so they run on a stream worker that can be given up on
+            reader = _StreamReader(runnable.stream(inputs))
+            self.stream_executor.submit(reader.run)
+            try:
+                try:
+                    first = self._next_chunk(call, reader, call_deadline)
+                except LLMTimeoutError:
+                    raise
+                except Exception as e:
+                    delay = self._backoff(call, attempt, e, call_deadline)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                self._record(call, "ok", started_at)
+                if first is not _END:
+                    yield first
+                    while True:
+                        chunk = self._next_chunk(call, reader, time.monotonic() + self.call_timeout)
+                        if chunk is _END:
+                            break
+                        yield chunk
+                return
+            finally:
+                reader.close()
+
+    def _next_chunk(self, call, reader, deadline):
+        try:
+            return reader.next(deadline)
+        except queue.Empty:
+            raise self._timeout(call) from None
+
+    async def astream(self, call, runnable, inputs, deadline=None):
+        """
+        Async variant of stream. The stream of every attempt is closed when it is given up on:
+        before a retry, on a timeout or when the consumer stops reading.
+        """
+        call_deadline = self.call_deadline(call, deadline)
+        for attempt in range(self.max_retries + 1):
+            enqueued_at = self._enqueue(call)
+            delay = self._reserve(call, call_deadline, enqueued_at)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._dequeue(call, enqueued_at)
+            started_at = time.monotonic()
+            iterator = runnable.astream(inputs).__aiter__()
+            try:
+                try:
+                    first = await self._anext_chunk(call, iterator, call_deadline)
+                except LLMTimeoutError:
+                    raise
+                except Exception as e:
+                    delay = self._backoff(call, attempt, e, call_deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self._record(call, "ok", started_at)
+                if first is not _END:
+                    yield first
+                    while True:
+                        chunk = await self._anext_chunk(call, iterator, time.monotonic() + self.call_timeout)
+                        if chunk is _END:
+                            break
+                        yield chunk
+                return
+            finally:
+                await self._aclose(iterator)
+
+    async def _anext_chunk(self, call, iterator, deadline):
+        task = asyncio.ensure_future(iterator.__anext__())
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, deadline - time.monotonic()))
+        if not done:
+            task.cancel()
+            # The iterator can only be closed once the cancelled read has stopped
+            await asyncio.wait({task})
+            raise self._timeout(call)
+        try:
+            return task.result()
+        except StopAsyncIteration:
+            return _END
+
+    @staticmethod
+    async def _aclose(iterator):
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is None:
+            return
+        try:
+            await aclose()
+        except Exception as e:
+            logger.debug("Closing an abandoned LLM stream failed: %s", e)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,10 @@
 from langchain.prompts import PromptTemplate
 
-# Define the context about the RDF schema
+# Named graph holding the supplier triples of the default tenant (see kge_exercise_generate_kg.py)
+GRAPH_NAME = "rag_suppliers_YOUR_NUMBER"
+
+# Define the context about the RDF schema. The retriever introspects it from the live graph
+# (see schema_context.py) and only falls back to this one if the graph cannot be read.
 def get_rdf_context():
     return """
             Your RDF graph uses the following structure:
@@ -29,7 +33,7 @@ def get_rdf_context():
 
             """
 
-def get_sparql_prompt():
+def get_sparql_prompt(graph_name=GRAPH_NAME):
 
     sparql_prompt_template = """
         Generate a SPARQL query for the user question.
@@ -40,7 +44,7 @@ def get_sparql_prompt():
         '{question}'
 
         Instructions:
-        - Query the GRAPH <rag_suppliers_YOUR_NUMBER>.
+        - Query the GRAPH <{graph_name}>.
         - Always use the 'rag:' prefix for entities and predicates.
         - Available query variables include: ?supplierName, ?supplierType, ?supplierId, ?address, ?city, ?email, ?phone, ?website, ?country, ?risk.
         - You must only use available variables. Do NOT use any incorrect or undefined variables.
@@ -60,7 +64,7 @@ def get_sparql_prompt():
         Example:
         PREFIX rag: <http://sap.com/rag/>
         SELECT ?supplier ?supplierType ?country ?risk
-        FROM <rag_suppliers_YOUR_NUMBER>
+        FROM <{graph_name}>
         WHERE {{
             ?supplier rag:locatedIn ?country .
             ?supplier rag:hasSupplierType ?supplierType .
@@ -72,10 +76,11 @@ def get_sparql_prompt():
 
     return PromptTemplate(
         template=sparql_prompt_template,
-        input_variables=["rdf_context","question"]
+        input_variables=["rdf_context","question"],
+        partial_variables={"graph_name": graph_name}
     )
 
-def get_sparql_recovery_prompt():
+def get_sparql_recovery_prompt(graph_name=GRAPH_NAME):
 
     recovery_prompt_template = """
         Given the RDF context: {rdf_context}
@@ -93,7 +98,7 @@ def get_sparql_recovery_prompt():
 
         Instructions:
         - Generate a SPARQL query for the user question.
-        - Query the GRAPH <rag_suppliers_YOUR_NUMBER>.
+        - Query the GRAPH <{graph_name}>.
         - Always use the 'rag:' prefix for entities and predicates.
         - Available query variables include: ?supplierName, ?supplierType, ?supplierId, ?address, ?city, ?email, ?phone, ?website, ?country, ?risk.
         - You must only use available variables. Do NOT use any incorrect or undefined variables.
@@ -113,7 +118,7 @@ def get_sparql_recovery_prompt():
         Example:
         PREFIX rag: <http://sap.com/rag/>
         SELECT ?supplier ?supplierType ?country ?risk
-        FROM <rag_suppliers_YOUR_NUMBER>
+        FROM <{graph_name}>
         WHERE {{
             ?supplier rag:locatedIn ?country .
             ?supplier rag:hasSupplierType ?supplierType .
@@ -125,7 +130,8 @@ def get_sparql_recovery_prompt():
 
     return PromptTemplate(
         template=recovery_prompt_template,
-        input_variables=["rdf_context", "bad_query", "error_message", "original_user_question"]
+        input_variables=["rdf_context", "bad_query", "error_message", "question"],
+        partial_variables={"graph_name": graph_name}
     )
 
 def get_final_answer_prompt():
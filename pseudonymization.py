@@ -0,0 +1,176 @@
+import csv
+import re
+from io import StringIO
+from itertools import islice
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+
+# Sensitive columns of the SPARQL result that must not be sent to the LLM
+SENSITIVE_FIELDS = ("supplierName", "supplierId", "address", "email", "phone", "website")
+
+# Matches every placeholder produced by Pseudonymizer.pseudonymize_value. The digits are
+# matched greedily, so MASKED_EMAIL_1 never matches inside MASKED_EMAIL_12.
+PLACEHOLDER_PATTERN = re.compile(r"MASKED_[A-Z]+_\d+")
+
+# Matches a trailing prefix of a placeholder, which may still be completed by the next chunk.
+# This includes a complete placeholder at the very end, because more digits may follow.
+PARTIAL_PLACEHOLDER_PATTERN = re.compile(r"M(?:A(?:S(?:K(?:E(?:D(?:_(?:[A-Z]+(?:_\d*)?)?)?)?)?)?)?)?$")
+
+def iter_lines(text):
+    """
+    Yields the lines of text including their line breaks, one slice at a time,
+    so that a large result is never split into a full list of lines.
+    """
+    start, length = 0, len(text)
+    while start < length:
+        end = text.find("\n", start) + 1 or length
+        yield text[start:end]
+        start = end
+
+class Pseudonymizer:
+    """
+    Pseudonymization state for a single request.
+
+    Sensitive values are replaced by placeholders before the KG context is sent to the LLM,
+    and restore() puts the original values back into the LLM response in a single pass.
+    """
+    def __init__(self):
+        self.mapping = {field: {} for field in SENSITIVE_FIELDS}
+        self.counter = 1
+        self._originals = {}  # placeholder -> original value without the rag: namespace
+
+    def pseudonymize_value(self, field, value):
+        """
+        Pseudonymizes a value for a specific field and stores the mapping.
+        """
+        field_mapping = self.mapping[field]
+        placeholder = field_mapping.get(value)
+        if placeholder is None:
+            placeholder = f"MASKED_{field.upper()}_{self.counter}"
+            field_mapping[value] = placeholder
+            self._originals[placeholder] = value.replace(RAG_NAMESPACE, "")
+            self.counter += 1
+        return placeholder
+
+    def pseudonymize_column(self, field, values):
+        """
+        Pseudonymizes a whole column: each distinct value gets its placeholder once and the
+        column is rebuilt from that mapping in one pass. Empty values are left empty.
+        """
+        field_mapping = self.mapping[field]
+        new_values = [value for value in dict.fromkeys(values) if value and value not in field_mapping]
+        if new_values:
+            # Same placeholders as pseudonymize_value, numbered in order of first appearance
+            prefix = f"MASKED_{field.upper()}_"
+            placeholders = [f"{prefix}{n}" for n in range(self.counter, self.counter + len(new_values))]
+            field_mapping.update(zip(new_values, placeholders))
+            self._originals.update(zip(placeholders, [value.replace(RAG_NAMESPACE, "") for value in new_values]))
+            self.counter += len(new_values)
+        return list(map(field_mapping.get, values, values))
+
+    def _pseudonymize_rows(self, header, rows):
+        """
+        Masks the sensitive columns of a list of rows column by column and returns the rows.
+        """
+        # Short rows (e.g. unbound trailing values) are padded, so that columns stay aligned
+        width = max(len(header), max(map(len, rows)))
+        if min(map(len, rows)) < width:
+            rows = [row + [""] * (width - len(row)) for row in rows if row]
+        columns = list(zip(*rows))
+        for i, field in enumerate(header):
+            if field in self.mapping:
+                columns[i] = self.pseudonymize_column(field, columns[i])
+        return list(zip(*columns))
+
+    def iter_pseudonymized_rows(self, header, rows, chunk_rows=10000):
+        """
+        Yields the rows of a SPARQL result with the given header with their sensitive columns
+        masked. Rows are masked chunk_rows at a time, so a caller that stops early leaves the
+        rest of the result unmasked.
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                return
+            yield from self._pseudonymize_rows(header, chunk)
+
+    def iter_pseudonymized_csv(self, kg_context_csv, chunk_rows=10000):
+        """
+        Pseudonymizes the sensitive columns of a SPARQL CSV result and yields the resulting
+        CSV in pieces of at most chunk_rows rows, the first one starting with the header.
+
+        kg_context_csv may be a string or an iterable of lines. Rows are parsed into columns
+        chunk by chunk, and only the sensitive columns present in the header are masked, so
+        results without some of them (or without any rows) pass through.
+        """
+        if not kg_context_csv:
+            return
+        reader = csv.reader(iter_lines(kg_context_csv) if isinstance(kg_context_csv, str) else kg_context_csv)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(header)
+        while True:
+            rows = list(islice(reader, chunk_rows))
+            if not rows:
+                break
+            writer.writerows(self._pseudonymize_rows(header, rows))
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+        if output.tell():
+            yield output.getvalue()
+
+    def pseudonymize_kg_context(self, kg_context_csv):
+        """
+        Pseudonymizes sensitive fields in the kg_context CSV data.
+        Returns an empty string if there is no KG context, e.g. after a failed query.
+        """
+        return "".join(self.iter_pseudonymized_csv(kg_context_csv))
+
+    def original_value(self, placeholder):
+        """
+        Returns the original value for a placeholder, or the placeholder itself if unknown.
+        """
+        return self._originals.get(placeholder, placeholder)
+
+    def restore(self, response_text):
+        """
+        Restores original values in the LLM response by replacing pseudonymized placeholders
+        with their corresponding original values, without the 'http://sap.com/rag/' namespace.
+        """
+        if not self._originals:
+            return response_text
+        return PLACEHOLDER_PATTERN.sub(lambda match: self.original_value(match.group(0)), response_text)
+
+class StreamingRestorer:
+    """
+    Restores placeholders in a streamed LLM response, chunk by chunk.
+
+    Text is passed through as soon as it arrives, except for a trailing fragment that may be
+    the beginning of a placeholder; that fragment is held back until the next chunk decides it.
+    """
+    def __init__(self, pseudonymizer):
+        self.pseudonymizer = pseudonymizer
+        self._pending = ""
+
+    def feed(self, chunk):
+        """
+        Returns the restored text that can be emitted after receiving chunk.
+        """
+        text = self._pending + chunk
+        match = PARTIAL_PLACEHOLDER_PATTERN.search(text)
+        cut = match.start() if match else len(text)
+        self._pending = text[cut:]
+        return self.pseudonymizer.restore(text[:cut])
+
+    def flush(self):
+        """
+        Returns the restored remainder once the stream has ended.
+        """
+        text, self._pending = self._pending, ""
+        return self.pseudonymizer.restore(text)
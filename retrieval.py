@@ -1,198 +1,1354 @@
-from database import HanaClient
-from gen_ai_hub.proxy.langchain.openai import OpenAIEmbeddings, ChatOpenAI
-from gen_ai_hub.proxy.gen_ai_hub_proxy import GenAIHubProxyClient
-from ai_core_sdk.ai_core_v2_client import AICoreV2Client
-from langchain_hana import HanaDB
-from prompts import get_rdf_context, get_sparql_prompt, get_sparql_recovery_prompt, get_final_answer_prompt
+from database import HanaClient, connect, get_shared_pool
+from prompts import GRAPH_NAME, get_rdf_context, get_sparql_prompt, get_sparql_recovery_prompt, get_final_answer_prompt
 from config import load_aicore_config
-import csv
-from io import StringIO
+from sparql_cache import SemanticQueryCache
+from sparql_result_cache import CachedSparqlClient, SparqlResultCache, read_graph_version
+from sparql_validation import SparqlValidator
+from sparql_router import TemplateRouter
+from schema_context import SchemaContext
+from vector_replica import VectorReplica
+from risk_view import RiskView
+from embedding_cache import CachedEmbeddings
+from pseudonymization import Pseudonymizer, StreamingRestorer
+from context_assembly import ContextAssembler
+from entity_mentions import find_mentioned_chunks, kg_entity_names
+from tenants import TenantRegistry, UnknownTenantError, tenant_names
+from instrumentation import get_instrumentation, log_payload
+from llm_scheduler import LLMScheduler
+import asyncio
+import copy
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+VECTOR_TABLE = "SUPPLIERS_EMBED_ADA_YOUR_NUMBER"
+
+def create_proxy_client():
+    """
+    Authenticates against AI Core and returns a GenAIHub proxy client.
+    """
+    from gen_ai_hub.proxy.gen_ai_hub_proxy import GenAIHubProxyClient
+    from ai_core_sdk.ai_core_v2_client import AICoreV2Client
+
+    # Load AICore configuration
+    aicore_config = load_aicore_config()
+
+    # Initialize AICore client and proxy
+    ai_core_client = AICoreV2Client(
+        base_url=aicore_config['AICORE_BASE_URL'],
+        auth_url=aicore_config['AICORE_AUTH_URL'],
+        client_id=aicore_config['AICORE_CLIENT_ID'],
+        client_secret=aicore_config['AICORE_CLIENT_SECRET'],
+        resource_group=aicore_config['AICORE_RESOURCE_GROUP']
+    )
+
+    # Initialize GenAIHub proxy client
+    return GenAIHubProxyClient(ai_core_client=ai_core_client)
+
+def count_result_rows(results):
+    """
+    Number of rows in a SPARQL CSV result: a header line followed by one line per row.
+    """
+    return max(results.count("\n") - 1, 0) if results else 0
+
+class _Step:
+    """
+    A blocking call requested by a step generator: the retriever method named method with
+    args, timed under stage in timings if a stage is given.
+    """
+    __slots__ = ("method", "args", "timings", "stage")
+
+    def __init__(self, method, *args, timings=None, stage=None):
+        self.method, self.args, self.timings, self.stage = method, args, timings, stage
+
+class _Spawn:
+    """
+    Starts a step generator concurrently with the one that yields this; the driver sends
+    back a handle to wait for with _Join.
+    """
+    __slots__ = ("steps",)
+
+    def __init__(self, steps):
+        self.steps = steps
+
+class _Join:
+    """
+    Waits for a spawned step generator (or a concurrent.futures.Future) and sends back its result.
+    """
+    __slots__ = ("handle",)
+
+    def __init__(self, handle):
+        self.handle = handle
 
 class HybridRetriever:
-    def __init__(self):
-        # Load AICore configuration
-        aicore_config = load_aicore_config()
-        
-        # Initialize AICore client and proxy
-        ai_core_client = AICoreV2Client(
-            base_url=aicore_config['AICORE_BASE_URL'],
-            auth_url=aicore_config['AICORE_AUTH_URL'],
-            client_id=aicore_config['AICORE_CLIENT_ID'],
-            client_secret=aicore_config['AICORE_CLIENT_SECRET'],
-            resource_group=aicore_config['AICORE_RESOURCE_GROUP']
+    # Calls of the step generators that the async drivers await natively; every other call
+    # blocks and runs in a worker thread
+    _ASYNC_STEPS = {
+        "embed_question": "aembed_question",
+        "embed_questions": "aembed_questions",
+        "_invoke_llm": "_ainvoke_llm",
+        "_open_stream": "_aopen_stream",
+        "_next_chunk": "_anext_chunk",
+    }
+
+    def __init__(self, parallel=True, max_workers=None, sparql_cache=None, context_assembler=None,
+                 instrumentation=None, embedding_model=None, llm=None, db=None, hana_client=None,
+                 sparql_validator=None, sparql_router=None, vector_replica=None, sparql_result_cache=None,
+                 tenant_db_factory=None, llm_scheduler=None, risk_view=None):
+        # Stage timings, token counts, row counts and cache hits go here
+        self.instrumentation = instrumentation or get_instrumentation()
+
+        # The default tenant; other tenants are served by views created in _create_tenant
+        self.tenant = None
+        self.graph_name = GRAPH_NAME
+        self.vector_table = VECTOR_TABLE
+        self._load_prompts()
+
+        # Clients can be injected (e.g. local fakes for benchmarks); the rest are created here.
+        # The slow steps run side by side: AI Core authentication, connecting to HANA (the
+        # vector store then waits for the embedding model) and loading the tokenizer.
+        self.startup_timings = {}
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="hybrid-retriever-init") as init_executor:
+            models_future = init_executor.submit(
+                self._timed_startup, "ai_clients", self._create_models, embedding_model, llm
+            )
+            vector_store_future = init_executor.submit(
+                self._timed_startup, "vector_store", self._open_vector_store,
+                db, hana_client is None, models_future
+            )
+            assembler_future = init_executor.submit(
+                self._timed_startup, "tokenizer", lambda: context_assembler or ContextAssembler(
+                    token_budget=int(os.environ.get('CONTEXT_TOKEN_BUDGET', 6000)),
+                    max_chunks=int(os.environ.get('CONTEXT_MAX_CHUNKS', 8))
+                )
+            )
+        self.embedding_model, self.llm = models_future.result()
+        # Connections come from the process-wide pool so concurrent requests share them.
+        # HanaDB keeps its connection for its lifetime, so it gets a dedicated one.
+        self.pool, self.vector_connection, self.db = vector_store_future.result()
+        try:
+            # Keeps the final-answer prompt within a fixed token budget
+            self.context_assembler = assembler_future.result()
+        except Exception:
+            if self.vector_connection is not None:
+                self.pool.release(self.vector_connection)
+            raise
+        logger.info("Retriever clients created in parallel (s): %s",
+                    ", ".join(f"{step}={value:.3f}" for step, value in self.startup_timings.items()))
+
+        self.hana_client = hana_client or HanaClient(pool=self.pool)
+        # Tenant views wrap this client in result caches of their own
+        self.uncached_hana_client = self.hana_client
+
+        # Answers repeated KG lookups locally until the KG loader bumps the graph version
+        self.sparql_result_cache = sparql_result_cache
+        if sparql_result_cache is None and os.environ.get('SPARQL_RESULT_CACHE', 'true').lower() == 'true':
+            uncached_client, graph_name = self.hana_client, self.graph_name
+            self.sparql_result_cache = SparqlResultCache(
+                version_loader=lambda: read_graph_version(uncached_client, graph_name),
+                max_bytes=int(os.environ.get('SPARQL_RESULT_CACHE_MB', 64)) * 1024 * 1024,
+                version_check_interval=float(os.environ.get('SPARQL_RESULT_CACHE_VERSION_INTERVAL', 30)),
+                max_staleness=float(os.environ.get('SPARQL_RESULT_CACHE_MAX_STALENESS', 0))
+            )
+        if self.sparql_result_cache is not None:
+            self.hana_client = CachedSparqlClient(self.hana_client, self.sparql_result_cache)
+
+        # Optional in-process copy of the vector table; HANA stays the source of truth
+        # and serves every search the replica cannot (not synced yet, stale or failing)
+        self.vector_replica = vector_replica
+        if vector_replica is None and os.environ.get('VECTOR_REPLICA_DIR'):
+            self.vector_replica = VectorReplica(
+                os.environ['VECTOR_REPLICA_DIR'],
+                self.vector_table,
+                connection_factory=(self.pool or get_shared_pool()).connection,
+                nprobe=int(os.environ.get('VECTOR_REPLICA_NPROBE', 8)),
+                refresh_interval=int(os.environ.get('VECTOR_REPLICA_REFRESH_INTERVAL', 300)),
+                max_staleness=int(os.environ.get('VECTOR_REPLICA_MAX_STALENESS', 3600))
+            )
+            self.vector_replica.start_background_sync()
+
+        # Supplier risk profiles precomputed by kge_exercise_build_risk_view.py, which answer
+        # risk-screening questions with one in-process lookup
+        self.risk_view = risk_view
+        if risk_view is None and os.environ.get('RISK_VIEW_DIR'):
+            self.risk_view = RiskView(os.path.join(os.environ['RISK_VIEW_DIR'], self.graph_name))
+
+        # Chunks fetched per vector search; the context assembler keeps the best of them
+        self.vector_top_k = int(os.environ.get('VECTOR_TOP_K', 25))
+        # Chunks added from the entity-mention index for the entities of the KG result (0: off)
+        self.mention_top_k = int(os.environ.get('ENTITY_MENTION_TOP_K', 10))
+
+        # Vector search and SPARQL generation do not depend on each other,
+        # so in parallel mode they run side by side on this pool. Each request thread of
+        # the server may have a SPARQL generation on it, so it is sized like the server.
+        self.parallel = parallel
+        if max_workers is None:
+            max_workers = int(os.environ.get('RETRIEVER_WORKERS', os.environ.get('WEB_THREADS', 16)))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid-retriever")
+
+        # Rate limit, deadlines, retries and hedging for every LLM call, shared with the tenant views
+        self.llm_scheduler = llm_scheduler or LLMScheduler.from_environment(self.instrumentation)
+        # SPARQL generation is on the critical path of every request, so a slow call is hedged
+        self.hedge_sparql = os.environ.get('LLM_HEDGE', 'true').lower() == 'true'
+
+        # Questions of one answer_many batch that are answered at the same time
+        self.batch_max_concurrency = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+
+        # Reuses validated SPARQL for questions similar to ones answered before
+        self.sparql_cache = sparql_cache if sparql_cache is not None else SemanticQueryCache(
+            threshold=float(os.environ.get('SPARQL_CACHE_THRESHOLD', 0.95)),
+            persist_path=os.environ.get('SPARQL_CACHE_PATH')
+        )
+
+        # Repairs or rejects generated SPARQL before it costs a HANA round-trip
+        self.sparql_validator = sparql_validator or SparqlValidator(self.graph_name, self.rdf_context)
+
+        # Answers common question shapes from SPARQL templates, without an LLM call
+        self.sparql_router = sparql_router
+        if sparql_router is None and os.environ.get('SPARQL_TEMPLATES', 'true').lower() == 'true':
+            self.sparql_router = TemplateRouter(self.hana_client, self.graph_name)
+
+        # Describes the predicates and values actually in the graph to the SPARQL prompts
+        self.schema_context = None
+        if os.environ.get('SCHEMA_INTROSPECTION', 'true').lower() == 'true':
+            self.schema_context = self._create_schema_context()
+        # Entity names and the schema may have changed when the graph was reloaded
+        if self.sparql_result_cache is not None and self.sparql_result_cache.on_version_change is None:
+            self.sparql_result_cache.on_version_change = self._reset_graph_state
+
+        # Other tenants are routed to their own graph and vector table. The views of the
+        # most recently used tenants stay warm; the rest are closed and recreated on demand.
+        self.tenant_db_factory = tenant_db_factory
+        self.tenants = TenantRegistry(
+            self._create_tenant,
+            max_size=int(os.environ.get('TENANT_CACHE_SIZE', 8)),
+            on_evict=self._close_tenant
         )
-        
-        # Initialize GenAIHub proxy client
-        proxy_client = GenAIHubProxyClient(ai_core_client=ai_core_client)
+
+    def _load_prompts(self):
+        """
+        Builds the prompt templates once; the SPARQL prompts name the graph of the tenant.
+        """
+        self.rdf_context = get_rdf_context()
+        self.sparql_prompt = get_sparql_prompt(self.graph_name)
+        self.sparql_recovery_prompt = get_sparql_recovery_prompt(self.graph_name)
+        self.final_answer_prompt = get_final_answer_prompt()
+
+    def _create_schema_context(self):
+        """
+        Introspects the graph through the (cached) HANA client; the validator learns the
+        predicates of every newly loaded context.
+        """
+        return SchemaContext(
+            self.hana_client,
+            self.graph_name,
+            counter=self.context_assembler.counter,
+            token_budget=int(os.environ.get('RDF_CONTEXT_TOKEN_BUDGET', 250)),
+            fallback=self.rdf_context,
+            on_load=self.sparql_validator.update_schema
+        )
+
+    def current_rdf_context(self):
+        """
+        Returns the RDF context for the SPARQL prompts: the one introspected from the graph,
+        or the static one if introspection is off or the graph cannot be read.
+        """
+        if self.schema_context is None:
+            return self.rdf_context
+        return self.schema_context.get()
+
+    def _reset_graph_state(self):
+        """
+        Forgets what was loaded from the graph: the template entity names and the RDF context.
+        """
+        if self.sparql_router is not None:
+            self.sparql_router.reset()
+        if self.schema_context is not None:
+            self.schema_context.reset()
+
+    def _timed_startup(self, step, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.startup_timings[step] = time.perf_counter() - start
+
+    @staticmethod
+    def _create_models(embedding_model, llm):
+        """
+        Authenticates against AI Core and creates the embedding model and LLM that were not injected.
+        """
+        if embedding_model is not None and llm is not None:
+            return embedding_model, llm
+        proxy_client = create_proxy_client()
 
         # Initialize embedding model and LLM
-        self.embedding_model = OpenAIEmbeddings(proxy_model_name='text-embedding-ada-002', proxy_client=proxy_client)
-        self.llm = ChatOpenAI(proxy_model_name='gpt-4o', proxy_client=proxy_client)
-        
+        if embedding_model is None:
+            from gen_ai_hub.proxy.langchain.openai import OpenAIEmbeddings
+            embedding_model = CachedEmbeddings(
+                OpenAIEmbeddings(proxy_model_name='text-embedding-ada-002', proxy_client=proxy_client),
+                model_name='text-embedding-ada-002',
+                cache_dir=os.environ.get('EMBEDDING_CACHE_DIR')
+            )
+        if llm is None:
+            from gen_ai_hub.proxy.langchain.openai import ChatOpenAI
+            llm = ChatOpenAI(proxy_model_name='gpt-4o', proxy_client=proxy_client)
+        return embedding_model, llm
+
+    @staticmethod
+    def _open_vector_store(db, needs_pool, models_future):
+        """
+        Returns the connection pool (None if all HANA clients were injected), the dedicated
+        vector store connection and the vector store. The connection is opened right away;
+        HanaDB is created once the embedding model is ready.
+        """
+        pool = get_shared_pool() if db is None or needs_pool else None
+        if db is not None:
+            return pool, None, db
+
+        connection = pool.acquire()
+        try:
+            embedding_model, _ = models_future.result()
+            db = HybridRetriever._create_vector_store(embedding_model, connection, VECTOR_TABLE)
+        except Exception:
+            pool.release(connection)
+            raise
+        return pool, connection, db
+
+    @staticmethod
+    def _create_vector_store(embedding_model, connection, table_name):
         # Initialize HanaDB
-        self.db = HanaDB(
-            embedding=self.embedding_model,
-            connection=HanaClient().connection,
-            table_name="SUPPLIERS_EMBED_ADA_YOUR_NUMBER",
+        from langchain_hana import HanaDB
+        return HanaDB(
+            embedding=embedding_model,
+            connection=connection,
+            table_name=table_name,
             content_column="CONTENT",
             metadata_column="METADATA",
             vector_column="VECTOR"
         )
-        self.hana_client = HanaClient()
-
-        # Initialize pseudonymization mappings
-        self.pseudonymization_map = {
-            "supplierName": {},
-            "supplierId": {},
-            "address": {},
-            "email": {},
-            "phone": {},
-            "website": {}
-        }
-        self.pseudonymization_counter = 1
 
-    def retrieve_vector(self, question, top_k=25):
+    def warm_up(self):
+        """
+        Pays the first-request costs ahead of time: a pooled HANA round-trip, the graph
+        version, template entity names and RDF context, a first embedding request, which also
+        fetches the AI Core token, and the tenants listed in TENANT_PREWARM. Returns the
+        duration of each step in seconds; failures are logged and leave the step to the
+        first request.
+        """
+        # Go past the embedding cache, which may already know the warm-up text
+        embedding = getattr(self.embedding_model, "embedding", self.embedding_model)
+        steps = {"embedding": lambda: embedding.embed_query("warm-up")}
+        if self.pool is not None:
+            steps["hana_connection"] = self._ping_hana
+        if self.sparql_result_cache is not None:
+            steps["graph_version"] = self.sparql_result_cache.current_version
+        if self.sparql_router is not None:
+            steps["sparql_templates"] = self.sparql_router.warm_up
+        if self.schema_context is not None:
+            steps["rdf_context"] = self.schema_context.warm_up
+        for tenant in filter(None, os.environ.get('TENANT_PREWARM', '').replace(" ", "").split(",")):
+            steps[f"tenant_{tenant}"] = lambda tenant=tenant: self._warm_up_tenant(tenant)
+
+        def run(step):
+            start = time.perf_counter()
+            try:
+                steps[step]()
+            except Exception as e:
+                logger.warning("Warm-up step %s failed: %s", step, e)
+            return time.perf_counter() - start
+
+        futures = {step: self.executor.submit(run, step) for step in steps}
+        timings = {step: future.result() for step, future in futures.items()}
+        logger.info("Warm-up done (s): %s", ", ".join(f"{step}={value:.3f}" for step, value in timings.items()))
+        return timings
+
+    def _ping_hana(self):
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM DUMMY")
+            cursor.fetchone()
+
+    def acquire_tenant(self, tenant):
+        """
+        Returns the retriever to use for a tenant: this one for the default tenant (None),
+        otherwise a view on the tenant's graph and vector table that shares the clients,
+        the tokenizer and the worker pool with this one. Raises UnknownTenantError if the
+        tenant is not configured or has no vector table. Views are created on the tenant's
+        first request and must be handed back with release_tenant.
+        """
+        if tenant is None or tenant == self.tenant:
+            return self
+        return self.tenants.acquire(tenant)
+
+    def release_tenant(self, retriever):
+        """
+        Hands back a retriever returned by acquire_tenant.
+        """
+        if retriever is not self:
+            self.tenants.release(retriever)
+
+    @contextmanager
+    def for_tenant(self, tenant):
+        """
+        Context manager yielding the retriever of a tenant for the duration of a request.
+        """
+        retriever = self.acquire_tenant(tenant)
+        try:
+            yield retriever
+        finally:
+            self.release_tenant(retriever)
+
+    def _warm_up_tenant(self, tenant):
+        with self.for_tenant(tenant) as retriever:
+            if retriever.sparql_router is not None:
+                retriever.sparql_router.warm_up()
+            if retriever.schema_context is not None:
+                retriever.schema_context.warm_up()
+
+    def _create_tenant(self, tenant):
+        """
+        Creates the view of this retriever for a tenant. Only the tenant-specific parts are
+        new: the vector store on its table, its own SPARQL result and query caches, the
+        validator, the template router, the RDF context, the risk view and the SPARQL prompts
+        for its graph.
+        """
+        start = time.perf_counter()
+        graph_name, table_name = tenant_names(tenant)
+        view = copy.copy(self)
+        view.tenant, view.graph_name, view.vector_table = tenant, graph_name, table_name
+        view.tenants = None
+        view.vector_replica = None
+        if self.risk_view is not None:
+            view.risk_view = RiskView(os.path.join(os.path.dirname(self.risk_view.directory), graph_name))
+        view.sparql_prompt = get_sparql_prompt(graph_name)
+        view.sparql_recovery_prompt = get_sparql_recovery_prompt(graph_name)
+
+        # Step 1: Vector store on the tenant's table. HanaDB keeps its connection, so it gets
+        # one outside the pool, which would otherwise run dry with many warm tenants.
+        view.vector_connection = None
+        if self.tenant_db_factory is not None:
+            view.db = self.tenant_db_factory(tenant, table_name)
+        else:
+            view.vector_connection = connect()
+            try:
+                if not self._table_exists(view.vector_connection, table_name):
+                    raise UnknownTenantError(f"Unknown tenant: {tenant} (no vector table {table_name})")
+                view.db = self._create_vector_store(self.embedding_model, view.vector_connection, table_name)
+            except Exception:
+                view.vector_connection.close()
+                raise
+
+        # Step 2: SPARQL caches for the tenant's graph
+        view.hana_client = self.uncached_hana_client
+        if self.sparql_result_cache is not None:
+            uncached_client = self.uncached_hana_client
+            view.sparql_result_cache = SparqlResultCache(
+                version_loader=lambda: read_graph_version(uncached_client, graph_name),
+                max_bytes=self.sparql_result_cache.max_bytes,
+                version_check_interval=self.sparql_result_cache.version_check_interval,
+                max_staleness=self.sparql_result_cache.max_staleness
+            )
+            view.hana_client = CachedSparqlClient(view.hana_client, view.sparql_result_cache)
+        view.sparql_cache = SemanticQueryCache(
+            threshold=self.sparql_cache.threshold,
+            max_entries=self.sparql_cache.max_entries,
+            ttl=self.sparql_cache.ttl
+        )
+
+        # Step 3: Validation, templates and RDF context against the tenant's graph. The validator
+        # is copied rather than parsed again; its predicates follow the tenant's RDF context.
+        view.sparql_validator = copy.copy(self.sparql_validator)
+        view.sparql_validator.graph_name = graph_name
+        view.sparql_router = None
+        if self.sparql_router is not None:
+            view.sparql_router = TemplateRouter(view.hana_client, graph_name)
+        view.schema_context = None
+        if self.schema_context is not None:
+            view.schema_context = view._create_schema_context()
+        if view.sparql_result_cache is not None:
+            view.sparql_result_cache.on_version_change = view._reset_graph_state
+        # Loads the graph version, entity names and RDF context while the first request embeds its question
+        for component in (view.sparql_router, view.schema_context):
+            if component is not None:
+                self.executor.submit(component.warm_up)
+
+        self.instrumentation.observe("tenant_startup_seconds", time.perf_counter() - start)
+        logger.info("Created retriever for tenant %s (graph %s, table %s)", tenant, graph_name, table_name)
+        return view
+
+    @staticmethod
+    def _table_exists(connection, table_name):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT COUNT(*) FROM SYS.TABLES WHERE SCHEMA_NAME = CURRENT_SCHEMA AND TABLE_NAME = ?",
+                (table_name,)
+            )
+            return cursor.fetchone()[0] > 0
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _close_tenant(view):
+        """
+        Closes the connection of an evicted tenant view; everything else is shared or garbage.
+        """
+        logger.info("Closing retriever for tenant %s", view.tenant)
+        if view.vector_connection is not None:
+            view.vector_connection.close()
+
+    def embed_question(self, question):
+        """
+        Computes the question embedding shared by the vector search and the SPARQL cache.
+        """
+        return self.embedding_model.embed_query(question)
+
+    def embed_questions(self, questions):
+        """
+        Computes the embeddings of several questions in one batched call.
+        """
+        embed = getattr(self.embedding_model, "embed_queries", None) or self.embedding_model.embed_documents
+        return embed(questions)
+
+    def retrieve_vector(self, question, top_k=25, question_embedding=None):
         """
         Retrieve the top_k most relevant documents from the vector database.
         """
+        if question_embedding is not None:
+            return self._search_by_vector(question_embedding, top_k)
         retriever = self.db.as_retriever(search_kwargs={'k': top_k})
         return retriever.invoke(question)
 
-    def generate_sparql_query(self, rdf_context, question):
+    def _search_by_vector(self, embedding, top_k, chunk_filter=None):
+        if self.vector_replica is not None and self.vector_replica.ready:
+            try:
+                documents = self.vector_replica.similarity_search_by_vector(embedding, k=top_k, filter=chunk_filter)
+                self.instrumentation.increment("vector_searches_total", backend="replica")
+                return documents
+            except Exception as e:
+                logger.warning("Vector replica search failed, falling back to HANA: %s", e)
+        self.instrumentation.increment("vector_searches_total", backend="hana")
+        return self.db.similarity_search_by_vector(embedding, k=top_k, filter=chunk_filter)
+
+    def match_risk_view(self, question):
+        """
+        Returns the filters of a risk-screening question that the supplier risk view can answer
+        (see RiskView.match), or None if there is no view, the question does not fit it or the
+        view was built against another graph version.
+        """
+        if self.risk_view is None:
+            return None
+        filters = self.risk_view.match(question)
+        if filters is None:
+            return None
+        if self.sparql_result_cache is not None:
+            version = self.sparql_result_cache.current_version()
+            if version is None or version != self.risk_view.graph_version:
+                self.instrumentation.increment("risk_view_stale_total")
+                return None
+        return filters
+
+    def lookup_risk_view(self, filters, question_embedding, timings=None):
+        """
+        Replaces steps 2 to 4 for a question matched by match_risk_view: returns the
+        (vector_context, kg_context) of one lookup in the supplier risk view.
+        """
+        timings = {} if timings is None else timings
+        kg_context, vector_context = self._timed(
+            timings, "risk_view", self.risk_view.lookup, filters, question_embedding, self.vector_top_k
+        )
+        timings["sparql_route"] = "risk_view"
+        intent = "+".join(["risk"] + (["type"] if filters["type"] else []))
+        self.instrumentation.increment("sparql_routes_total", route="risk_view", intent=intent)
+        return vector_context, kg_context
+
+    def retrieve_from_risk_view(self, question, question_embedding, timings=None):
+        """
+        Returns the (vector_context, kg_context) of the supplier risk view for a risk-screening
+        question, or None if the view cannot answer it.
+        """
+        filters = self.match_risk_view(question)
+        return None if filters is None else self.lookup_risk_view(filters, question_embedding, timings)
+
+    def add_mentioned_chunks(self, vector_context, kg_context, question_embedding):
+        """
+        Adds the chunks that the entity-mention index links to the suppliers and countries of
+        the KG result and that the vector search missed: the ids come from one rag:mentionedIn
+        lookup, and the mention_top_k of them closest to the question are fetched. The vector
+        context is returned unchanged if the lookup finds nothing new or fails.
+        """
+        if not self.mention_top_k or not kg_context:
+            return vector_context
+        try:
+            chunk_ids = find_mentioned_chunks(self.hana_client, kg_entity_names(kg_context), self.graph_name)
+            known = {doc.metadata.get("chunk_id") for doc in vector_context}
+            missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in known]
+            self.instrumentation.increment("mention_lookups_total", result="hit" if missing else "miss")
+            if not missing:
+                return vector_context
+            documents = self._search_by_vector(question_embedding, self.mention_top_k, {"chunk_id": {"$in": missing}})
+        except Exception as e:
+            logger.warning("Entity mention lookup failed, using the vector search results only: %s", e)
+            return vector_context
+        self.instrumentation.increment("mention_chunks_total", len(documents))
+        return vector_context + documents
+
+    def generate_sparql_query(self, rdf_context, question, deadline=None):
         """
         Generates a SPARQL query based on the RDF context and user question.
+        deadline is the time.monotonic() by which the whole request should be answered.
         """
-        sparql_llm_chain = get_sparql_prompt() | self.llm
-        sparql_query = sparql_llm_chain.invoke({
+        return self._run(self._generate_sparql_steps(rdf_context, question, deadline))
+
+    def _generate_sparql_steps(self, rdf_context, question, deadline):
+        sparql_llm_chain = self.sparql_prompt | self.llm
+        sparql_query = yield _Step("_invoke_llm", "sparql_generation", sparql_llm_chain, {
             "rdf_context": rdf_context,
             "question": question
-        })
+        }, deadline, self.hedge_sparql)
+        self._record_llm_usage("sparql_generation", sparql_query)
         return sparql_query.content.strip()
 
-    def regenerate_sparql_with_error_context(self, rdf_context, bad_query, error_message, question):
+    def get_sparql_query(self, rdf_context, question, question_embedding, timings=None, deadline=None):
+        """
+        Returns a SPARQL query from a template if the question fits one, else a previously
+        validated query for a similar question if one is cached, otherwise generates a new one
+        with the LLM. The source is recorded under timings["sparql_route"]. question_embedding
+        is None if the SPARQL cache is known to have no query for the question (see
+        SemanticQueryCache.may_match), so that generation need not wait for the embedding.
+        """
+        return self._run(self._sparql_query_steps(rdf_context, question, question_embedding, timings, deadline))
+
+    def _sparql_query_steps(self, rdf_context, question, question_embedding, timings, deadline):
+        if self.sparql_router is not None:
+            # The first call loads the entity names from HANA
+            query = yield _Step("_route_sparql_template", question, timings)
+            if query is not None:
+                return query
+        cached_query = self._lookup_sparql_cache(question, question_embedding, timings)
+        if cached_query is not None:
+            return cached_query
+        return (yield from self._generate_sparql_steps(rdf_context, question, deadline))
+
+    def _route_sparql_template(self, question, timings):
+        if self.sparql_router is None:
+            return None
+        routed = self.sparql_router.route(question)
+        if routed is None:
+            return None
+        intent, query = routed
+        if timings is not None:
+            timings["sparql_route"] = "template"
+        self.instrumentation.increment("sparql_routes_total", route="template", intent=intent)
+        return query
+
+    def _lookup_sparql_cache(self, question, question_embedding, timings):
+        cached_query = None
+        if question_embedding is not None:
+            cached_query = self.sparql_cache.get(question_embedding, question)
+        route = "cache" if cached_query is not None else "llm"
+        if timings is not None:
+            timings["sparql_cache_hit"] = cached_query is not None
+            timings["sparql_route"] = route
+        self.instrumentation.increment(
+            "cache_requests_total", cache="sparql", result="hit" if cached_query is not None else "miss"
+        )
+        self.instrumentation.increment("sparql_routes_total", route=route, intent="")
+        return cached_query
+
+    def regenerate_sparql_with_error_context(self, rdf_context, bad_query, error_message, question, deadline=None):
         """
         Regenerates the SPARQL query using the error context.
         """
-        print("Regenerating SPARQL due to error:", error_message)
+        return self._run(self._regenerate_sparql_steps(rdf_context, bad_query, error_message, question, deadline))
+
+    def _regenerate_sparql_steps(self, rdf_context, bad_query, error_message, question, deadline):
+        logger.warning("Regenerating SPARQL due to error: %s", error_message)
+        self.instrumentation.increment("sparql_retries_total")
 
         # Now we feed LLM a **different prompt** saying:
         # "This query caused an error, please regenerate it properly."
 
-        recovery_chain = get_sparql_recovery_prompt() | self.llm
+        recovery_chain = self.sparql_recovery_prompt | self.llm
 
-        recovery_output = recovery_chain.invoke({
+        recovery_output = yield _Step("_invoke_llm", "sparql_recovery", recovery_chain, {
             "rdf_context": rdf_context,
             "bad_query": bad_query,
             "error_message": error_message,
             "question": question
-        })
-
+        }, deadline)
+        self._record_llm_usage("sparql_recovery", recovery_output)
 
         return recovery_output.content.strip()
-    
-    def execute_sparql_with_retry(self, sparql_query, question, max_retries=1):
+
+    def execute_sparql_with_retry(self, sparql_query, question, max_retries=1, rdf_context=None):
         """
         Executes the SPARQL query and retries if an error occurs.
         """
-        try:
-            return self.hana_client.execute_raw_sparql(sparql_query)[0]  # only return result
-        except Exception as e:
-            print(f"SPARQL error: {e}")
-            if max_retries > 0:
-                regenerated_query = self.regenerate_sparql_with_error_context(
-                    self.rdf_context, sparql_query, str(e), question
-                )
-                return self.execute_sparql_with_retry(regenerated_query, question, max_retries - 1)
-            else:
-                print("SPARQL regeneration failed.")
-                return None
-            
-    def pseudonymize_value(self, field, value):
-        """
-        Pseudonymizes a value for a specific field and stores the mapping.
-        """
-        if value not in self.pseudonymization_map[field]:
-            placeholder = f"MASKED_{field.upper()}_{self.pseudonymization_counter}"
-            self.pseudonymization_map[field][value] = placeholder
-            self.pseudonymization_counter += 1
-        return self.pseudonymization_map[field][value]
-
-    def pseudonymize_kg_context(self, kg_context_csv):
-        """
-        Pseudonymizes sensitive fields in the kg_context CSV data.
-        """
-        pseudonymized_rows = []
-        csv_reader = csv.DictReader(StringIO(kg_context_csv))
-        
-        for row in csv_reader:
-            # Pseudonymize sensitive fields
-            row["supplierName"] = self.pseudonymize_value("supplierName", row["supplierName"])
-            row["supplierId"] = self.pseudonymize_value("supplierId", row["supplierId"])
-            row["address"] = self.pseudonymize_value("address", row["address"])
-            row["email"] = self.pseudonymize_value("email", row["email"])
-            row["phone"] = self.pseudonymize_value("phone", row["phone"])
-            row["website"] = self.pseudonymize_value("website", row["website"])
-            pseudonymized_rows.append(row)
-        
-        # Convert back to CSV format
-        output = StringIO()
-        csv_writer = csv.DictWriter(output, fieldnames=csv_reader.fieldnames)
-        csv_writer.writeheader()
-        csv_writer.writerows(pseudonymized_rows)
-        
-        return output.getvalue()
-
-    def generate_final_answer(self, vector_context, kg_context, question):
+        return self.run_sparql_with_retry(sparql_query, question, max_retries, rdf_context)[0]  # only return result
+
+    def validate_sparql(self, sparql_query):
+        """
+        Applies the local repairs to a generated query.
+        Returns the repaired query and an error message if it still cannot run, else None.
+        """
+        sparql_query, fixes, errors = self.sparql_validator.validate(sparql_query)
+        for fix in fixes:
+            self.instrumentation.increment("sparql_repairs_total", fix=fix)
+        if fixes:
+            logger.info("Repaired SPARQL locally: %s", ", ".join(fixes))
+        if not errors:
+            return sparql_query, None
+        self.instrumentation.increment("sparql_validation_errors_total")
+        return sparql_query, "The query was rejected before execution: " + " ".join(errors)
+
+    def run_sparql_with_retry(self, sparql_query, question, max_retries=1, rdf_context=None, deadline=None,
+                              validate=True):
+        """
+        Validates and executes the SPARQL query, and regenerates it if an error occurs.
+        Queries that fail local validation are regenerated without being sent to HANA.
+        validate=False skips validation for queries that passed it before (templates and cached
+        queries); a regenerated query is always validated.
+        Returns the result together with the query that produced it, or (None, None).
+        """
+        return self._run(self._run_sparql_steps(sparql_query, question, max_retries, rdf_context, deadline, validate))
+
+    def _run_sparql_steps(self, sparql_query, question, max_retries=1, rdf_context=None, deadline=None,
+                          validate=True):
+        rdf_context = self.current_rdf_context() if rdf_context is None else rdf_context
+        while True:
+            error_message = None
+            if validate:
+                sparql_query, error_message = yield _Step("validate_sparql", sparql_query)
+            if error_message is None:
+                try:
+                    results = yield _Step("_execute_sparql", sparql_query)
+                except Exception as e:
+                    error_message = str(e)
+                else:
+                    self._record_result_rows(results)
+                    return results, sparql_query
+
+            logger.warning("SPARQL error: %s", error_message)
+            if max_retries <= 0:
+                logger.error("SPARQL regeneration failed.")
+                return None, None
+            sparql_query = yield from self._timed_steps({}, "sparql_retry", self._regenerate_sparql_steps(
+                rdf_context, sparql_query, error_message, question, deadline
+            ))
+            max_retries -= 1
+            validate = True
+
+    def _execute_sparql(self, sparql_query):
+        return self.hana_client.execute_raw_sparql(sparql_query)[0]
+
+    def generate_final_answer(self, vector_context, kg_context, question, pseudonymizer, deadline=None):
         """
         Generates the final answer by combining vector and KG context.
+        Sensitive KG values are masked with the request's pseudonymizer.
+        """
+        return self._run(self._final_answer_steps(vector_context, kg_context, question, pseudonymizer, deadline))
+
+    def _final_answer_steps(self, vector_context, kg_context, question, pseudonymizer, deadline):
+        final_answer_llm_chain = self.final_answer_prompt | self.llm
+        final_answer = yield _Step(
+            "_invoke_llm", "final_answer", final_answer_llm_chain,
+            self.build_final_answer_inputs(vector_context, kg_context, question, pseudonymizer), deadline
+        )
+        self._record_llm_usage("final_answer", final_answer)
+        return final_answer.content.strip()
+
+    def build_final_answer_inputs(self, vector_context, kg_context, question, pseudonymizer):
         """
-        final_answer_llm_chain = get_final_answer_prompt() | self.llm
+        Builds the final answer prompt inputs from the vector and KG context.
+        """
+        # The KG rows are masked before they are counted, so the budget holds for the text sent
+        vector_context, kg_text, stats = self.context_assembler.assemble(vector_context, kg_context, pseudonymizer)
+        logger.debug("Context assembly: %s", stats)
+        self.instrumentation.observe("prompt_tokens", stats["kg_tokens"], part="kg")
+        self.instrumentation.observe("prompt_tokens", stats["vector_tokens"], part="vector")
+        self.instrumentation.increment("context_rows_dropped_total", stats["kg_rows_dropped"])
+        self.instrumentation.increment("context_chunks_dropped_total", stats["vector_chunks_dropped"])
 
         vector_text = "\n\n".join([doc.page_content for doc in vector_context])
         # kg_text = "\n".join([str(row) for row in kg_context])
-        kg_text = self.pseudonymize_kg_context(kg_context)
-        print("KG Text:", kg_text)
+        log_payload(logger, "KG Text: %s", kg_text)
 
-        final_answer = final_answer_llm_chain.invoke({
+        return {
             "vector_context": vector_text,
             "sparql_context": kg_text,
             "question": question
-        })
-        return final_answer.content.strip()
+        }
     
-    def restore_original_values_in_response(self, response_text):
+    def restore_original_values_in_response(self, response_text, pseudonymizer):
         """
         Restores original values in the LLM response by replacing pseudonymized placeholders
         with their corresponding original values, and removes the 'http://sap.com/rag/' namespace.
         """
-        for field, mapping in self.pseudonymization_map.items():
-            for original, pseudonymized in mapping.items():
-                # Remove the namespace from the original value
-                clean_original = original.replace("http://sap.com/rag/", "")
-                # Replace pseudonymized placeholders with the cleaned original values
-                response_text = response_text.replace(pseudonymized, clean_original)
-        return response_text
+        return pseudonymizer.restore(response_text)
+
+    def _timed(self, timings, stage, func, *args):
+        """
+        Runs func(*args) and records its wall-clock duration under timings[stage]
+        and in the stage latency histogram.
+        """
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            self.instrumentation.increment("stage_errors_total", stage=stage)
+            raise
+        finally:
+            timings[stage] = time.perf_counter() - start
+            self.instrumentation.observe("stage_seconds", timings[stage], stage=stage)
+
+    def _timed_steps(self, timings, stage, steps):
+        """
+        Step generator variant of _timed: runs the step generator steps and records its duration.
+        """
+        start = time.perf_counter()
+        try:
+            return (yield from steps)
+        except Exception:
+            self.instrumentation.increment("stage_errors_total", stage=stage)
+            raise
+        finally:
+            timings[stage] = time.perf_counter() - start
+            self.instrumentation.observe("stage_seconds", timings[stage], stage=stage)
+
+    def _record_llm_usage(self, call, message):
+        """
+        Counts the input and output tokens reported by the proxy for an LLM call.
+        """
+        usage = getattr(message, "usage_metadata", None) or {}
+        for kind in ("input_tokens", "output_tokens"):
+            if usage.get(kind):
+                self.instrumentation.increment("llm_tokens_total", usage[kind], call=call, kind=kind)
+
+    def _record_result_rows(self, results):
+        self.instrumentation.observe("sparql_result_rows", count_result_rows(results))
+
+    def _remember_sparql(self, question_embedding, question, kg_context, executed_query, timings):
+        # Only queries that ran successfully are remembered for similar questions.
+        # Template queries are rebuilt for free and their parameters must not leak
+        # to similar questions about other entities.
+        if kg_context is not None and timings.get("sparql_route") != "template":
+            self.sparql_cache.put(question_embedding, question, executed_query)
+
+    @staticmethod
+    def _vector_event(vector_context):
+        sources = list(dict.fromkeys(doc.metadata.get("source") for doc in vector_context if doc.metadata.get("source")))
+        return {"hits": len(vector_context), "sources": sources[:5]}
+
+    @staticmethod
+    def _sparql_event(executed_query, kg_context, timings):
+        return {"query": executed_query, "route": timings.get("sparql_route"), "rows": count_result_rows(kg_context)}
+
+    def _finish_request(self, timings, start):
+        timings["total"] = time.perf_counter() - start
+        self.instrumentation.observe("stage_seconds", timings["total"], stage="total")
+        self.instrumentation.increment("requests_total")
+        logger.info("Stage timings (s): %s", ", ".join(
+            f"{stage}={value:.3f}" if isinstance(value, float) else f"{stage}={value}"
+            for stage, value in timings.items()
+        ))
+
+    # The sync and async variants of the pipeline share its steps as generators. A step
+    # generator yields a _Step for each blocking call, _Spawn / _Join to run another step
+    # generator concurrently, and (event, data) pairs for the streaming variants. It is driven
+    # by _drive on the calling thread or by _adrive on the event loop, which make the calls.
+
+    def _invoke_llm(self, call, chain, inputs, deadline, hedge=False):
+        return self.llm_scheduler.invoke(call, chain, inputs, deadline, hedge=hedge)
+
+    async def _ainvoke_llm(self, call, chain, inputs, deadline, hedge=False):
+        return await self.llm_scheduler.ainvoke(call, chain, inputs, deadline, hedge=hedge)
+
+    def _open_stream(self, call, chain, inputs, deadline):
+        return self.llm_scheduler.stream(call, chain, inputs, deadline)
+
+    async def _aopen_stream(self, call, chain, inputs, deadline):
+        return self.llm_scheduler.astream(call, chain, inputs, deadline)
+
+    @staticmethod
+    def _next_chunk(chunks):
+        return next(chunks, None)
+
+    @staticmethod
+    async def _anext_chunk(chunks):
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def _drive(self, steps):
+        """
+        Runs a step generator on this thread: makes the calls it requests, runs the generators
+        it spawns on the worker pool and raises errors back into it. Yields its (event, data)
+        pairs and returns its return value.
+        """
+        spawned = []
+        value = error = None
+        try:
+            while True:
+                try:
+                    item = steps.send(value) if error is None else steps.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                value = error = None
+                if isinstance(item, tuple):
+                    yield item
+                    continue
+                try:
+                    value = self._perform(item, spawned)
+                except Exception as e:
+                    error = e
+        finally:
+            steps.close()
+            for future in spawned:
+                future.cancel()
+
+    def _run(self, steps):
+        """
+        Runs a step generator to the end on this thread and returns its return value.
+        """
+        events = self._drive(steps)
+        while True:
+            try:
+                next(events)
+            except StopIteration as stop:
+                return stop.value
+
+    def _perform(self, item, spawned):
+        if isinstance(item, _Spawn):
+            future = self.executor.submit(self._run, item.steps)
+            spawned.append(future)
+            return future
+        if isinstance(item, _Join):
+            return item.handle.result()
+        method = getattr(self, item.method)
+        if item.stage is None:
+            return method(*item.args)
+        return self._timed(item.timings, item.stage, method, *item.args)
+
+    async def _adrive(self, steps, outcome=None):
+        """
+        Async variant of _drive. Calls with a native async variant (see _ASYNC_STEPS) are
+        awaited and the others run in a worker thread; spawned generators run as tasks.
+        The return value of steps is appended to outcome.
+        """
+        spawned = []
+        value = error = None
+        try:
+            while True:
+                try:
+                    item = steps.send(value) if error is None else steps.throw(error)
+                except StopIteration as stop:
+                    if outcome is not None:
+                        outcome.append(stop.value)
+                    return
+                value = error = None
+                if isinstance(item, tuple):
+                    yield item
+                    continue
+                try:
+                    value = await self._aperform(item, spawned)
+                except Exception as e:
+                    error = e
+        finally:
+            steps.close()
+            for task in spawned:
+                task.cancel()
+
+    async def _arun(self, steps):
+        """
+        Async variant of _run.
+        """
+        outcome = []
+        async for _ in self._adrive(steps, outcome):
+            pass
+        return outcome[0]
+
+    async def _aperform(self, item, spawned):
+        if isinstance(item, _Spawn):
+            task = asyncio.ensure_future(self._arun(item.steps))
+            spawned.append(task)
+            return task
+        if isinstance(item, _Join):
+            if isinstance(item.handle, Future):
+                return await asyncio.wrap_future(item.handle)
+            return await item.handle
+        native = self._ASYNC_STEPS.get(item.method)
+        if native is not None:
+            call = getattr(self, native)
+        else:
+            call = functools.partial(asyncio.to_thread, getattr(self, item.method))
+        if item.stage is None:
+            return await call(*item.args)
+        return await self._atimed(item.timings, item.stage, call, *item.args)
+
+    async def _atimed(self, timings, stage, func, *args):
+        """
+        Awaits func(*args) and records its wall-clock duration under timings[stage].
+        """
+        start = time.perf_counter()
+        try:
+            return await func(*args)
+        except Exception:
+            self.instrumentation.increment("stage_errors_total", stage=stage)
+            raise
+        finally:
+            timings[stage] = time.perf_counter() - start
+            self.instrumentation.observe("stage_seconds", timings[stage], stage=stage)
+
+    def _context_steps(self, question, rdf_context, timings, deadline, start, question_embedding=None,
+                       parallel=True, sparql_steps=None):
+        """
+        Steps 1 to 4 of the pipeline. Yields ("vector", event) and ("sparql", event) as the
+        stages finish and returns (vector_context, kg_context).
+
+        In parallel mode, SPARQL generation is spawned while the question is embedded and the
+        vector search runs. It starts before the embedding unless the SPARQL cache may have a
+        query for the question. Batches pass the question_embedding they computed for all their
+        questions and a sparql_steps that shares executions between them.
+        """
+        sparql_steps = sparql_steps or self._run_sparql_steps
+        risk_filters = None
+        if self.risk_view is not None:
+            # The graph version check may read from HANA
+            risk_filters = yield _Step("match_risk_view", question)
+
+        # Step 3 does not need the embedding unless the SPARQL cache may answer it
+        sparql_task = None
+        if parallel and risk_filters is None and not self.sparql_cache.may_match(question):
+            sparql_task = yield _Spawn(self._timed_steps(
+                timings, "sparql_generation", self._sparql_query_steps(rdf_context, question, None, timings, deadline)
+            ))
+
+        # Step 1: Embed the question once for the vector search, the SPARQL cache and the risk view
+        if question_embedding is None:
+            question_embedding = yield _Step("embed_question", question, timings=timings, stage="embedding")
+
+        # Step 2-4: Risk-screening questions are answered with one lookup in the supplier risk view
+        if risk_filters is not None:
+            vector_context, kg_context = yield _Step("lookup_risk_view", risk_filters, question_embedding, timings)
+            yield "vector", self._vector_event(vector_context)
+            yield "sparql", self._sparql_event(None, kg_context, timings)
+            return vector_context, kg_context
+
+        # Step 2: Vector Search, in parallel mode while the SPARQL generation runs
+        if parallel and sparql_task is None:
+            sparql_task = yield _Spawn(self._timed_steps(
+                timings, "sparql_generation",
+                self._sparql_query_steps(rdf_context, question, question_embedding, timings, deadline)
+            ))
+        vector_context = yield _Step(
+            "retrieve_vector", question, self.vector_top_k, question_embedding, timings=timings, stage="vector_search"
+        )
+        yield "vector", self._vector_event(vector_context)
+
+        # Step 3: Generate SPARQL
+        if parallel:
+            sparql_query = yield _Join(sparql_task)
+            timings["parallel_join"] = time.perf_counter() - start
+        else:
+            sparql_query = yield from self._timed_steps(
+                timings, "sparql_generation",
+                self._sparql_query_steps(rdf_context, question, question_embedding, timings, deadline)
+            )
+
+        # Step 4: Execute SPARQL, then add the chunks that mention its entities.
+        # Template and cached queries passed validation before, so only generated ones are checked.
+        validate = timings.get("sparql_route") not in ("template", "cache")
+        kg_context, executed_query = yield from self._timed_steps(
+            timings, "sparql_execution", sparql_steps(sparql_query, question, 1, rdf_context, deadline, validate)
+        )
+        vector_context = yield _Step(
+            "add_mentioned_chunks", vector_context, kg_context, question_embedding,
+            timings=timings, stage="mention_lookup"
+        )
+        self._remember_sparql(question_embedding, question, kg_context, executed_query, timings)
+        yield "sparql", self._sparql_event(executed_query, kg_context, timings)
+        return vector_context, kg_context
+
+    def _answer_steps(self, vector_context, kg_context, question, timings, deadline):
+        """
+        Steps 5 and 6 of the pipeline: generates the final answer and restores the original
+        values in it.
+        """
+        # Step 5: Final Answer
+        # Pseudonymization state lives only as long as this request
+        pseudonymizer = Pseudonymizer()
+        pseudonymized_answer = yield from self._timed_steps(
+            timings, "final_answer",
+            self._final_answer_steps(vector_context, kg_context, question, pseudonymizer, deadline)
+        )
+
+        # Step 6: Restore Original Values in the Response
+        return self._timed(
+            timings, "restore", self.restore_original_values_in_response, pseudonymized_answer, pseudonymizer
+        )
+
+    def _stream_answer_steps(self, vector_context, kg_context, question, timings, deadline, start):
+        """
+        Steps 5 and 6 of the streaming pipelines: yields ("token", ...) events with placeholders
+        restored as they complete, and returns the restored answer.
+        """
+        pseudonymizer = Pseudonymizer()
+        restorer = StreamingRestorer(pseudonymizer)
+        final_answer_llm_chain = self.final_answer_prompt | self.llm
+        inputs = self.build_final_answer_inputs(vector_context, kg_context, question, pseudonymizer)
+        stage_start = time.perf_counter()
+        message = None
+        try:
+            chunks = yield _Step("_open_stream", "final_answer", final_answer_llm_chain, inputs, deadline)
+            while True:
+                chunk = yield _Step("_next_chunk", chunks)
+                if chunk is None:
+                    break
+                message = chunk if message is None else message + chunk
+                timings.setdefault("first_token", time.perf_counter() - start)
+                text = restorer.feed(chunk.content)
+                if text:
+                    yield "token", {"text": text}
+        except Exception:
+            self.instrumentation.increment("stage_errors_total", stage="final_answer")
+            raise
+        finally:
+            timings["final_answer"] = time.perf_counter() - stage_start
+            self.instrumentation.observe("stage_seconds", timings["final_answer"], stage="final_answer")
+        text = restorer.flush()
+        if text:
+            yield "token", {"text": text}
+        self._record_llm_usage("final_answer", message)
+
+        return pseudonymizer.restore(message.content.strip()) if message is not None else ""
+
+    def _request_steps(self, question, timings, parallel, stream=False, question_embedding=None,
+                       rdf_context=None, sparql_steps=None):
+        """
+        The whole pipeline for one question, shared by all its variants. With stream=True the
+        answer is yielded as ("token", ...) events followed by ("done", {"answer": ...}).
+        """
+        start = time.perf_counter()
+        deadline = self.llm_scheduler.request_deadline()
+        rdf_context = self.current_rdf_context() if rdf_context is None else rdf_context
+
+        # Step 1-4: Embedding, vector search and SPARQL (or the risk view), reported as they finish
+        vector_context, kg_context = yield from self._context_steps(
+            question, rdf_context, timings, deadline, start, question_embedding, parallel, sparql_steps
+        )
 
-    def hybrid_retrieve_and_answer(self, question):
+        # Step 5 + 6: Final Answer with Original Values restored, streamed as placeholders complete
+        if stream:
+            answer = yield from self._stream_answer_steps(
+                vector_context, kg_context, question, timings, deadline, start
+            )
+        else:
+            answer = yield from self._answer_steps(vector_context, kg_context, question, timings, deadline)
+
+        self._finish_request(timings, start)
+        if stream:
+            yield "done", {"answer": answer}
+        return answer
+
+    def hybrid_retrieve_and_answer(self, question, parallel=None, timings=None):
         """
         Main function to retrieve information and generate an answer.
+
+        If parallel is True (defaults to the retriever setting), the vector search and the
+        SPARQL generation run concurrently and are joined before the SPARQL execution.
+        Pass a dict as timings to receive the per-stage durations in seconds.
+        """
+        parallel = self.parallel if parallel is None else parallel
+        timings = {} if timings is None else timings
+        return self._run(self._request_steps(question, timings, parallel))
+
+    def hybrid_retrieve_and_stream(self, question, timings=None):
+        """
+        Streaming variant of hybrid_retrieve_and_answer.
+
+        Yields (event, data) pairs as the stages finish: "vector" with the number of hits,
+        "sparql" with the executed query (None for answers from the risk view) and its row
+        count, then one "token" per chunk of the final answer with placeholders already
+        restored, and "done" with the full answer.
+        """
+        timings = {} if timings is None else timings
+        return self._drive(self._request_steps(question, timings, self.parallel, stream=True))
+
+    def _batch_indices(self, questions):
+        """
+        Maps each distinct question of a batch to its indices, so that it is answered once.
+        """
+        indices = defaultdict(list)
+        for index, question in enumerate(questions):
+            indices[question].append(index)
+        self.instrumentation.increment("batch_questions_total", len(questions))
+        return indices
+
+    def _shared_sparql_steps(self):
+        """
+        Returns a replacement for _run_sparql_steps with which the questions of one batch that
+        end up with the same SPARQL query share a single execution: later questions wait for
+        the first one.
+        """
+        executions = {}
+        lock = threading.Lock()
+
+        def run_sparql_steps(sparql_query, *args):
+            key = " ".join(sparql_query.split())
+            with lock:
+                execution = executions.get(key)
+                is_owner = execution is None
+                if is_owner:
+                    execution = executions[key] = Future()
+            if not is_owner:
+                self.instrumentation.increment("batch_sparql_shared_total")
+                return (yield _Join(execution))
+            try:
+                result = yield from self._run_sparql_steps(sparql_query, *args)
+                execution.set_result(result)
+            except Exception as e:
+                execution.set_exception(e)
+                raise
+            finally:
+                # Only left open when the whole batch is abandoned
+                if not execution.done():
+                    execution.cancel()
+            return result
+
+        return run_sparql_steps
+
+    def answer_many(self, questions, max_concurrency=None):
+        """
+        Answers a batch of questions and yields one result dict per question as it finishes.
+
+        All questions are embedded in one call, and repeated questions are answered once.
+        Questions that end up with the same SPARQL query share a single execution. At most
+        max_concurrency questions (default: BATCH_MAX_CONCURRENCY) are processed at a time,
+        which bounds the concurrent LLM calls. Each result has the question's "index" in the
+        batch, the "question" and either an "answer" or an "error".
+        """
+        if not questions:
+            return
+        max_concurrency = max_concurrency or self.batch_max_concurrency
+        rdf_context = self.current_rdf_context()
+        indices = self._batch_indices(questions)
+
+        # Step 1: Embed all distinct questions at once
+        embeddings = self._timed({}, "embedding", self.embed_questions, list(indices))
+        sparql_steps = self._shared_sparql_steps()
+
+        def answer(question, question_embedding):
+            # Step 2-6: The batch already runs questions side by side
+            try:
+                return {"answer": self._run(self._request_steps(
+                    question, {}, False, question_embedding=question_embedding,
+                    rdf_context=rdf_context, sparql_steps=sparql_steps
+                ))}
+            except Exception as e:
+                logger.warning("Batch question failed: %s", e)
+                return {"error": str(e)}
+
+        # Step 2-6: Answer the questions on a dedicated pool, so that a large batch
+        # does not starve the single-question requests sharing self.executor
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="hybrid-retriever-batch")
+        try:
+            futures = {
+                executor.submit(answer, question, embedding): question
+                for question, embedding in zip(indices, embeddings)
+            }
+            for future in as_completed(futures):
+                question = futures[future]
+                for index in indices[question]:
+                    yield {"index": index, "question": question, **future.result()}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def aembed_question(self, question):
+        """
+        Async variant of embed_question.
+        """
+        return await self.embedding_model.aembed_query(question)
+
+    async def aembed_questions(self, questions):
+        """
+        Async variant of embed_questions.
+        """
+        embed = getattr(self.embedding_model, "aembed_queries", None) or self.embedding_model.aembed_documents
+        return await embed(questions)
+
+    async def ahybrid_retrieve_and_answer(self, question, timings=None):
+        """
+        Awaitable variant of hybrid_retrieve_and_answer for async servers.
+
+        LLM and embedding calls are awaited natively and blocking HANA calls are moved off
+        the event loop. Vector search and SPARQL generation always run concurrently.
         """
+        timings = {} if timings is None else timings
+        return await self._arun(self._request_steps(question, timings, True))
 
-        # Step 1: Vector Search
-        vector_context = self.retrieve_vector(question)
+    def ahybrid_retrieve_and_stream(self, question, timings=None):
+        """
+        Async variant of hybrid_retrieve_and_stream, yielding the same (event, data) pairs.
+        """
+        timings = {} if timings is None else timings
+        return self._adrive(self._request_steps(question, timings, True, stream=True))
 
-        # Step 2: Generate SPARQL
-        sparql_query = self.generate_sparql_query(get_rdf_context(), question)
+    async def aanswer_many(self, questions, max_concurrency=None):
+        """
+        Async variant of answer_many, yielding the same result dicts.
+        """
+        if not questions:
+            return
+        max_concurrency = max_concurrency or self.batch_max_concurrency
+        rdf_context = self.current_rdf_context()
+        indices = self._batch_indices(questions)
 
-        # Step 3: Execute SPARQL
-        kg_context = self.execute_sparql_with_retry(sparql_query, question)
+        # Step 1: Embed all distinct questions at once
+        embeddings = await self._atimed({}, "embedding", self.aembed_questions, list(indices))
+        sparql_steps = self._shared_sparql_steps()
+        semaphore = asyncio.Semaphore(max_concurrency)
 
-        # Step 4: Final Answer
-        pseudonymized_answer = self.generate_final_answer(vector_context, kg_context, question)
+        async def answer(question, question_embedding):
+            async with semaphore:
+                try:
+                    return question, {"answer": await self._arun(self._request_steps(
+                        question, {}, True, question_embedding=question_embedding,
+                        rdf_context=rdf_context, sparql_steps=sparql_steps
+                    ))}
+                except Exception as e:
+                    logger.warning("Batch question failed: %s", e)
+                    return question, {"error": str(e)}
 
-        # Step 5: Restore Original Values in the Response
-        restored_answer = self.restore_original_values_in_response(pseudonymized_answer)
-        
-        self.hana_client.close()
+        # Step 2-6: Answer the questions, at most max_concurrency at a time
+        tasks = [asyncio.ensure_future(answer(question, embedding))
+                 for question, embedding in zip(indices, embeddings)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                question, result = await next_done
+                for index in indices[question]:
+                    yield {"index": index, "question": question, **result}
+        finally:
+            for task in tasks:
+                task.cancel()
 
-        return restored_answer
+    def close(self):
+        """
+        Releases the dedicated vector store connection and the tenant views, and stops the worker pool.
+        """
+        self.tenants.close()
+        self.executor.shutdown(wait=False)
+        self.llm_scheduler.close()
+        self.sparql_cache.close()
+        if self.vector_replica is not None:
+            self.vector_replica.close()
+        if self.vector_connection is not None:
+            self.pool.release(self.vector_connection)
@@ -0,0 +1,214 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from io import StringIO
+import numpy as np
+from langchain_core.documents import Document
+from entity_mentions import MentionMatcher
+from sparql_router import RISK_PATTERN, TYPE_PATTERN, UNSUPPORTED_PATTERN
+from vector_replica import current_build, new_build, publish_build
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+
+# The columns of the supplier SPARQL template (see sparql_router.py), so that rows from the
+# view are pseudonymized and assembled exactly like a SPARQL result
+PROFILE_COLUMNS = ("supplierName", "supplierType", "supplierId", "address", "city", "email", "phone", "website",
+                   "country", "risk")
+
+def write_risk_view(directory, profiles, chunk_ids, documents, vectors, meta):
+    """
+    Writes a risk view and replaces the previous one in directory.
+
+    profiles are dicts with the PROFILE_COLUMNS values of a supplier as SPARQL returns them
+    ("row") and the ids of its report chunks ("chunks"); chunk_ids, documents and vectors
+    describe every chunk referenced by a profile, row by row. meta is stored in meta.json.
+    The files go into a new build directory that the CURRENT file in directory is then
+    switched to, so readers never load a mix of two builds.
+    """
+    if len(chunk_ids):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(chunk_ids), -1)
+    else:
+        vectors = np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+
+    build = new_build(directory)
+
+    def path(name):
+        return os.path.join(build, name)
+
+    with open(path("vectors.f32"), "wb") as f:
+        f.write(vectors.tobytes())
+    with open(path("chunks.jsonl"), "w") as f:
+        for chunk_id, document in zip(chunk_ids, documents):
+            f.write(json.dumps({"id": chunk_id, "content": document.page_content,
+                                "metadata": document.metadata}) + "\n")
+    with open(path("profiles.jsonl"), "w") as f:
+        for profile in profiles:
+            f.write(json.dumps(profile) + "\n")
+    with open(path("meta.json"), "w") as f:
+        json.dump({**meta, "dim": int(vectors.shape[1]), "count": len(chunk_ids)}, f)
+    publish_build(directory, build)
+
+def read_risk_view(directory):
+    """
+    Reads the current view written by write_risk_view. Returns its meta, profiles, chunk ids,
+    chunk documents and memory-mapped vectors (None without chunks), or None if there is none.
+    """
+    build = current_build(directory)
+    if build is None:
+        return None
+    with open(os.path.join(build, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(build, "profiles.jsonl")) as f:
+        profiles = [json.loads(line) for line in f]
+    chunk_ids, documents = [], []
+    with open(os.path.join(build, "chunks.jsonl")) as f:
+        for line in f:
+            record = json.loads(line)
+            chunk_ids.append(record["id"])
+            documents.append(Document(page_content=record["content"], metadata=record["metadata"]))
+    vectors = np.memmap(os.path.join(build, "vectors.f32"), dtype=np.float32, mode="r",
+                        shape=(meta["count"], meta["dim"])) if meta["count"] else None
+    return meta, profiles, chunk_ids, documents, vectors
+
+class _RiskViewState:
+    __slots__ = ("meta", "rows", "chunk_rows", "by_risk", "documents", "vectors", "entities")
+
+    def __init__(self, meta, rows, chunk_rows, documents, vectors):
+        self.meta = meta
+        self.rows = rows                # PROFILE_COLUMNS values per supplier
+        self.chunk_rows = chunk_rows    # rows of the supplier's chunks in vectors and documents
+        self.documents = documents
+        self.vectors = vectors
+        self.by_risk = {}
+        for i, row in enumerate(rows):
+            if row[-1]:
+                self.by_risk.setdefault(row[-1].lower(), []).append(i)
+
+        # Questions naming suppliers, countries or cities are left to the templates and the LLM
+        aliases = {}
+        for row in rows:
+            for value in (row[0], row[4], row[8]):
+                name = value[len(RAG_NAMESPACE):] if value.startswith(RAG_NAMESPACE) else value
+                if name:
+                    aliases.setdefault(name, name)
+                    aliases.setdefault(name.replace("_", " "), name)
+        self.entities = MentionMatcher(aliases)
+
+class RiskView:
+    """
+    Precomputed per-supplier risk profiles, searched in-process.
+
+    The view is built offline by kge_exercise_build_risk_view.py into a directory: one
+    profile per supplier with its KG attributes and country risk (profiles.jsonl), and the
+    report chunks that mention the supplier with their embeddings (chunks.jsonl and the
+    memory-mapped vectors.f32). Risk-screening questions (a risk level, optionally supplier
+    types, no named entities and no aggregate, negation or comparison wording) are answered
+    with one lookup by risk level instead of SPARQL generation, execution, vector search and
+    mention lookup. A rebuilt view is picked up within check_interval seconds.
+    """
+    def __init__(self, directory, check_interval=30):
+        self.directory = directory
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._state = None
+        self._mtime = None
+        self._checked_at = None
+
+    @property
+    def graph_version(self):
+        """
+        Version stamp of the graph the view was built against, or None if there is no view.
+        """
+        state = self._current()
+        return state.meta.get("graph_version") if state is not None else None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _current(self):
+        """
+        Returns the loaded view, loading it again if CURRENT changed since the last check.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._state
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._state
+            self._checked_at = now
+            try:
+                mtime = os.stat(self._path("CURRENT")).st_mtime_ns
+            except OSError:
+                return self._state
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+            return self._state
+
+    def _load(self):
+        try:
+            view = read_risk_view(self.directory)
+            if view is None:
+                return
+            meta, profiles, chunk_ids, documents, vectors = view
+            row_of = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+            chunk_rows = [
+                np.array([row_of[c] for c in profile["chunks"] if c in row_of], dtype=np.int64)
+                for profile in profiles
+            ]
+            self._state = _RiskViewState(meta, [profile["row"] for profile in profiles], chunk_rows, documents, vectors)
+            logger.info("Loaded supplier risk view with %d profiles and %d chunks from %s",
+                        len(profiles), len(chunk_ids), self.directory)
+        except Exception as e:
+            logger.warning("Could not load supplier risk view from %s: %s", self.directory, e)
+
+    def match(self, question):
+        """
+        Returns the risk levels and supplier types a risk-screening question asks for as
+        {"risk": [...], "type": [...]}, or None if the view cannot answer the question.
+        """
+        text = question.lower()
+        if UNSUPPORTED_PATTERN.search(text):
+            return None
+        risks = list(dict.fromkeys((m.group(1) or m.group(2)).capitalize() for m in RISK_PATTERN.finditer(text)))
+        if not risks:
+            return None
+        state = self._current()
+        if state is None or state.entities.find(question):
+            return None
+        types = list(dict.fromkeys(m.group(1).capitalize() for m in TYPE_PATTERN.finditer(text)))
+        return {"risk": risks, "type": types}
+
+    def lookup(self, filters, question_embedding, top_k=25):
+        """
+        Returns the profiles matching filters (see match) as a SPARQL CSV result, and the
+        top_k of their report chunks closest to the question embedding.
+        """
+        state = self._current()
+        selected = sorted({i for risk in filters["risk"] for i in state.by_risk.get(risk.lower(), ())})
+        if filters["type"]:
+            types = {t.lower() for t in filters["type"]}
+            selected = [i for i in selected if state.rows[i][1].lower() in types]
+
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(PROFILE_COLUMNS)
+        writer.writerows(state.rows[i] for i in selected)
+
+        documents = []
+        if selected and state.vectors is not None:
+            rows = np.unique(np.concatenate([state.chunk_rows[i] for i in selected]))
+            if len(rows):
+                query = np.asarray(question_embedding, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                scores = state.vectors[rows] @ query
+                documents = [state.documents[row] for row in rows[np.argsort(-scores)[:top_k]]]
+        return output.getvalue(), documents
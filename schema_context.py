@@ -0,0 +1,222 @@
+import csv
+import logging
+import threading
+import time
+from io import StringIO
+from prompts import GRAPH_NAME, get_rdf_context
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+
+# One row per predicate: its number of triples, of distinct objects and of IRI objects,
+# and a sample subject and object
+PREDICATE_QUERY = """SELECT ?predicate (COUNT(*) AS ?triples) (COUNT(DISTINCT ?object) AS ?values)
+    (SUM(IF(isIRI(?object), 1, 0)) AS ?iris) (SAMPLE(?subject) AS ?sampleSubject) (SAMPLE(?object) AS ?sampleObject)
+FROM <{graph_name}>
+WHERE {{ ?subject ?predicate ?object . }}
+GROUP BY ?predicate"""
+
+# Which predicates describe the objects of which other predicates, e.g. the country
+# properties reached through rag:locatedIn
+LINK_QUERY = """SELECT DISTINCT ?predicate ?objectPredicate
+FROM <{graph_name}>
+WHERE {{ ?subject ?predicate ?object . ?object ?objectPredicate ?value . }}"""
+
+# All values of the predicates with a small value domain, e.g. risk levels and supplier types
+DOMAIN_QUERY = """SELECT DISTINCT ?predicate ?value
+FROM <{graph_name}>
+WHERE {{
+    ?subject ?predicate ?value .
+    FILTER(?predicate IN ({predicates}))
+}}
+ORDER BY ?predicate ?value"""
+
+# The entity-mention index is looked up by the retriever, never by generated SPARQL. It has a
+# graph of its own, but stores that merge the graphs would otherwise show it.
+EXCLUDED_PREDICATES = {f"{RAG_NAMESPACE}mentionedIn"}
+
+# Longer sample literals are cut, they only show the shape of the values
+SAMPLE_LENGTH = 40
+
+def _term(value, is_iri):
+    if is_iri:
+        return f"rag:{value[len(RAG_NAMESPACE):]}" if value.startswith(RAG_NAMESPACE) else f"<{value}>"
+    if len(value) > SAMPLE_LENGTH:
+        value = value[:SAMPLE_LENGTH - 3] + "..."
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _rows(results):
+    return list(csv.DictReader(StringIO(results)))
+
+def build_schema_contexts(predicates, links):
+    """
+    Returns the RDF context variants for the introspected predicates, largest first:
+    "full" with sample values and example triples, "compact" with sample values and
+    "minimal" with value domains only. Every variant lists every predicate.
+
+    predicates are dicts with the predicate IRI ("name"), "kind" ("IRI", "Literal" or
+    "IRI or Literal"), "domain" (all values, or None), "subject" and "object" (samples);
+    links maps a predicate to the predicate whose objects it describes.
+    """
+    groups = {}
+    for predicate in predicates:
+        groups.setdefault(links.get(predicate["name"]), []).append(predicate)
+
+    def heading(link, members, with_samples):
+        subject = members[0]["subject"]
+        if link is None:
+            sample = f" such as {_term(subject, True)}" if with_samples else ""
+            return f"Entities{sample} have the following properties:"
+        sample = f" (such as {_term(subject, True)})" if with_samples else ""
+        return f"Entities referenced by {_term(link, True)}{sample} have the following properties:"
+
+    def line(predicate, with_samples):
+        is_iri = predicate["kind"] == "IRI"
+        text = f"- {_term(predicate['name'], True)} → {predicate['kind']}"
+        domain = predicate["domain"]
+        if domain:
+            values = [_term(value, is_iri) for value in domain]
+            text += ": " + (f"{', '.join(values[:-1])} or {values[-1]}" if len(values) > 1 else values[0])
+        elif with_samples:
+            text += f", e.g. {_term(predicate['object'], is_iri)}"
+        return text + "."
+
+    def render(with_samples, with_examples):
+        lines = ["Your RDF graph uses the following structure:", "", "Namespaces:", f"- rag: <{RAG_NAMESPACE}>"]
+        # Entities that are not referenced by another predicate first, e.g. suppliers before countries
+        for link in sorted(groups, key=lambda link: (link is not None, link or "")):
+            members = groups[link]
+            lines += ["", heading(link, members, with_samples)]
+            lines += [line(predicate, with_samples) for predicate in members]
+        if with_examples:
+            lines += ["", "Example triples:"]
+            lines += [
+                f"- {_term(p['subject'], True)} {_term(p['name'], True)} "
+                f"{_term(p['object'], p['kind'] == 'IRI')} ."
+                for p in predicates
+            ]
+        return "\n".join(lines) + "\n"
+
+    return [
+        ("full", render(True, True)),
+        ("compact", render(True, False)),
+        ("minimal", render(False, False))
+    ]
+
+class SchemaContext:
+    """
+    RDF context for the SPARQL prompts, introspected from the live graph.
+
+    The predicates of the graph, the values of those with a small value domain (such as risk
+    levels and supplier types) and sample IRIs and literals are read with three queries on
+    first use. Of the context variants built from them, the largest that fits token_budget is
+    kept until reset(), which the retriever calls when the graph version changes. While the
+    graph cannot be read, the hand-written fallback context is used and loading is retried
+    after retry_interval seconds. on_load is called with every newly loaded context.
+    """
+    def __init__(self, hana_client, graph_name=GRAPH_NAME, counter=None, token_budget=250, fallback=None,
+                 max_domain_values=8, retry_interval=300, on_load=None):
+        self.hana_client = hana_client
+        self.graph_name = graph_name
+        self.counter = counter
+        self.token_budget = token_budget
+        self.fallback = fallback or get_rdf_context()
+        self.max_domain_values = max_domain_values
+        self.retry_interval = retry_interval
+        self.on_load = on_load
+
+        self._lock = threading.Lock()
+        self._context = None
+        self._failed_at = None
+
+    def get(self):
+        """
+        Returns the RDF context of the graph, or the fallback context if it cannot be read.
+        """
+        context = self._load()
+        return context if context is not None else self.fallback
+
+    def warm_up(self):
+        """
+        Loads the context ahead of the first question. Returns False if that failed.
+        """
+        return self._load() is not None
+
+    def reset(self):
+        """
+        Forgets the loaded context, e.g. after the graph was reloaded.
+        """
+        with self._lock:
+            self._context = None
+            self._failed_at = None
+
+    def _load(self):
+        with self._lock:
+            if self._context is not None:
+                return self._context
+            if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+                return None
+            try:
+                predicates, links = self._introspect()
+            except Exception as e:
+                logger.warning("Could not introspect graph %s, using the static RDF context: %s", self.graph_name, e)
+                self._failed_at = time.monotonic()
+                return None
+
+            if self.counter is None:
+                from context_assembly import TokenCounter
+                self.counter = TokenCounter()
+            variants = build_schema_contexts(predicates, links)
+            for variant, context in variants:
+                tokens = self.counter.count(context)
+                if tokens <= self.token_budget:
+                    break
+            logger.info("RDF context of graph %s: %d predicates, %s variant with %d tokens (static context: %d)",
+                        self.graph_name, len(predicates), variant, tokens, self.counter.count(self.fallback))
+            self._context = context
+            if self.on_load is not None:
+                self.on_load(context)
+            return context
+
+    def _introspect(self):
+        """
+        Returns the predicates of the graph (see build_schema_contexts) and the links between them.
+        """
+        # Step 1: Predicates with their counts and samples
+        rows = _rows(self.hana_client.execute_raw_sparql(PREDICATE_QUERY.format(graph_name=self.graph_name))[0])
+        predicates = []
+        for row in rows:
+            if row["predicate"] in EXCLUDED_PREDICATES:
+                continue
+            triples, values, iris = int(row["triples"]), int(row["values"]), int(row["iris"] or 0)
+            predicates.append({
+                "name": row["predicate"],
+                "kind": "IRI" if iris == triples else "Literal" if iris == 0 else "IRI or Literal",
+                # Only values that repeat make a domain; unique ones such as ids are shown as samples
+                "domain": [] if values <= self.max_domain_values and values * 2 <= triples else None,
+                "subject": row["sampleSubject"],
+                "object": row["sampleObject"]
+            })
+        if not predicates:
+            raise ValueError("the graph has no triples")
+        # IRI-valued predicates first, e.g. rag:locatedIn before the literal properties
+        predicates.sort(key=lambda p: (p["kind"] != "IRI", p["name"]))
+
+        # Step 2: Value domains
+        with_domain = {p["name"]: p for p in predicates if p["domain"] is not None}
+        if with_domain:
+            query = DOMAIN_QUERY.format(
+                graph_name=self.graph_name, predicates=", ".join(f"<{name}>" for name in with_domain)
+            )
+            for row in _rows(self.hana_client.execute_raw_sparql(query)[0]):
+                with_domain[row["predicate"]]["domain"].append(row["value"])
+
+        # Step 3: Links from IRI-valued predicates to the properties of their objects
+        links = {}
+        known = {p["name"] for p in predicates}
+        rows = _rows(self.hana_client.execute_raw_sparql(LINK_QUERY.format(graph_name=self.graph_name))[0])
+        for row in sorted(rows, key=lambda row: row["predicate"]):
+            if row["predicate"] != row["objectPredicate"] and {row["predicate"], row["objectPredicate"]} <= known:
+                links.setdefault(row["objectPredicate"], row["predicate"])
+        return predicates, links
@@ -0,0 +1,259 @@
+import logging
+import os
+import re
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+")
+# Apostrophes inside words ("supplier's") do not open a quote
+QUOTED_PATTERN = re.compile(r"\"([^\"]+)\"|(?<!\w)'([^']+)'(?!\w)")
+IRI_PATTERN = re.compile(r"<([^<>\s]+)>|\b\w+:(\w+)")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+def _words(text):
+    return " ".join(WORD_PATTERN.findall(text.replace("_", " ").lower()))
+
+def _local_name(iri):
+    return iri.rstrip("/").rsplit("/", 1)[-1].rsplit("#", 1)[-1]
+
+def question_entities(question):
+    """
+    Returns the values a question is specific to: quoted strings, IRIs, numbers and the
+    capitalized words inside a sentence, such as the "Germany" of "Which suppliers are in
+    Germany?". Questions with different values must not share a cached query.
+    """
+    entities = set()
+    for match in QUOTED_PATTERN.finditer(question):
+        entities.add(_words(match.group(1) or match.group(2)))
+    for match in IRI_PATTERN.finditer(question):
+        entities.add(_words(_local_name(match.group(1)) if match.group(1) else match.group(2)))
+    entities.update(NUMBER_PATTERN.findall(question))
+    for sentence in SENTENCE_PATTERN.findall(QUOTED_PATTERN.sub(" ", question)):
+        for word in WORD_PATTERN.findall(sentence)[1:]:
+            if word[0].isupper() and word != "I":
+                entities.add(_words(word))
+    entities.discard("")
+    return frozenset(entities)
+
+def query_constants(sparql_query, question):
+    """
+    Returns the IRIs and literals of a SPARQL query that were taken from the question it
+    answers, e.g. rag:Germany or "High", as lowercase words. A similar question can only
+    reuse the query if it names all of them too.
+    """
+    text = f" {_words(question)} "
+    constants = set()
+    for match in IRI_PATTERN.finditer(sparql_query):
+        constants.add(_words(_local_name(match.group(1)) if match.group(1) else match.group(2)))
+    for match in QUOTED_PATTERN.finditer(sparql_query):
+        constants.add(_words(match.group(1) or match.group(2)))
+    return tuple(sorted(c for c in constants if c and f" {c} " in text))
+
+class SemanticQueryCache:
+    """
+    Cache of validated SPARQL queries, looked up by the embedding of the question they answered.
+
+    Embeddings are kept L2-normalized in a preallocated NumPy matrix, so a lookup is a single
+    matrix-vector product. Embeddings of questions about different entities are close, so an
+    entry only matches a question with the same entities (see question_entities) that also
+    names the values its query was built from (see query_constants). Entries expire after
+    ttl seconds and the least recently used entry is evicted once max_entries is reached.
+    If persist_path is set, the cache is loaded from that .npz file, and changes are written
+    to it in the background at most every save_interval seconds and on close().
+    """
+    def __init__(self, threshold=0.95, max_entries=1000, ttl=7 * 24 * 3600, persist_path=None, save_interval=30):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        # Taken before self._lock, so that snapshots are written in the order they were taken
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._dirty = False
+        self._vectors = None  # allocated on first insert, once the embedding size is known
+        self._active = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._questions = [None] * max_entries
+        self._queries = [None] * max_entries
+        self._entities = [None] * max_entries
+        self._constants = [None] * max_entries
+        self._slots_by_entities = {}
+        self._slots_by_question = {}
+
+        if persist_path and os.path.exists(persist_path):
+            self._load()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = self._active & (now - self._created > self.ttl)
+        self._active[expired] = False
+
+    def _candidates(self, question):
+        """
+        Active slots whose entities and query constants fit the question.
+        """
+        entities = question_entities(question)
+        text = f" {_words(question)} "
+        return [
+            slot for slot in self._slots_by_entities.get(entities, ())
+            if self._active[slot] and all(f" {c} " in text for c in self._constants[slot])
+        ]
+
+    def may_match(self, question):
+        """
+        Returns False if no cached query can be reused for the question, whatever its
+        embedding, so that the caller need not wait for the embedding to find out.
+        """
+        with self._lock:
+            # Cosine similarity never exceeds 1, so a higher threshold disables the cache
+            if self._vectors is None or self.threshold > 1:
+                return False
+            self._expire(time.time())
+            return bool(self._candidates(question))
+
+    def get(self, embedding, question):
+        """
+        Returns the cached SPARQL query of the most similar past question about the same
+        entities, or None.
+        """
+        with self._lock:
+            if self._vectors is None or not self._active.any():
+                return None
+            now = time.time()
+            self._expire(now)
+            candidates = self._candidates(question)
+            if not candidates:
+                return None
+
+            scores = self._vectors[candidates] @ self._normalize(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            slot = candidates[best]
+            self._last_used[slot] = now
+            logger.debug("SPARQL cache hit (similarity %.3f) for question: %s", scores[best], self._questions[slot])
+            return self._queries[slot]
+
+    def put(self, embedding, question, sparql_query):
+        """
+        Stores a SPARQL query that executed successfully for the given question.
+        """
+        vector = self._normalize(embedding)
+        entities = question_entities(question)
+        constants = query_constants(sparql_query, question)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            now = time.time()
+            self._expire(now)
+
+            # Refresh an identical question instead of storing it twice; the slot of an expired one is free
+            slot = self._slots_by_question.get(question)
+            if slot is None and not self._active.all():
+                slot = int(np.argmin(self._active))
+            elif slot is None:
+                slot = int(np.argmin(self._last_used))
+
+            self._store(slot, vector, now, now, question, sparql_query, entities, constants)
+            self._schedule_save()
+
+    def _store(self, slot, vector, created, last_used, question, sparql_query, entities, constants):
+        if self._entities[slot] is not None:
+            self._slots_by_entities[self._entities[slot]].discard(slot)
+            if self._slots_by_question.get(self._questions[slot]) == slot:
+                del self._slots_by_question[self._questions[slot]]
+        self._vectors[slot] = vector
+        self._active[slot] = True
+        self._created[slot] = created
+        self._last_used[slot] = last_used
+        self._questions[slot] = question
+        self._queries[slot] = sparql_query
+        self._entities[slot] = entities
+        self._constants[slot] = constants
+        self._slots_by_entities.setdefault(entities, set()).add(slot)
+        self._slots_by_question[question] = slot
+
+    def clear(self):
+        with self._lock:
+            self._active[:] = False
+            self._schedule_save()
+
+    def _schedule_save(self):
+        """
+        Marks the cache as changed and schedules a background save; called with self._lock held.
+        """
+        if not self.persist_path:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_interval, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """
+        Writes pending changes to persist_path. Only copying the entries holds the lock.
+        """
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                slots = np.flatnonzero(self._active)
+                snapshot = {
+                    "vectors": self._vectors[slots],
+                    "created": self._created[slots],
+                    "last_used": self._last_used[slots],
+                    "questions": np.array([self._questions[i] for i in slots], dtype=str),
+                    "queries": np.array([self._queries[i] for i in slots], dtype=str)
+                }
+            try:
+                tmp_path = self.persist_path + ".tmp.npz"
+                np.savez(tmp_path, **snapshot)
+                os.replace(tmp_path, self.persist_path)
+            except Exception as e:
+                logger.warning("Could not save SPARQL cache to %s: %s", self.persist_path, e)
+
+    def close(self):
+        """
+        Cancels the scheduled save and writes pending changes right away.
+        """
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+        if self.persist_path:
+            self.flush()
+
+    def _load(self):
+        try:
+            with np.load(self.persist_path) as data:
+                vectors = data["vectors"]
+                count = min(len(vectors), self.max_entries)
+                if count == 0:
+                    return
+                # Keep the most recently used entries if the file holds more than fit
+                order = np.argsort(data["last_used"])[::-1][:count]
+                self._vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+                for slot, i in enumerate(order):
+                    question, query = str(data["questions"][i]), str(data["queries"][i])
+                    self._store(slot, vectors[i], data["created"][i], data["last_used"][i], question, query,
+                                question_entities(question), query_constants(query, question))
+            self._expire(time.time())
+        except Exception as e:
+            logger.warning("Could not load SPARQL cache from %s: %s", self.persist_path, e)
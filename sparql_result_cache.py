@@ -0,0 +1,274 @@
+import csv
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import StringIO
+from instrumentation import get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+GRAPH_VERSION_IRI = f"<{RAG_NAMESPACE}graphVersion>"
+GRAPH_VERSION_PREDICATE = f"<{RAG_NAMESPACE}hasVersion>"
+
+# One token per match: comments and whitespace are dropped, everything else is kept as-is
+TOKEN_PATTERN = re.compile(r'''
+    (?P<comment>\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\'|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<iri><[^<>"{}|^`\\\s]*>)
+  | (?P<variable>[?$][A-Za-z0-9_]+)
+  | (?P<blank>_:[A-Za-z0-9_\-.]*)
+  | (?P<prefixed>[A-Za-z][\w\-.]*:[\w%\-]*(?:\.[\w%\-]+)*|:[\w%\-]*(?:\.[\w%\-]+)*)
+  | (?P<word>[A-Za-z_][\w\-]*)
+  | (?P<other>@[A-Za-z]+(?:-[A-Za-z0-9]+)*|\^\^|&&|\|\||!=|<=|>=|[^\s])
+''', re.VERBOSE | re.DOTALL)
+
+READ_FORMS = {"select", "ask", "construct", "describe"}
+
+def normalize_sparql(query):
+    """
+    Returns a canonical form of a SPARQL query and its variable names in order of appearance.
+
+    Comments and layout are dropped, prefixed names are expanded to full IRIs, keywords are
+    lower-cased and variables are renamed ?v0, ?v1, ... in the order they first appear, so
+    queries that differ only in these respects share a key.
+    """
+    prefixes, tokens, variables = {}, [], {}
+    pending_prefix = None
+    for match in TOKEN_PATTERN.finditer(query):
+        kind, text = match.lastgroup, match.group()
+        if kind in ("comment", "space"):
+            continue
+        if pending_prefix is not None:
+            # Completing a PREFIX declaration: "PREFIX rag: <iri>"
+            if pending_prefix == "" and kind == "prefixed" and text.endswith(":"):
+                pending_prefix = text[:-1]
+                continue
+            if kind == "iri":
+                prefixes[pending_prefix] = text[1:-1]
+                pending_prefix = None
+                continue
+            tokens.append("prefix")
+            pending_prefix = None
+        if kind == "word" and text.lower() == "prefix":
+            pending_prefix = ""
+        elif kind == "variable":
+            name = text[1:]
+            variables.setdefault(name, f"v{len(variables)}")
+            tokens.append("?" + variables[name])
+        elif kind == "prefixed":
+            prefix, _, local = text.partition(":")
+            namespace = prefixes.get(prefix)
+            tokens.append(f"<{namespace}{local}>" if namespace is not None else text)
+        elif kind == "word":
+            tokens.append(text if text == "a" else text.lower())
+        else:
+            tokens.append(text)
+    return " ".join(tokens), list(variables)
+
+def read_graph_version(client, graph_name):
+    """
+    Returns the version stamp the KG loader last wrote for the graph, or "" if there is none.
+    """
+    results = client.execute_raw_sparql(
+        f"SELECT ?version FROM <{graph_name}_meta> "
+        f"WHERE {{ {GRAPH_VERSION_IRI} {GRAPH_VERSION_PREDICATE} ?version . }}"
+    )[0]
+    rows = list(csv.reader(StringIO(results)))
+    return rows[1][0] if len(rows) > 1 and rows[1] else ""
+
+def bump_graph_version(client, graph_name):
+    """
+    Writes a new version stamp for the graph, so that cached query results are invalidated.
+    Must be called after every change to the graph's triples.
+    """
+    version = uuid.uuid4().hex
+    client.execute_raw_sparql(
+        f"DELETE WHERE {{ GRAPH <{graph_name}_meta> {{ {GRAPH_VERSION_IRI} {GRAPH_VERSION_PREDICATE} ?version . }} }}"
+    )
+    client.execute_raw_sparql(
+        f'INSERT DATA {{ GRAPH <{graph_name}_meta> {{ {GRAPH_VERSION_IRI} {GRAPH_VERSION_PREDICATE} "{version}" . }} }}'
+    )
+    return version
+
+class SparqlResultCache:
+    """
+    LRU cache of SPARQL_EXECUTE results, bounded by the total size of the cached results.
+
+    Results are keyed by the normalized query (see normalize_sparql) and belong to the graph
+    version current when the query was sent. The version is re-read through version_loader
+    before a cached result is served if it was last read more than max_staleness seconds ago
+    (default 0: on every hit), and otherwise at most every version_check_interval seconds.
+    After the KG loader bumped the version, results of the old graph are therefore served for
+    at most max_staleness seconds. When the version changes, every cached result is dropped
+    and on_version_change is called. While the version cannot be read, nothing is cached.
+    """
+    def __init__(self, version_loader=None, max_bytes=64 * 1024 * 1024, version_check_interval=30,
+                 on_version_change=None, max_staleness=0):
+        self.version_loader = version_loader
+        self.max_bytes = max_bytes
+        self.version_check_interval = version_check_interval
+        self.on_version_change = on_version_change
+        self.max_staleness = max_staleness
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # normalized query -> (results, metadata, variable names, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._version = "" if version_loader is None else None
+        self._known_version = self._version
+        self._checked_at = None  # when the last version read started
+
+    def current_version(self, max_age=None):
+        """
+        Returns the graph version, re-reading it if the last read started more than max_age
+        seconds ago (default: version_check_interval). With max_age=0, the version returned
+        was read after the call started.
+        Returns None if the version is unknown and results must not be cached.
+        """
+        if self.version_loader is None:
+            return self._version
+        max_age = self.version_check_interval if max_age is None else max_age
+        asked_at = time.monotonic()
+        checked_at = self._checked_at
+        if checked_at is not None and asked_at - checked_at < max_age:
+            return self._version
+        # One thread re-reads the version; the others keep using the last known one, unless
+        # they need a fresh one and wait for it
+        if not self._refresh_lock.acquire(blocking=checked_at is None or max_age == 0):
+            return self._version
+        try:
+            if self._checked_at != checked_at and (max_age or self._checked_at >= asked_at):
+                return self._version
+            started_at = time.monotonic()
+            try:
+                version = self.version_loader()
+            except Exception as e:
+                logger.warning("Could not read the graph version, bypassing the SPARQL result cache: %s", e)
+                version = None
+            self._checked_at = started_at
+            if version != self._version:
+                with self._lock:
+                    self._version = version
+                    self._entries.clear()
+                    self._size = 0
+            if version is not None and version != self._known_version:
+                if self._known_version is not None:
+                    logger.info("Graph version changed from %s to %s", self._known_version, version)
+                    get_instrumentation().increment("cache_invalidations_total", cache="sparql_result")
+                    if self.on_version_change is not None:
+                        self.on_version_change()
+                self._known_version = version
+            return version
+        finally:
+            self._refresh_lock.release()
+
+    def get(self, key, variables, version):
+        """
+        Returns the cached (results, metadata) for a normalized query at this version, or None.
+        The version is confirmed first if it was read more than max_staleness seconds ago.
+        """
+        entry = self._entry(key, version)
+        if (entry is not None and self.version_loader is not None
+                and time.monotonic() - self._checked_at >= self.max_staleness):
+            # The KG loader may have bumped the version since
+            entry = self._entry(key, self.current_version(self.max_staleness))
+        with self._lock:
+            if entry is not None:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        get_instrumentation().increment(
+            "cache_requests_total", cache="sparql_result", result="hit" if entry is not None else "miss"
+        )
+        if entry is None:
+            return None
+        results, metadata, cached_variables, _ = entry
+        if cached_variables != variables:
+            results = _rename_columns(results, cached_variables, variables)
+        return results, metadata
+
+    def _entry(self, key, version):
+        with self._lock:
+            return self._entries.get(key) if version is not None and version == self._version else None
+
+    def put(self, key, variables, version, results, metadata):
+        """
+        Stores the result of a normalized query that was sent while the graph was at version.
+        Results of an outdated version are not stored.
+        """
+        size = len(key) + len(str(results)) + len(str(metadata))
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            if version is None or version != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[3]
+            self._entries[key] = (results, metadata, variables, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, _, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted += 1
+        if evicted:
+            get_instrumentation().increment("cache_evictions_total", evicted, cache="sparql_result")
+
+    def invalidate(self):
+        """
+        Drops every cached result.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+def _rename_columns(results, cached_variables, variables):
+    """
+    Rewrites the CSV header of a cached result to the variable names of an equivalent query.
+    """
+    if not isinstance(results, str):
+        return results
+    names = dict(zip(cached_variables, variables))
+    header, newline, body = results.partition("\n")
+    columns = [names.get(column.strip(), column.strip()) for column in header.split(",")]
+    return ",".join(columns) + ("\r" if header.endswith("\r") else "") + newline + body
+
+class CachedSparqlClient:
+    """
+    Drop-in wrapper around a HanaClient that answers repeated read queries from a
+    SparqlResultCache. Updates go through to the client and clear the local cache.
+    """
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def execute_raw_sparql(self, sparql_query):
+        key, variables = normalize_sparql(sparql_query)
+        # The query form is the first keyword after the prologue
+        form = next((token for token in key.split(" ") if token.isalpha() and token != "base"), "")
+        if form not in READ_FORMS:
+            try:
+                return self.client.execute_raw_sparql(sparql_query)
+            finally:
+                self.cache.invalidate()
+
+        version = self.cache.current_version()
+        cached = self.cache.get(key, variables, version)
+        if cached is not None:
+            return cached
+        results, metadata = self.client.execute_raw_sparql(sparql_query)
+        self.cache.put(key, variables, version, results, metadata)
+        return results, metadata
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,180 @@
+import csv
+import logging
+import re
+import threading
+import time
+from io import StringIO
+from prompts import GRAPH_NAME
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+
+ENTITY_QUERY = """PREFIX rag: <http://sap.com/rag/>
+SELECT DISTINCT ?supplierName ?country ?city
+FROM <{graph_name}>
+WHERE {{
+    ?supplierName rag:locatedIn ?country .
+    OPTIONAL {{ ?supplierName rag:locatedInCity ?city . }}
+}}"""
+
+SUPPLIER_TEMPLATE = """PREFIX rag: <http://sap.com/rag/>
+SELECT ?supplierName ?supplierType ?supplierId ?address ?city ?email ?phone ?website ?country ?risk
+FROM <{graph_name}>
+WHERE {{
+    ?supplierName rag:locatedIn ?country .
+    OPTIONAL {{ ?supplierName rag:hasSupplierType ?supplierType . }}
+    OPTIONAL {{ ?supplierName rag:hasSupplierId ?supplierId . }}
+    OPTIONAL {{ ?supplierName rag:hasAddress ?address . }}
+    OPTIONAL {{ ?supplierName rag:locatedInCity ?city . }}
+    OPTIONAL {{ ?supplierName rag:hasEmail ?email . }}
+    OPTIONAL {{ ?supplierName rag:hasPhone ?phone . }}
+    OPTIONAL {{ ?supplierName rag:hasWebsite ?website . }}
+    OPTIONAL {{ ?country rag:hasGeopoliticalRisk ?risk . }}
+{filters}
+}}"""
+
+RISK_PATTERN = re.compile(
+    r"\b(high|medium|low)(?:[- ]?(?:geopolitical|political))?[- ]?risks?\b"
+    r"|\brisk(?: level)?(?: is| of)? (high|medium|low)\b"
+)
+TYPE_PATTERN = re.compile(r"\b(manufacturer|reseller)s?\b")
+
+# Question shapes the templates cannot express: aggregates, negation, comparison, ranking
+UNSUPPORTED_PATTERN = re.compile(
+    r"\b(how many|number of|count|most|least|average|more than|less than|fewer|compare|"
+    r"not|no|except|excluding|without|other than|outside|per|each|rank|top|bottom|percentage)\b"
+)
+
+def _local_name(value):
+    return value[len(RAG_NAMESPACE):] if value.startswith(RAG_NAMESPACE) else value
+
+class EntityMatcher:
+    """
+    Finds known entity names in a question as whole words, case-insensitively.
+    IRI names match with underscores or spaces, e.g. North_Korea and "north korea".
+    """
+    def __init__(self, names):
+        self.by_text = {}
+        for name in names:
+            self.by_text.setdefault(name.lower(), name)
+            self.by_text.setdefault(name.replace("_", " ").lower(), name)
+        # Longest names first, so "north korea" wins over "north"
+        alternation = "|".join(re.escape(text) for text in sorted(self.by_text, key=len, reverse=True))
+        self.pattern = re.compile(rf"\b(?:{alternation})\b") if self.by_text else None
+
+    def find(self, text):
+        if self.pattern is None:
+            return []
+        return list(dict.fromkeys(self.by_text[match] for match in self.pattern.findall(text)))
+
+class TemplateRouter:
+    """
+    Answers common question shapes with a parameterized SPARQL template instead of the LLM.
+
+    Supplier, country and city names are loaded once from the graph and matched as whole
+    words; risk levels and supplier types are matched by keyword. A question that names at
+    least one of them and has no aggregate, negation or comparison wording is answered by
+    filtering the full supplier row. Attributes a supplier lacks, and the risk of a country
+    without a status, come back empty instead of dropping the supplier. route() returns
+    None for everything else, and the caller falls back to the LLM.
+    """
+    def __init__(self, hana_client, graph_name=GRAPH_NAME, retry_interval=300):
+        self.hana_client = hana_client
+        self.graph_name = graph_name
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._matchers = None
+        self._failed_at = None
+
+    def _load(self):
+        """
+        Loads the supplier, country and city names from the graph on first use.
+        If that fails, routing is disabled until retry_interval seconds have passed.
+        """
+        with self._lock:
+            if self._matchers is not None:
+                return self._matchers
+            if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+                return None
+            try:
+                results = self.hana_client.execute_raw_sparql(ENTITY_QUERY.format(graph_name=self.graph_name))[0]
+            except Exception as e:
+                logger.warning("Could not load entities for SPARQL templates: %s", e)
+                self._failed_at = time.monotonic()
+                return None
+
+            suppliers, countries, cities = set(), set(), set()
+            for row in csv.DictReader(StringIO(results)):
+                suppliers.add(_local_name(row["supplierName"]))
+                countries.add(_local_name(row["country"]))
+                if row.get("city"):
+                    cities.add(row["city"])
+            self._matchers = {
+                "supplier": EntityMatcher(suppliers),
+                "country": EntityMatcher(countries),
+                "city": EntityMatcher(cities)
+            }
+            logger.info("SPARQL templates know %d suppliers, %d countries and %d cities",
+                        len(suppliers), len(countries), len(cities))
+            return self._matchers
+
+    def warm_up(self):
+        """
+        Loads the entity names ahead of the first question. Returns False if that failed.
+        """
+        return self._load() is not None
+
+    def reset(self):
+        """
+        Forgets the loaded entity names, e.g. after the graph was reloaded.
+        """
+        with self._lock:
+            self._matchers = None
+            self._failed_at = None
+
+    def route(self, question):
+        """
+        Returns (intent, sparql_query) for a question that fits a template, otherwise None.
+        """
+        text = question.lower()
+        if UNSUPPORTED_PATTERN.search(text):
+            return None
+        matchers = self._load()
+        if matchers is None:
+            return None
+
+        suppliers = matchers["supplier"].find(text)
+        countries = matchers["country"].find(text)
+        cities = matchers["city"].find(text)
+        risks = list(dict.fromkeys((m.group(1) or m.group(2)).capitalize() for m in RISK_PATTERN.finditer(text)))
+        types = list(dict.fromkeys(m.group(1).capitalize() for m in TYPE_PATTERN.finditer(text)))
+
+        filters, intent = [], []
+        if suppliers:
+            filters.append(_in_filter("supplierName", [f"rag:{name}" for name in suppliers]))
+            intent.append("supplier")
+        if countries:
+            filters.append(_in_filter("country", [f"rag:{name}" for name in countries]))
+            intent.append("country")
+        if cities:
+            filters.append(_in_filter("city", [_literal(name) for name in cities]))
+            intent.append("city")
+        if risks:
+            filters.append(_in_filter("risk", [_literal(risk) for risk in risks]))
+            intent.append("risk")
+        if types:
+            filters.append(_in_filter("supplierType", [_literal(t) for t in types]))
+            intent.append("type")
+        if not filters:
+            return None
+
+        query = SUPPLIER_TEMPLATE.format(graph_name=self.graph_name, filters="\n".join(filters))
+        return "+".join(intent), query
+
+def _literal(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _in_filter(variable, values):
+    return f"    FILTER(?{variable} IN ({', '.join(values)}))"
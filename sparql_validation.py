@@ -0,0 +1,287 @@
+import difflib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from rdflib import URIRef, Variable
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+from prompts import GRAPH_NAME, get_rdf_context
+from sparql_result_cache import TOKEN_PATTERN, normalize_sparql
+
+logger = logging.getLogger(__name__)
+
+RAG_NAMESPACE = "http://sap.com/rag/"
+PREFIX_DECLARATION = f"PREFIX rag: <{RAG_NAMESPACE}>"
+
+# Predicate that binds each of the query variables offered in the SPARQL prompt,
+# and whether its subject is the supplier or the country. None stands for the entity itself.
+VARIABLE_BINDINGS = {
+    "supplierName": ("supplier", None),
+    "supplierType": ("supplier", "hasSupplierType"),
+    "supplierId": ("supplier", "hasSupplierId"),
+    "address": ("supplier", "hasAddress"),
+    "city": ("supplier", "locatedInCity"),
+    "email": ("supplier", "hasEmail"),
+    "phone": ("supplier", "hasPhone"),
+    "website": ("supplier", "hasWebsite"),
+    "country": ("supplier", "locatedIn"),
+    "risk": ("country", "hasGeopoliticalRisk"),
+}
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:sparql)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+SPARQL_EXECUTE_PATTERN = re.compile(r"CALL\s+SPARQL_EXECUTE\s*\(\s*'(.*?)'", re.DOTALL | re.IGNORECASE)
+PREFIX_PATTERN = re.compile(r"PREFIX\s+rag\s*:", re.IGNORECASE)
+GRAPH_IRI_PATTERN = re.compile(r"\b(FROM(?:\s+NAMED)?|GRAPH)(\s+)<([^>]*)>", re.IGNORECASE)
+GRAPH_VARIABLE_PATTERN = re.compile(r"\bGRAPH\s+[?$]\w+", re.IGNORECASE)
+SCHEMA_PREDICATE_PATTERN = re.compile(r"rag:(\w+)\s*→")
+
+# rdflib's pyparsing grammar keeps parse state in shared objects and is not thread-safe
+_parse_lock = threading.Lock()
+
+def schema_predicates(rdf_context):
+    """
+    Returns the rag: predicate names described in the RDF context given to the LLM.
+    """
+    return set(SCHEMA_PREDICATE_PATTERN.findall(rdf_context))
+
+class SparqlValidator:
+    """
+    Checks generated SPARQL locally before it is sent to HANA.
+
+    Cheap, deterministic problems are repaired in place: code fences or a SPARQL_EXECUTE
+    wrapper around the query, a missing rag: prefix, a missing or wrong graph name,
+    misspelled schema predicates and SELECTed variables that WHERE never binds, if their
+    name says what to bind them to (see VARIABLE_BINDINGS). Anything else is reported as an
+    error: syntax errors, rag: predicates that are not in the schema, and SELECTed variables
+    that WHERE never binds and that cannot be bound that way. Only those queries go back to
+    the LLM. rdflib parses one query at a time, so the
+    outcome of the last memo_size queries is remembered by their normalized form.
+    """
+    def __init__(self, graph_name=GRAPH_NAME, rdf_context=None, memo_size=1024):
+        self.graph_name = graph_name
+        self.memo_size = memo_size
+        self._memo_lock = threading.Lock()
+        self.update_schema(rdf_context or get_rdf_context())
+
+    def update_schema(self, rdf_context):
+        """
+        Replaces the known predicates with the ones of an RDF context, e.g. one introspected
+        from the live graph (see schema_context.py).
+        """
+        predicates = schema_predicates(rdf_context)
+        self.predicates, self._predicates_by_lower = predicates, {p.lower(): p for p in predicates}
+        # Outcomes for the previous predicates no longer hold
+        self._memo = OrderedDict()
+
+    def validate(self, sparql_query):
+        """
+        Returns the repaired query, the names of the repairs applied and the remaining errors.
+        """
+        # Layout, comments and keyword case do not change the outcome; variable names and the
+        # graph (views of other tenants share the memo) do
+        canonical, variables = normalize_sparql(sparql_query)
+        key = (self.graph_name, canonical, tuple(variables))
+        memo = self._memo
+        with self._memo_lock:
+            outcome = memo.get(key)
+            if outcome is not None:
+                memo.move_to_end(key)
+        if outcome is None:
+            outcome = self._validate(sparql_query)
+            with self._memo_lock:
+                memo[key] = outcome
+                while len(memo) > self.memo_size:
+                    memo.popitem(last=False)
+        query, fixes, errors = outcome
+        return query, list(fixes), list(errors)
+
+    def _validate(self, sparql_query):
+        fixes = []
+        query = self._strip_wrappers(sparql_query, fixes)
+        query = self._fix_prefix(query, fixes)
+        query = self._fix_graph(query, fixes)
+
+        algebra, error = self._parse(query)
+        if error:
+            return query, fixes, [error]
+
+        query, errors = self._fix_predicates(query, algebra, fixes)
+        if errors:
+            return query, fixes, errors
+        if "predicate" in fixes:
+            algebra, error = self._parse(query)
+            if error:
+                return query, fixes, [error]
+
+        query, errors = self._fix_unbound_variables(query, algebra, fixes)
+        if "unbound_variable" in fixes:
+            _, error = self._parse(query)
+            if error:
+                errors.append(error)
+        return query, fixes, errors
+
+    def _strip_wrappers(self, query, fixes):
+        query = query.strip()
+        match = CODE_FENCE_PATTERN.search(query)
+        if match:
+            query = match.group(1).strip()
+            fixes.append("code_fence")
+        match = SPARQL_EXECUTE_PATTERN.search(query)
+        if match:
+            query = match.group(1).replace("''", "'").strip()
+            fixes.append("sparql_execute_wrapper")
+        if query.endswith(";"):
+            query = query.rstrip(";").rstrip()
+            fixes.append("trailing_semicolon")
+        return query
+
+    def _fix_prefix(self, query, fixes):
+        if "rag:" in query and not PREFIX_PATTERN.search(query):
+            fixes.append("prefix")
+            return f"{PREFIX_DECLARATION}\n{query}"
+        return query
+
+    def _fix_graph(self, query, fixes):
+        def replace(match):
+            if match.group(3) == self.graph_name:
+                return match.group(0)
+            if "graph_name" not in fixes:
+                fixes.append("graph_name")
+            return f"{match.group(1)}{match.group(2)}<{self.graph_name}>"
+
+        if GRAPH_IRI_PATTERN.search(query):
+            return GRAPH_IRI_PATTERN.sub(replace, query)
+        # GRAPH ?g ranges over the named graphs of the dataset, which a FROM clause would change
+        if GRAPH_VARIABLE_PATTERN.search(query):
+            return query
+
+        # No dataset clause at all: read from the graph explicitly, right before WHERE
+        where = re.search(r"\bWHERE\b", query, re.IGNORECASE) or re.search(r"\{", query)
+        if where is None:
+            return query
+        fixes.append("graph_name")
+        return f"{query[:where.start()]}FROM <{self.graph_name}>\n{query[where.start():]}"
+
+    @staticmethod
+    def _parse(query):
+        try:
+            with _parse_lock:
+                return translateQuery(parseQuery(query)).algebra, None
+        except Exception as e:
+            return None, f"SPARQL syntax error: {e}"
+
+    def _fix_predicates(self, query, algebra, fixes):
+        errors = []
+        for _, predicate, _ in _triples(algebra):
+            if not isinstance(predicate, URIRef) or not predicate.startswith(RAG_NAMESPACE):
+                continue
+            name = predicate[len(RAG_NAMESPACE):]
+            if name in self.predicates:
+                continue
+            candidates = ([self._predicates_by_lower[name.lower()]] if name.lower() in self._predicates_by_lower
+                          else difflib.get_close_matches(name, self.predicates, n=1, cutoff=0.85))
+            if not candidates:
+                errors.append(f"Unknown predicate rag:{name}; use one of: "
+                              + ", ".join(f"rag:{p}" for p in sorted(self.predicates)))
+                continue
+            query = re.sub(rf"rag:{re.escape(name)}\b", f"rag:{candidates[0]}", query)
+            query = query.replace(f"<{RAG_NAMESPACE}{name}>", f"rag:{candidates[0]}")
+            if "predicate" not in fixes:
+                fixes.append("predicate")
+        return query, errors
+
+    def _fix_unbound_variables(self, query, algebra, fixes):
+        projected = list(algebra.get("PV") or [])
+        bound = _bound_variables(algebra)
+        unbound = [v for v in projected if v not in bound]
+        if not unbound:
+            return query, []
+
+        # Find the variables standing for the supplier and the country entities
+        roles = {}
+        for subject, predicate, obj in _triples(algebra):
+            if not isinstance(predicate, URIRef) or not predicate.startswith(RAG_NAMESPACE):
+                continue
+            name = predicate[len(RAG_NAMESPACE):]
+            if name == "hasGeopoliticalRisk" and isinstance(subject, Variable):
+                roles.setdefault("country", subject)
+            elif isinstance(subject, Variable):
+                roles.setdefault("supplier", subject)
+            if name == "locatedIn" and isinstance(obj, Variable):
+                roles.setdefault("country", obj)
+
+        # Each pattern goes at the end of the group where its subject is bound, e.g. inside a
+        # GRAPH block, rather than before the last brace of the query
+        patterns, errors = {}, []
+        for variable in unbound:
+            role, predicate = VARIABLE_BINDINGS.get(str(variable), (None, None))
+            subject = roles.get(role)
+            closing = _binding_group_end(query, subject) if subject is not None else None
+            if closing is None:
+                errors.append(f"Variable ?{variable} is selected but never bound in WHERE")
+                continue
+            pattern = (f"    BIND(?{subject} AS ?{variable})" if predicate is None
+                       else f"    OPTIONAL {{ ?{subject} rag:{predicate} ?{variable} . }}")
+            patterns.setdefault(closing, []).append(pattern)
+
+        for closing in sorted(patterns, reverse=True):
+            query = query[:closing].rstrip() + "\n" + "\n".join(patterns[closing]) + "\n" + query[closing:]
+        if patterns:
+            fixes.append("unbound_variable")
+        return query, errors
+
+def _binding_group_end(query, variable):
+    """
+    Returns the index of the "}" that closes the group in which variable first appears as the
+    subject of a triple pattern, or None. Braces in strings, IRIs and comments are skipped.
+    """
+    tokens = [match for match in TOKEN_PATTERN.finditer(query) if match.lastgroup not in ("comment", "space")]
+    start = next((i for i, token in enumerate(tokens)
+                  if token.lastgroup == "variable" and token.group()[1:] == str(variable)
+                  and (i == 0 or tokens[i - 1].group() in ("{", ".", ";", "}"))), None)
+    if start is None:
+        return None
+    depth = 0
+    for token in tokens[start:]:
+        if token.group() == "{" and token.lastgroup == "other":
+            depth += 1
+        elif token.group() == "}" and token.lastgroup == "other":
+            if depth == 0:
+                return token.start()
+            depth -= 1
+    return None
+
+def _walk(node):
+    if isinstance(node, CompValue):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, (list, tuple)):
+        for value in node:
+            yield from _walk(value)
+
+def _triples(algebra):
+    for node in _walk(algebra):
+        if node.name == "BGP":
+            yield from node.triples
+
+def _bound_variables(algebra):
+    """
+    Variables bound by triple patterns, BIND, VALUES or subquery projections.
+    """
+    bound = set()
+    for node in _walk(algebra):
+        if node.name == "BGP":
+            bound.update(term for triple in node.triples for term in triple if isinstance(term, Variable))
+        elif node.name == "Extend":
+            bound.add(node.var)
+        elif node.name == "values":
+            bound.update(variable for row in node.res for variable in row)
+        elif node.name == "Graph" and isinstance(node.term, Variable):
+            bound.add(node.term)
+        elif node.name == "ToMultiSet":
+            # Subquery: what it projects is bound for the outer query
+            bound.update(next((n.PV for n in _walk(node.p) if n.name == "Project"), []))
+    return bound
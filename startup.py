@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LazyInitializer:
+    """
+    Creates an expensive object once per process, either on first use or ahead of it
+    in a background thread, and reports how far that got for readiness checks.
+
+    get() returns the object, creating it if needed; callers that arrive while it is
+    being created wait for the same attempt. If creating it failed, the next get()
+    tries again. warm_up, if given, is called with the new object by start() only.
+    """
+    def __init__(self, factory, warm_up=None):
+        self.factory = factory
+        self.warm_up = warm_up
+
+        self._instance = None
+        self._lock = threading.Lock()
+        self._state = "not_started"
+        self._error = None
+        self._timings = {}
+        self._thread = None
+        self._created = time.monotonic()
+
+    def get(self):
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                self._state, self._error = "initializing", None
+                start = time.perf_counter()
+                try:
+                    self._instance = self.factory()
+                except Exception as e:
+                    self._state, self._error = "failed", str(e)
+                    raise
+                finally:
+                    self._timings["initialize"] = time.perf_counter() - start
+                if self._state == "initializing":
+                    self._state = "ready"
+            return self._instance
+
+    def peek(self):
+        """
+        Returns the object if it was created already, without waiting.
+        """
+        return self._instance
+
+    def set(self, instance):
+        """
+        Replaces the object, e.g. with one built from local fakes.
+        """
+        with self._lock:
+            self._instance = instance
+            self._state, self._error = "ready", None
+
+    def start(self):
+        """
+        Creates and warms up the object in a background thread. Does nothing if that already started.
+        """
+        with self._lock:
+            if self._thread is not None or self._instance is not None:
+                return
+            self._thread = threading.Thread(target=self._initialize, name="lazy-initializer", daemon=True)
+            self._thread.start()
+
+    def _initialize(self):
+        try:
+            instance = self.get()
+        except Exception:
+            logger.exception("Background initialization failed; the next request will retry")
+            return
+        if self.warm_up is None:
+            return
+        self._state = "warming_up"
+        start = time.perf_counter()
+        try:
+            self._timings.update(self.warm_up(instance) or {})
+        except Exception:
+            logger.exception("Warm-up failed")
+        finally:
+            self._timings["warm_up"] = time.perf_counter() - start
+            self._state = "ready"
+
+    @property
+    def ready(self):
+        return self._state == "ready"
+
+    def status(self):
+        """
+        Returns the initialization state, the last error and the step durations in seconds.
+        """
+        return {
+            "state": self._state,
+            "error": self._error,
+            "seconds_since_start": round(time.monotonic() - self._created, 3),
+            "timings": {step: round(value, 3) for step, value in self._timings.items()}
+        }
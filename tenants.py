@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from instrumentation import get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Tenant ids end up in graph IRIs and table names, so only plain identifiers are accepted (fullmatch)
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9_]{1,64}")
+
+class UnknownTenantError(LookupError):
+    pass
+
+def load_tenant_config():
+    """
+    Returns the tenants configured in the TENANTS environment variable as a dict of
+    tenant id -> {"graph": ..., "table": ...}, or None if it is not set. Either name may
+    be left out, in which case it follows TENANT_GRAPH_TEMPLATE or TENANT_TABLE_TEMPLATE.
+    """
+    raw = os.environ.get('TENANTS')
+    if not raw:
+        return None
+    tenants = json.loads(raw)
+    if not isinstance(tenants, dict):
+        raise ValueError("TENANTS must be a JSON object of tenant id -> {\"graph\": ..., \"table\": ...}")
+    return tenants
+
+def tenant_names(tenant, tenants=None):
+    """
+    Returns the (graph name, vector table) of a tenant.
+
+    Tenants listed in TENANTS use the names given there. Without TENANTS, every tenant id
+    is mapped through TENANT_GRAPH_TEMPLATE and TENANT_TABLE_TEMPLATE, so onboarding a
+    tenant only takes loading its graph and table. Raises UnknownTenantError for ids that
+    are malformed or not listed.
+    """
+    if not isinstance(tenant, str) or not TENANT_ID_PATTERN.fullmatch(tenant):
+        raise UnknownTenantError(f"Invalid tenant id: {tenant!r}")
+    tenants = load_tenant_config() if tenants is None else tenants
+    if tenants is not None and tenant not in tenants:
+        raise UnknownTenantError(f"Unknown tenant: {tenant}")
+    names = (tenants or {}).get(tenant) or {}
+    graph_name = names.get("graph") or os.environ.get('TENANT_GRAPH_TEMPLATE', 'rag_suppliers_{tenant}').format(
+        tenant=tenant
+    )
+    table_name = names.get("table") or os.environ.get('TENANT_TABLE_TEMPLATE', 'SUPPLIERS_EMBED_ADA_{tenant}').format(
+        tenant=tenant
+    )
+    return graph_name, table_name
+
+class _TenantEntry:
+    __slots__ = ("future", "leases", "evicted")
+
+    def __init__(self):
+        self.future = Future()
+        self.leases = 0
+        self.evicted = False
+
+class TenantRegistry:
+    """
+    Bounded, least-recently-used set of per-tenant resources.
+
+    The resources of a tenant are created by factory(tenant) on its first request; requests
+    for the same tenant that arrive meanwhile wait for that one creation instead of starting
+    their own. When more than max_size tenants are warm, the least recently used ones are
+    dropped and passed to on_evict. Resources are leased for the duration of a request, and
+    resources that are evicted while still leased are only closed after the last release.
+    """
+    def __init__(self, factory, max_size=8, on_evict=None):
+        self.factory = factory
+        self.max_size = max_size
+        self.on_evict = on_evict
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # tenant -> _TenantEntry, least recently used first
+        self._leased = {}  # id(resources) -> _TenantEntry
+
+    def acquire(self, tenant):
+        """
+        Returns the resources of a tenant, creating them if the tenant is not warm.
+        Every acquire must be followed by a release of the returned resources.
+        """
+        with self._lock:
+            entry = self._entries.get(tenant)
+            is_owner = entry is None
+            if is_owner:
+                entry = self._entries[tenant] = _TenantEntry()
+            else:
+                self._entries.move_to_end(tenant)
+            entry.leases += 1
+        get_instrumentation().increment("cache_requests_total", cache="tenant", result="miss" if is_owner else "hit")
+
+        if is_owner:
+            try:
+                resources = self.factory(tenant)
+            except BaseException as e:
+                # Not remembered, so that the next request for the tenant tries again
+                with self._lock:
+                    entry.leases -= 1
+                    if self._entries.get(tenant) is entry:
+                        del self._entries[tenant]
+                entry.future.set_exception(e)
+                raise
+            entry.future.set_result(resources)
+            self._evict()
+
+        try:
+            resources = entry.future.result()
+        except BaseException:
+            with self._lock:
+                entry.leases -= 1
+            raise
+        with self._lock:
+            self._leased[id(resources)] = entry
+        return resources
+
+    def release(self, resources):
+        """
+        Ends a lease taken with acquire.
+        """
+        with self._lock:
+            entry = self._leased[id(resources)]
+            entry.leases -= 1
+            close = entry.evicted and entry.leases == 0
+            if close:
+                del self._leased[id(resources)]
+        if close:
+            self._close(resources)
+
+    @contextmanager
+    def lease(self, tenant):
+        """
+        Context manager yielding the resources of a tenant for the duration of the block.
+        """
+        resources = self.acquire(tenant)
+        try:
+            yield resources
+        finally:
+            self.release(resources)
+
+    def tenants(self):
+        """
+        Returns the warm tenants, least recently used first.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def _evict(self):
+        closing = []
+        evicted = 0
+        with self._lock:
+            for tenant, entry in list(self._entries.items()):
+                if len(self._entries) <= self.max_size:
+                    break
+                # Tenants still being created are skipped; their creator evicts again afterwards
+                if not entry.future.done():
+                    continue
+                del self._entries[tenant]
+                entry.evicted = True
+                evicted += 1
+                resources = entry.future.result()
+                if entry.leases == 0:
+                    self._leased.pop(id(resources), None)
+                    closing.append(resources)
+        if evicted:
+            get_instrumentation().increment("cache_evictions_total", evicted, cache="tenant")
+        for resources in closing:
+            self._close(resources)
+
+    def _close(self, resources):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(resources)
+        except Exception as e:
+            logger.warning("Closing evicted tenant resources failed: %s", e)
+
+    def close(self):
+        """
+        Drops every tenant. Resources that are still leased are closed on their last release.
+        """
+        closing = []
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), OrderedDict()
+            for entry in entries:
+                entry.evicted = True
+                if entry.future.done() and entry.future.exception() is None and entry.leases == 0:
+                    resources = entry.future.result()
+                    self._leased.pop(id(resources), None)
+                    closing.append(resources)
+        for resources in closing:
+            self._close(resources)
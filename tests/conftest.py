@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live at the top level of the repository and the offline fakes in benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
@@ -0,0 +1,42 @@
+import os
+import threading
+
+import pytest
+
+# api reads the XSUAA service binding at import time unless testing locally
+os.environ.setdefault("LOCAL_TESTING", "true")
+import api
+from startup import LazyInitializer
+
+@pytest.fixture
+def initializer(monkeypatch):
+    release = threading.Event()
+
+    def factory():
+        release.wait(5)
+        return "retriever"
+
+    initializer = LazyInitializer(factory)
+    initializer.release = release
+    monkeypatch.setattr(api, "retriever_initializer", initializer)
+    return initializer
+
+def test_readyz_reports_503_until_the_retriever_is_ready(initializer):
+    client = api.app.test_client()
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["state"] == "not_started"
+
+    initializer.start()
+    assert client.get("/readyz").status_code == 503
+    initializer.release.set()
+    initializer._thread.join(5)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.get_json()["state"] == "ready"
+    assert "initialize" in response.get_json()["timings"]
+
+def test_healthz_answers_while_the_retriever_is_created(initializer):
+    initializer.start()
+    assert api.app.test_client().get("/healthz").status_code == 200
+    initializer.release.set()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+# api and asgi read the XSUAA service binding at import time unless testing locally
+os.environ.setdefault("LOCAL_TESTING", "true")
+import asgi
+from asgi import AdmissionLimiter, SlotBody, ais_authorized
+from startup import LazyInitializer
+
+class CountingLimiter:
+    def __init__(self):
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+def test_requests_beyond_the_slots_and_the_queue_are_rejected():
+    async def scenario():
+        limiter = AdmissionLimiter(max_concurrency=1, max_queue=1)
+        assert await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()
+
+        limiter.release()
+        assert await waiting
+        limiter.release()
+        assert await limiter.acquire()
+
+    asyncio.run(scenario())
+
+def test_a_burst_is_admitted_queued_or_rejected_at_once():
+    async def scenario():
+        limiter = AdmissionLimiter(max_concurrency=2, max_queue=1)
+        tasks = [asyncio.ensure_future(limiter.acquire()) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert [task.result() if task.done() else None for task in tasks] == [True, True, None, False]
+        limiter.release()
+        assert await tasks[2]
+
+    asyncio.run(scenario())
+
+def test_the_slot_is_released_once_the_body_is_finished():
+    async def body():
+        yield b"a"
+        yield b"b"
+
+    async def scenario():
+        limiter = CountingLimiter()
+        slot_body = SlotBody(body(), limiter)
+        assert [chunk async for chunk in slot_body] == [b"a", b"b"]
+        await slot_body.aclose()
+        assert limiter.released == 1
+
+    asyncio.run(scenario())
+
+def test_the_slot_is_released_if_the_body_is_closed_before_it_started():
+    started = []
+
+    async def body():
+        started.append(True)
+        yield b"a"
+
+    async def scenario():
+        limiter = CountingLimiter()
+        await SlotBody(body(), limiter).aclose()
+        assert limiter.released == 1 and not started
+
+    asyncio.run(scenario())
+
+def test_the_slot_is_released_if_the_body_fails():
+    async def body():
+        yield b"a"
+        raise RuntimeError("lost")
+
+    async def scenario():
+        limiter = CountingLimiter()
+        slot_body = SlotBody(body(), limiter)
+        assert await slot_body.__anext__() == b"a"
+        with pytest.raises(RuntimeError):
+            await slot_body.__anext__()
+        assert limiter.released == 1
+
+    asyncio.run(scenario())
+
+def test_authorization_runs_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def is_authorized(header):
+        threads.append(threading.current_thread())
+        return header == "Bearer token"
+
+    monkeypatch.setattr("asgi.is_authorized", is_authorized)
+
+    async def scenario():
+        assert await ais_authorized("Bearer token")
+        assert not await ais_authorized(None)
+
+    asyncio.run(scenario())
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+def test_readyz_follows_the_retriever_initializer(monkeypatch):
+    initializer = LazyInitializer(lambda: "retriever")
+    monkeypatch.setattr(asgi, "retriever_initializer", initializer)
+
+    async def scenario():
+        client = asgi.app.test_client()
+        response = await client.get("/readyz")
+        assert response.status_code == 503
+        initializer.get()
+        response = await client.get("/readyz")
+        assert response.status_code == 200
+        assert (await response.get_json())["state"] == "ready"
+
+    asyncio.run(scenario())
@@ -0,0 +1,79 @@
+from langchain_core.documents import Document
+from context_assembly import MASK_CHUNK_ROWS, ContextAssembler
+from pseudonymization import Pseudonymizer
+
+RAG = "http://sap.com/rag/"
+
+class WordCounter:
+    """
+    One token per whitespace-separated word, so that budgets are easy to reason about.
+    """
+    def count(self, text):
+        return len(text.split())
+
+def kg_csv(names):
+    return "supplierName,country\n" + "".join(f"{RAG}{name},{RAG}Germany\n" for name in names)
+
+class CharCounter:
+    def count(self, text):
+        return len(text)
+
+def test_kg_rows_are_trimmed_to_their_share_of_the_budget():
+    assembler = ContextAssembler(token_budget=20, kg_share=0.5, counter=WordCounter())
+    _, kg, stats = assembler.assemble([], kg_csv(f"Supplier_{i}" for i in range(20)))
+    # The header and every row are one word each, the note four: it takes the place of four rows
+    assert stats["kg_tokens"] == 10
+    assert stats["kg_rows_dropped"] == 15
+    assert kg.count("\r\n") == 6 and kg.endswith("\n(15 more rows omitted)")
+
+def test_kg_tokens_are_counted_on_the_masked_text():
+    counter = CharCounter()
+    assembler = ContextAssembler(token_budget=1000, kg_share=0.5, counter=counter)
+    names = [f"A_Supplier_With_A_Long_Name_{i}" for i in range(20)]
+    _, plain, plain_stats = assembler.assemble([], kg_csv(names))
+    pseudonymizer = Pseudonymizer()
+    _, masked, stats = assembler.assemble([], kg_csv(names), pseudonymizer)
+
+    assert "Long_Name" not in masked and "MASKED_SUPPLIERNAME_1," in masked
+    assert stats["kg_tokens"] == counter.count(masked) <= 500
+    assert plain_stats["kg_tokens"] == counter.count(plain)
+    assert stats["kg_rows_dropped"] < plain_stats["kg_rows_dropped"]
+    assert pseudonymizer.restore("MASKED_SUPPLIERNAME_1") == "A_Supplier_With_A_Long_Name_0"
+
+def test_kg_rows_mentioned_by_the_chunks_come_first():
+    assembler = ContextAssembler(token_budget=20, kg_share=0.5, counter=WordCounter())
+    documents = [Document(page_content="A report on Supplier 7 and its plants")]
+    _, kg, _ = assembler.assemble(documents, kg_csv(f"Supplier_{i}" for i in range(10)))
+    assert kg.splitlines()[1].startswith(f"{RAG}Supplier_7,")
+
+def test_chunks_get_the_rest_of_the_budget_and_duplicates_are_dropped():
+    assembler = ContextAssembler(token_budget=10, kg_share=0.5, counter=WordCounter(), min_entity_chunks=1)
+    documents = [
+        Document(page_content="alpha beta gamma"),
+        Document(page_content="alpha beta gamma"),
+        Document(page_content="delta epsilon"),
+        Document(page_content="zeta eta theta iota kappa"),
+    ]
+    chunks, kg, stats = assembler.assemble(documents, kg_csv(["Supplier_1", "Supplier_2"]))
+    # 3 KG tokens leave 7 for the chunks: the first chunk, not its duplicate, then the second
+    assert stats["kg_tokens"] == 3
+    assert [doc.page_content for doc in chunks] == ["alpha beta gamma", "delta epsilon"]
+    assert stats["vector_tokens"] == 5 and stats["vector_chunks_dropped"] == 2
+
+def test_chunks_mentioning_kg_entities_are_preferred():
+    assembler = ContextAssembler(token_budget=100, counter=WordCounter(), max_chunks=2, min_entity_chunks=2)
+    documents = [
+        Document(page_content="general market outlook"),
+        Document(page_content="Supplier 1 opened a plant"),
+        Document(page_content="news about Supplier 2"),
+    ]
+    chunks, _, _ = assembler.assemble(documents, kg_csv(["Supplier_1", "Supplier_2"]))
+    assert [doc.page_content for doc in chunks] == ["Supplier 1 opened a plant", "news about Supplier 2"]
+
+def test_a_large_result_is_masked_only_up_to_the_budget():
+    assembler = ContextAssembler(token_budget=200, kg_share=0.5, counter=WordCounter())
+    pseudonymizer = Pseudonymizer()
+    _, kg, stats = assembler.assemble([], kg_csv(f"Supplier_{i}" for i in range(100000)), pseudonymizer)
+    assert stats["kg_rows_dropped"] == 100000 - 95
+    assert kg.splitlines()[95].startswith("MASKED_SUPPLIERNAME_95,")
+    assert len(pseudonymizer.mapping["supplierName"]) == MASK_CHUNK_ROWS
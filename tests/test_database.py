@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+import database
+from database import HanaConnectionPool, PoolTimeoutError
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, statement):
+        if not self.connection.alive:
+            raise database.dbapi.Error("connection lost")
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def isconnected(self):
+        return self.alive and not self.closed
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(database, "connect", connect)
+    return connections
+
+def test_connections_are_opened_lazily_and_reused(opened):
+    pool = HanaConnectionPool(min_size=1, max_size=2, checkout_timeout=1, health_check_interval=60)
+    assert len(opened) == 1
+    first = pool.acquire()
+    second = pool.acquire()
+    assert len(opened) == 2 and first is not second
+    pool.release(second)
+    assert pool.acquire() is second
+    assert len(opened) == 2
+
+def test_checkout_waits_for_a_release_and_times_out(opened):
+    pool = HanaConnectionPool(min_size=0, max_size=1, checkout_timeout=0.05, health_check_interval=60)
+    connection = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    threading.Timer(0.05, pool.release, (connection,)).start()
+    assert pool.acquire(timeout=5) is connection
+
+def test_stale_idle_connections_are_replaced(opened):
+    pool = HanaConnectionPool(min_size=1, max_size=1, checkout_timeout=1, health_check_interval=0)
+    opened[0].alive = False
+    connection = pool.acquire()
+    assert connection is opened[1] and opened[0].closed
+
+def test_a_connection_that_failed_a_statement_is_checked_before_reuse(opened):
+    pool = HanaConnectionPool(min_size=0, max_size=1, checkout_timeout=1, health_check_interval=60)
+    with pytest.raises(database.dbapi.Error):
+        with pool.connection() as connection:
+            connection.alive = False
+            raise database.dbapi.Error("connection lost")
+    assert opened[0].closed
+    assert pool.acquire() is opened[1]
+
+def test_a_failed_connect_frees_its_slot(opened, monkeypatch):
+    pool = HanaConnectionPool(min_size=0, max_size=1, checkout_timeout=0.05, health_check_interval=60)
+
+    def failing_connect():
+        raise database.dbapi.Error("unreachable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(database, "connect", failing_connect)
+        with pytest.raises(database.dbapi.Error):
+            pool.acquire()
+    assert pool.acquire() is opened[0]
+
+def test_close_closes_idle_and_released_connections(opened):
+    pool = HanaConnectionPool(min_size=2, max_size=2, checkout_timeout=1, health_check_interval=60)
+    checked_out = pool.acquire()
+    pool.close()
+    assert all(connection.closed for connection in opened if connection is not checked_out)
+    assert not checked_out.closed
+    pool.release(checked_out)
+    assert checked_out.closed
+    with pytest.raises(RuntimeError):
+        pool.acquire()
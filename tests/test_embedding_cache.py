@@ -0,0 +1,39 @@
+import os
+from embedding_cache import DiskEmbeddingStore
+
+def test_vectors_survive_a_reopen(tmp_path):
+    store = DiskEmbeddingStore(str(tmp_path))
+    store.put_many([("a", [1.0, 2.0]), ("b", [3.0, 4.0])])
+    assert store.get("a") == [1.0, 2.0]
+
+    reopened = DiskEmbeddingStore(str(tmp_path))
+    assert reopened.get("b") == [3.0, 4.0]
+    assert reopened.get("missing") is None
+
+def test_existing_keys_are_not_appended_again(tmp_path):
+    store = DiskEmbeddingStore(str(tmp_path))
+    store.put_many([("a", [1.0, 2.0])])
+    store.put_many([("a", [9.0, 9.0]), ("b", [3.0, 4.0])])
+    assert store.get("a") == [1.0, 2.0]
+    assert os.path.getsize(tmp_path / "vectors.f32") == 2 * 2 * 4
+
+def test_rows_appended_by_another_process_are_picked_up(tmp_path):
+    reader = DiskEmbeddingStore(str(tmp_path))
+    writer = DiskEmbeddingStore(str(tmp_path))
+    writer.put_many([("a", [1.0, 2.0])])
+    assert reader.get("a") == [1.0, 2.0]
+
+def test_leftovers_of_a_crashed_writer_are_cut_off(tmp_path):
+    store = DiskEmbeddingStore(str(tmp_path))
+    store.put_many([("a", [1.0, 2.0])])
+    # A writer died after appending its vectors and part of its key line
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(b"\0" * 8)
+    with open(tmp_path / "keys.txt", "a") as f:
+        f.write("x")
+
+    recovered = DiskEmbeddingStore(str(tmp_path))
+    assert recovered.get("x") is None
+    recovered.put_many([("b", [3.0, 4.0])])
+    assert DiskEmbeddingStore(str(tmp_path)).get("b") == [3.0, 4.0]
+    assert os.path.getsize(tmp_path / "vectors.f32") == 2 * 2 * 4
@@ -0,0 +1,56 @@
+import pytest
+from langchain_core.documents import Document
+
+from entity_mentions import MentionMatcher, find_mentioned_chunks, kg_entity_names
+from fakes import FakeHanaClient
+
+def chunk(chunk_id, suppliers=(), countries=()):
+    return Document(page_content=chunk_id, metadata={
+        "chunk_id": chunk_id, "suppliers": list(suppliers), "countries": list(countries)
+    })
+
+@pytest.fixture(scope="module")
+def hana_client():
+    return FakeHanaClient(latency=0, documents=[
+        chunk("both", ["VisionCam_DE"], ["Germany"]),
+        chunk("supplier", ["VisionCam_DE"]),
+        chunk("country", countries=["Germany"]),
+        chunk("other", ["Other_Supplier"], ["France"]),
+    ])
+
+def test_chunks_mentioning_more_entities_come_first(hana_client):
+    chunk_ids = find_mentioned_chunks(hana_client, ["VisionCam_DE", "Germany"], "g")
+    assert chunk_ids[0] == "both"
+    assert sorted(chunk_ids[1:]) == ["country", "supplier"]
+
+def test_the_limit_caps_the_chunks(hana_client):
+    assert find_mentioned_chunks(hana_client, ["VisionCam_DE", "Germany"], "g", limit=1) == ["both"]
+
+def test_names_that_are_not_entity_names_never_reach_the_query():
+    class RecordingClient:
+        queries = []
+
+        def execute_raw_sparql(self, query):
+            self.queries.append(query)
+            return "chunk,mentions\n", "{}"
+
+    client = RecordingClient()
+    assert find_mentioned_chunks(client, ["} DROP ALL {", "Germany\n"], "g") == []
+    assert client.queries == []
+    find_mentioned_chunks(client, ["Germany", "a b"], "g")
+    assert "rag:Germany }" in client.queries[0] and "a b" not in client.queries[0]
+    assert "FROM <g_mentions>" in client.queries[0]
+
+def test_kg_entity_names_keep_the_order_of_appearance():
+    csv_text = ("supplierName,country,risk\n"
+                "http://sap.com/rag/VisionCam_DE,http://sap.com/rag/Germany,Low\n"
+                "http://sap.com/rag/Other_Supplier,http://sap.com/rag/Germany,Low\n")
+    assert kg_entity_names(csv_text) == ["VisionCam_DE", "Germany", "Other_Supplier"]
+    assert kg_entity_names(csv_text, limit=2) == ["VisionCam_DE", "Germany"]
+    assert kg_entity_names(None) == []
+
+def test_mention_matcher_prefers_the_longest_name():
+    matcher = MentionMatcher({"North": "North", "North Korea": "North_Korea", "VisionCam DE": "VisionCam_DE"})
+    assert matcher.find("Suppliers in North Korea and visioncam de, not in the north.") == [
+        "North_Korea", "VisionCam_DE", "North"
+    ]
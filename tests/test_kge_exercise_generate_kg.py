@@ -0,0 +1,22 @@
+import numpy as np
+from kge_exercise_generate_kg import triple_delta
+
+def digests(*values):
+    return np.array(values, dtype=np.uint64)
+
+def test_first_load_inserts_each_unique_triple_once():
+    keep, insert, delete, unique = triple_delta(digests(3, 1, 3, 2))
+    assert keep.tolist() == [True, True, False, True]
+    assert insert.tolist() == keep.tolist()
+    assert delete is None
+    assert unique.tolist() == [3, 1, 2]
+
+def test_delta_inserts_new_and_deletes_vanished_triples():
+    keep, insert, delete, unique = triple_delta(digests(1, 4, 2, 4), old_digests=digests(1, 2, 3))
+    assert insert.tolist() == [False, True, False, False]
+    assert delete.tolist() == [False, False, True]
+    assert unique.tolist() == [1, 4, 2]
+
+def test_unchanged_source_has_an_empty_delta():
+    _, insert, delete, _ = triple_delta(digests(5, 6, 5), old_digests=digests(5, 6))
+    assert not insert.any() and not delete.any()
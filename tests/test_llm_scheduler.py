@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from instrumentation import Instrumentation
+from llm_scheduler import LLMScheduler, LLMTimeoutError, TokenBucket
+
+class RecordingInstrumentation(Instrumentation):
+    def __init__(self):
+        self.counters = Counter()
+
+    def increment(self, name, value=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def attempts(self, result, call="test"):
+        return self.counters["llm_attempts_total", (("call", call), ("result", result))]
+
+class ProxyError(RuntimeError):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+class FakeRunnable:
+    """
+    Answers with the next entry of replies: an exception to raise, or (seconds, text).
+    Streams yield the text word by word and record whether they were closed.
+    """
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+        self.closed = []
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            reply = self.replies[min(self.calls, len(self.replies) - 1)]
+            self.calls += 1
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def invoke(self, inputs):
+        delay, text = self._next()
+        time.sleep(delay)
+        return text
+
+    async def ainvoke(self, inputs):
+        delay, text = self._next()
+        await asyncio.sleep(delay)
+        return text
+
+    async def astream(self, inputs):
+        index = len(self.closed)
+        self.closed.append(False)
+        try:
+            delay, text = self._next()
+            for word in text.split():
+                await asyncio.sleep(delay)
+                yield word
+        finally:
+            self.closed[index] = True
+
+@pytest.fixture
+def instrumentation():
+    return RecordingInstrumentation()
+
+@pytest.fixture
+def scheduler(instrumentation):
+    scheduler = LLMScheduler(requests_per_minute=60000, burst=100, call_timeout=5, backoff_base=0.01,
+                             backoff_max=0.01, instrumentation=instrumentation)
+    yield scheduler
+    scheduler.close()
+
+def test_token_bucket_spends_the_burst_then_paces_callers():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    # Waiting callers queue up behind each other
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+    assert not bucket.try_acquire()
+
+def test_token_bucket_refuses_a_wait_past_the_deadline_without_taking_a_token():
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.reserve()
+    with pytest.raises(LLMTimeoutError):
+        bucket.reserve(deadline=time.monotonic() + 0.5)
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+def test_token_bucket_halves_its_rate_on_throttling_and_recovers():
+    bucket = TokenBucket(rate=10, capacity=1)
+    bucket.throttle()
+    assert bucket.rate == 5
+    # 429s of calls that were already in flight count once
+    bucket.throttle()
+    assert bucket.rate == 5
+    bucket.recover()
+    assert bucket.rate == 5.5
+    for _ in range(20):
+        bucket.recover()
+    assert bucket.rate == 10
+
+def test_throttling_and_server_errors_are_retried(scheduler, instrumentation):
+    runnable = FakeRunnable(ProxyError(429), ProxyError(503), (0, "answer"))
+    assert scheduler.invoke("test", runnable, {}) == "answer"
+    assert runnable.calls == 3
+    assert instrumentation.attempts("throttled") == 1 and instrumentation.attempts("retry") == 1
+    assert instrumentation.attempts("ok") == 1
+
+def test_client_errors_are_not_retried(scheduler, instrumentation):
+    runnable = FakeRunnable(ProxyError(400), (0, "answer"))
+    with pytest.raises(ProxyError):
+        scheduler.invoke("test", runnable, {})
+    assert runnable.calls == 1 and instrumentation.attempts("error") == 1
+
+def test_a_call_gets_its_share_of_the_request_deadline(scheduler, instrumentation):
+    runnable = FakeRunnable((1, "late"))
+    started = time.monotonic()
+    # SPARQL generation may use half of what is left of the request
+    with pytest.raises(LLMTimeoutError):
+        scheduler.invoke("sparql_generation", runnable, {}, deadline=started + 0.4)
+    assert time.monotonic() - started < 0.5
+    assert instrumentation.attempts("timeout", call="sparql_generation") == 1
+
+def test_a_slow_call_is_hedged_and_the_faster_answer_wins(instrumentation):
+    scheduler = LLMScheduler(requests_per_minute=60000, burst=100, hedge_after=0.05,
+                             instrumentation=instrumentation)
+    runnable = FakeRunnable((2, "original"), (0, "hedge"))
+    started = time.monotonic()
+    assert scheduler.invoke("test", runnable, {}, hedge=True) == "hedge"
+    assert time.monotonic() - started < 1
+    assert instrumentation.counters["llm_hedges_total", (("call", "test"), ("winner", "hedge"))] == 1
+
+    async def ahedged():
+        return await scheduler.ainvoke("test", FakeRunnable((2, "original"), (0, "hedge")), {}, hedge=True)
+
+    assert asyncio.run(ahedged()) == "hedge"
+    scheduler.close()
+
+def test_waiting_for_the_rate_limit_past_the_deadline_is_a_timeout(instrumentation):
+    scheduler = LLMScheduler(requests_per_minute=1, burst=1, call_timeout=1, instrumentation=instrumentation)
+    scheduler.invoke("test", FakeRunnable((0, "first")), {})
+
+    async def over_the_limit():
+        with pytest.raises(LLMTimeoutError):
+            await scheduler.ainvoke("test", FakeRunnable((0, "answer")), {})
+        with pytest.raises(LLMTimeoutError):
+            async for _ in scheduler.astream("test", FakeRunnable((0, "answer")), {}):
+                pass
+
+    asyncio.run(over_the_limit())
+    with pytest.raises(LLMTimeoutError):
+        scheduler.invoke("test", FakeRunnable((0, "answer")), {})
+    assert instrumentation.attempts("timeout") == 3
+    assert scheduler._queued == 0
+    scheduler.close()
+
+def test_abandoned_async_streams_are_closed(scheduler):
+    async def scenario():
+        # A failed first read is retried with a new stream
+        retried = FakeRunnable(ProxyError(503), (0, "two words"))
+        assert [chunk async for chunk in scheduler.astream("test", retried, {})] == ["two", "words"]
+        assert retried.closed == [True, True]
+
+        # A stream that stalls is given up on after call_timeout
+        scheduler.call_timeout = 0.1
+        stalled = FakeRunnable((1, "too slow"))
+        with pytest.raises(LLMTimeoutError):
+            async for _ in scheduler.astream("test", stalled, {}):
+                pass
+        assert stalled.closed == [True]
+
+        # The consumer stops reading
+        scheduler.call_timeout = 5
+        read = FakeRunnable((0, "one two three"))
+        chunks = scheduler.astream("test", read, {})
+        assert await chunks.__anext__() == "one"
+        await chunks.aclose()
+        assert read.closed == [True]
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+from pseudonymization import RAG_NAMESPACE, Pseudonymizer, StreamingRestorer
+
+KG_CONTEXT = (
+    "supplierName,email,country\n"
+    f"{RAG_NAMESPACE}VisionCam_DE,info@visioncam.de,{RAG_NAMESPACE}Germany\n"
+    f"{RAG_NAMESPACE}StandSolutions,support@standsolutions.ru,{RAG_NAMESPACE}Russia\n"
+)
+
+def test_restore_puts_back_values_without_namespace():
+    pseudonymizer = Pseudonymizer()
+    masked = pseudonymizer.pseudonymize_kg_context(KG_CONTEXT)
+    assert "VisionCam_DE" not in masked and "info@visioncam.de" not in masked
+    assert f"{RAG_NAMESPACE}Germany" in masked
+
+    name = pseudonymizer.mapping["supplierName"][f"{RAG_NAMESPACE}VisionCam_DE"]
+    email = pseudonymizer.mapping["email"]["info@visioncam.de"]
+    assert pseudonymizer.restore(f"Contact {name} at {email}.") == "Contact VisionCam_DE at info@visioncam.de."
+
+def test_restore_does_not_match_a_placeholder_inside_a_longer_one():
+    pseudonymizer = Pseudonymizer()
+    values = [pseudonymizer.pseudonymize_value("email", f"user{i}@example.com") for i in range(12)]
+    assert values[0] == "MASKED_EMAIL_1" and values[11] == "MASKED_EMAIL_12"
+    assert pseudonymizer.restore("MASKED_EMAIL_12, MASKED_EMAIL_1") == "user11@example.com, user0@example.com"
+
+def test_restore_keeps_unknown_placeholders_and_plain_text():
+    pseudonymizer = Pseudonymizer()
+    assert pseudonymizer.restore("MASKED_EMAIL_1") == "MASKED_EMAIL_1"
+    pseudonymizer.pseudonymize_value("email", "a@example.com")
+    assert pseudonymizer.restore("MASKED_PHONE_7 and MASKED_EMAIL_1") == "MASKED_PHONE_7 and a@example.com"
+
+def test_streaming_restore_handles_placeholders_split_across_chunks():
+    pseudonymizer = Pseudonymizer()
+    for i in range(12):
+        pseudonymizer.pseudonymize_value("email", f"user{i}@example.com")
+    restorer = StreamingRestorer(pseudonymizer)
+    chunks = ["Write to MAS", "KED_EMAIL_1", "2 or MASKED_EMAIL_", "1"]
+    text = "".join(restorer.feed(chunk) for chunk in chunks) + restorer.flush()
+    assert text == "Write to user11@example.com or user0@example.com"
+
+def test_rows_are_masked_chunk_by_chunk():
+    pseudonymizer = Pseudonymizer()
+    header = ["supplierName", "country"]
+    rows = [[f"{RAG_NAMESPACE}Supplier_{i}", f"{RAG_NAMESPACE}Germany"] for i in range(10)]
+    masked = pseudonymizer.iter_pseudonymized_rows(header, rows, chunk_rows=3)
+    assert next(masked) == ("MASKED_SUPPLIERNAME_1", f"{RAG_NAMESPACE}Germany")
+    # Only the first chunk has been masked so far
+    assert len(pseudonymizer.mapping["supplierName"]) == 3
+    assert [row[0] for row in masked][-1] == "MASKED_SUPPLIERNAME_10"
@@ -0,0 +1,89 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from fakes import FakeChatModel, FakeEmbeddings, FakeHanaClient, NumpyVectorStore, synthetic_documents
+from instrumentation import Instrumentation
+from retrieval import HybridRetriever
+from sparql_cache import SemanticQueryCache
+
+# The first two questions get the same SPARQL query from the fake LLM, the third repeats the
+# first one and the last gets a query that filters on high risk
+QUESTIONS = [
+    "What challenges do our suppliers face?",
+    "Which suppliers report problems?",
+    "What challenges do our suppliers face?",
+    "Which suppliers are located in high-risk countries?",
+]
+
+@pytest.fixture
+def retriever(monkeypatch):
+    # Every SPARQL query reaches the fake HANA client and every question the LLM
+    for name in ("SPARQL_RESULT_CACHE", "SPARQL_TEMPLATES", "SCHEMA_INTROSPECTION", "LLM_HEDGE"):
+        monkeypatch.setenv(name, "false")
+    monkeypatch.delenv("RISK_VIEW_DIR", raising=False)
+    embedding_model = FakeEmbeddings(latency=0)
+    documents = synthetic_documents()
+    retriever = HybridRetriever(
+        max_workers=4,
+        embedding_model=embedding_model,
+        llm=FakeChatModel(latency={"sparql": 0.05, "recovery": 0, "final": 0}),
+        db=NumpyVectorStore(embedding_model, documents, latency=0),
+        hana_client=FakeHanaClient(latency=0.05, documents=documents),
+        sparql_cache=SemanticQueryCache(threshold=2.0),
+        instrumentation=Instrumentation()
+    )
+    yield retriever
+    retriever.close()
+
+@pytest.fixture
+def calls(retriever, monkeypatch):
+    """
+    Counts the embedding calls, the SPARQL generations and the SPARQL executions.
+    """
+    calls = Counter()
+
+    def counted(name, method):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            return method(*args, **kwargs)
+        return call
+
+    def counted_async(name, method):
+        async def call(*args, **kwargs):
+            calls[name] += 1
+            return await method(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(retriever, "embed_questions", counted("embed", retriever.embed_questions))
+    monkeypatch.setattr(retriever, "aembed_questions", counted_async("embed", retriever.aembed_questions))
+    monkeypatch.setattr(retriever, "_execute_sparql", counted("execute", retriever._execute_sparql))
+    invoke, ainvoke = retriever._invoke_llm, retriever._ainvoke_llm
+    monkeypatch.setattr(retriever, "_invoke_llm", lambda call, *args: counted(call, invoke)(call, *args))
+    monkeypatch.setattr(retriever, "_ainvoke_llm", lambda call, *args: counted_async(call, ainvoke)(call, *args))
+    return calls
+
+def check_batch(results, calls):
+    assert sorted(result["index"] for result in results) == list(range(len(QUESTIONS)))
+    for result in results:
+        assert result["question"] == QUESTIONS[result["index"]]
+        assert "error" not in result and result["answer"]
+    by_index = {result["index"]: result["answer"] for result in results}
+    assert by_index[0] == by_index[2]
+
+    assert calls["embed"] == 1
+    # The repeated question is answered once
+    assert calls["sparql_generation"] == 3
+    assert calls["final_answer"] == 3
+    # The first two questions share the execution of their query
+    assert calls["execute"] == 2
+
+def test_answer_many_answers_repeated_questions_and_queries_once(retriever, calls):
+    check_batch(list(retriever.answer_many(QUESTIONS, max_concurrency=4)), calls)
+
+def test_aanswer_many_answers_repeated_questions_and_queries_once(retriever, calls):
+    async def answer_all():
+        return [result async for result in retriever.aanswer_many(QUESTIONS, max_concurrency=4)]
+
+    check_batch(asyncio.run(answer_all()), calls)
@@ -0,0 +1,61 @@
+import csv
+from io import StringIO
+
+import pytest
+
+from fakes import FakeEmbeddings, FakeHanaClient, build_fake_risk_view, synthetic_documents
+from risk_view import RiskView
+from sparql_router import TemplateRouter
+
+EMBEDDING = FakeEmbeddings(latency=0)
+
+@pytest.fixture(scope="module")
+def documents():
+    return synthetic_documents()
+
+@pytest.fixture(scope="module")
+def view(tmp_path_factory, documents):
+    directory = str(tmp_path_factory.mktemp("risk_view"))
+    build_fake_risk_view(directory, EMBEDDING, documents)
+    return RiskView(directory)
+
+def rows(csv_text):
+    return sorted(map(tuple, list(csv.reader(StringIO(csv_text)))[1:]))
+
+@pytest.mark.parametrize("question, expected", [
+    ("Which high-risk suppliers should I screen?", {"risk": ["High"], "type": []}),
+    ("List medium-risk and low risk manufacturers.", {"risk": ["Medium", "Low"], "type": ["Manufacturer"]}),
+    ("Which suppliers are in countries whose risk is high?", {"risk": ["High"], "type": []}),
+])
+def test_risk_screening_questions_match(view, question, expected):
+    assert view.match(question) == expected
+
+@pytest.mark.parametrize("question", [
+    "What challenges do our suppliers face?",
+    "How many high risk suppliers do we have?",
+    "Which high risk suppliers are in Russia?",
+    "Is StandSolutions a high risk supplier?",
+])
+def test_other_questions_are_left_to_the_pipeline(view, question):
+    assert view.match(question) is None
+
+def test_no_view_matches_nothing(tmp_path):
+    assert RiskView(str(tmp_path)).match("Which high-risk suppliers should I screen?") is None
+
+def test_lookup_returns_the_rows_of_the_supplier_template(view, documents):
+    hana_client = FakeHanaClient(latency=0, documents=documents)
+    for question in ("Which high risk suppliers should I screen?", "Which low risk manufacturers should I screen?"):
+        _, query = TemplateRouter(hana_client).route(question)
+        kg_csv, _ = view.lookup(view.match(question), EMBEDDING.embed_query(question))
+        assert rows(kg_csv) == rows(hana_client.execute_raw_sparql(query)[0])
+        assert rows(kg_csv)
+
+def test_lookup_returns_the_closest_chunks_of_the_matching_suppliers(view, documents):
+    kg_csv, _ = view.lookup({"risk": ["High"], "type": []}, EMBEDDING.embed_query("anything"))
+    suppliers = {row[0].rsplit("/", 1)[-1] for row in rows(kg_csv)}
+    chunk = next(document for document in documents if document.metadata["suppliers"][0] in suppliers)
+
+    _, chunks = view.lookup({"risk": ["High"], "type": []}, EMBEDDING.embed_query(chunk.page_content), top_k=3)
+    assert len(chunks) == 3
+    assert chunks[0].metadata["chunk_id"] == chunk.metadata["chunk_id"]
+    assert all(document.metadata["suppliers"][0] in suppliers for document in chunks)
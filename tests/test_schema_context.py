@@ -0,0 +1,53 @@
+import pytest
+
+from fakes import FakeHanaClient, synthetic_documents
+from schema_context import SchemaContext
+
+class CharCounter:
+    def count(self, text):
+        return len(text)
+
+@pytest.fixture(scope="module")
+def hana_client():
+    # With the rag:mentionedIn triples of the documents, which the context must leave out
+    return FakeHanaClient(latency=0, documents=synthetic_documents(chunks_per_supplier=1))
+
+def test_the_context_describes_the_predicates_of_the_graph(hana_client):
+    context = SchemaContext(hana_client, "g", counter=CharCounter(), token_budget=10 ** 6).get()
+    assert "- rag:locatedIn → IRI, e.g. rag:" in context
+    assert '- rag:hasSupplierId → Literal, e.g. "S' in context
+    # Repeated values make a domain, listed in full
+    assert '- rag:hasGeopoliticalRisk → Literal: "High", "Low" or "Medium".' in context
+    assert "Entities referenced by rag:locatedIn" in context
+    assert "Example triples:" in context
+    assert "mentionedIn" not in context
+
+def test_the_largest_variant_within_the_budget_is_used(hana_client):
+    full = SchemaContext(hana_client, "g", counter=CharCounter(), token_budget=10 ** 6).get()
+    compact = SchemaContext(hana_client, "g", counter=CharCounter(), token_budget=len(full) - 1).get()
+    minimal = SchemaContext(hana_client, "g", counter=CharCounter(), token_budget=0).get()
+    assert len(minimal) < len(compact) < len(full)
+    assert "Example triples:" not in compact and "e.g." in compact
+    assert "e.g." not in minimal and '"High", "Low" or "Medium"' in minimal
+
+def test_the_fallback_is_used_while_the_graph_cannot_be_read():
+    class FailingClient:
+        calls = 0
+
+        def execute_raw_sparql(self, query):
+            self.calls += 1
+            raise RuntimeError("HANA is down")
+
+    client = FailingClient()
+    loaded = []
+    schema = SchemaContext(client, "g", counter=CharCounter(), fallback="static context", retry_interval=300,
+                           on_load=loaded.append)
+    assert schema.get() == "static context"
+    assert schema.get() == "static context"
+    assert client.calls == 1 and not schema.warm_up()
+
+    # A reset, e.g. after the graph version changed, retries at once
+    schema.hana_client = FakeHanaClient(latency=0)
+    schema.reset()
+    assert schema.warm_up()
+    assert schema.get() != "static context" and loaded == [schema.get()]
@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+
+from sparql_cache import SemanticQueryCache, question_entities
+
+GERMANY = "SELECT ?s WHERE { ?s rag:locatedIn rag:Germany }"
+
+def unit(*values):
+    return np.array(values, dtype=np.float32)
+
+def test_questions_match_only_with_the_same_entities():
+    assert question_entities("Which suppliers are in Germany?") == {"germany"}
+    cache = SemanticQueryCache(threshold=0.9)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+
+    assert cache.may_match("Which suppliers are located in Germany?")
+    assert cache.get(unit(1, 0.1), "Which suppliers are located in Germany?") == GERMANY
+    assert not cache.may_match("Which suppliers are in France?")
+    assert cache.get(unit(1, 0), "Which suppliers are in France?") is None
+    assert cache.get(unit(0, 1), "Which suppliers are located in Germany?") is None
+
+def test_a_threshold_above_one_disables_the_cache():
+    cache = SemanticQueryCache(threshold=1.01)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    assert not cache.may_match("Which suppliers are in Germany?")
+    assert cache.get(unit(1, 0), "Which suppliers are in Germany?") is None
+
+def test_an_identical_question_refreshes_its_entry():
+    cache = SemanticQueryCache(max_entries=2)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", "old")
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    assert cache._active.sum() == 1
+    assert cache.get(unit(1, 0), "Which suppliers are in Germany?") == GERMANY
+
+def test_the_least_recently_used_entry_is_evicted():
+    cache = SemanticQueryCache(max_entries=2)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    cache.put(unit(0, 1), "Which suppliers are in France?", "france")
+    cache.get(unit(1, 0), "Which suppliers are in Germany?")
+    cache.put(unit(1, 1), "Which suppliers are in Spain?", "spain")
+    assert cache.get(unit(0, 1), "Which suppliers are in France?") is None
+    assert cache.get(unit(1, 0), "Which suppliers are in Germany?") == GERMANY
+
+def test_entries_expire(monkeypatch):
+    cache = SemanticQueryCache(ttl=10)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    now = time.time()
+    monkeypatch.setattr("sparql_cache.time.time", lambda: now + 11)
+    assert cache.get(unit(1, 0), "Which suppliers are in Germany?") is None
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    assert cache._active.sum() == 1
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "sparql_cache.npz")
+    cache = SemanticQueryCache(persist_path=path, save_interval=3600)
+    cache.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    cache.close()
+
+    reopened = SemanticQueryCache(persist_path=path)
+    assert reopened.get(unit(1, 0), "Which suppliers are in Germany?") == GERMANY
+    reopened.put(unit(1, 0), "Which suppliers are in Germany?", GERMANY)
+    assert reopened._active.sum() == 1
@@ -0,0 +1,103 @@
+import pytest
+
+import sparql_result_cache
+from sparql_result_cache import CachedSparqlClient, SparqlResultCache, normalize_sparql
+
+QUERY = "SELECT ?s WHERE { ?s <p> ?o . }"
+
+def test_layout_comments_and_keyword_case_are_ignored():
+    first = """PREFIX rag: <http://sap.com/rag/>
+SELECT ?s WHERE {
+    ?s rag:locatedIn rag:Germany .  # suppliers in Germany
+}"""
+    second = "prefix rag: <http://sap.com/rag/> select ?s where { ?s rag:locatedIn rag:Germany . }"
+    assert normalize_sparql(first) == normalize_sparql(second)
+
+def test_prefixed_names_are_expanded():
+    prefixed, _ = normalize_sparql("PREFIX rag: <http://sap.com/rag/> SELECT ?s WHERE { ?s a rag:Supplier . }")
+    full, _ = normalize_sparql("SELECT ?s WHERE { ?s a <http://sap.com/rag/Supplier> . }")
+    assert prefixed == full
+
+def test_variables_are_renamed_in_order_of_appearance():
+    canonical, variables = normalize_sparql("SELECT ?name ?country WHERE { ?name <p> ?country . }")
+    assert variables == ["name", "country"]
+    assert canonical == "select ?v0 ?v1 where { ?v0 <p> ?v1 . }"
+    assert normalize_sparql("SELECT ?a ?b WHERE { ?a <p> ?b . }")[0] == canonical
+
+def test_literals_keep_their_case_and_spacing():
+    upper, _ = normalize_sparql('SELECT ?s WHERE { ?s <p> "High  Risk" . }')
+    lower, _ = normalize_sparql('SELECT ?s WHERE { ?s <p> "high risk" . }')
+    assert '"High  Risk"' in upper
+    assert upper != lower
+
+def test_braces_and_hashes_inside_strings_are_kept():
+    canonical, _ = normalize_sparql('SELECT ?s WHERE { ?s <p> "a # not a comment }" . }')
+    assert canonical.endswith('"a # not a comment }" . }')
+
+class CountingClient:
+    def __init__(self):
+        self.graph = "first"
+        self.executed = 0
+
+    def execute_raw_sparql(self, query):
+        self.executed += 1
+        return f"s\n{self.graph}\n", "{}"
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sparql_result_cache.time, "monotonic", clock)
+    return clock
+
+def cached_client(**options):
+    client = CountingClient()
+    changes = []
+    cache = SparqlResultCache(version_loader=lambda: client.graph, version_check_interval=30,
+                              on_version_change=lambda: changes.append(client.graph), **options)
+    return client, CachedSparqlClient(client, cache), changes
+
+def test_equivalent_queries_share_a_result(clock):
+    client, cached, _ = cached_client()
+    cached.execute_raw_sparql(QUERY)
+    results, _ = cached.execute_raw_sparql("select ?x where { ?x <p> ?y . }  # same query")
+    assert client.executed == 1
+    assert results == "x\nfirst\n"
+
+def test_a_reloaded_graph_is_never_served_from_the_cache(clock):
+    client, cached, changes = cached_client()
+    cached.execute_raw_sparql(QUERY)
+    client.graph = "second"
+    assert cached.execute_raw_sparql(QUERY)[0] == "s\nsecond\n"
+    assert changes == ["second"]
+
+def test_with_max_staleness_results_of_the_old_graph_are_served_that_long(clock):
+    client, cached, changes = cached_client(max_staleness=10)
+    cached.execute_raw_sparql(QUERY)
+    client.graph = "second"
+    clock.now += 9
+    assert cached.execute_raw_sparql(QUERY)[0] == "s\nfirst\n"
+    clock.now += 1
+    assert cached.execute_raw_sparql(QUERY)[0] == "s\nsecond\n"
+    assert changes == ["second"] and client.executed == 2
+
+def test_updates_clear_the_cache_and_unknown_versions_bypass_it(clock):
+    client, cached, _ = cached_client()
+    cached.execute_raw_sparql(QUERY)
+    cached.execute_raw_sparql("INSERT DATA { <a> <p> <b> . }")
+    cached.execute_raw_sparql(QUERY)
+    assert client.executed == 3
+
+    def unreadable():
+        raise RuntimeError("no meta graph")
+
+    cached.cache.version_loader = unreadable
+    cached.execute_raw_sparql(QUERY)
+    cached.execute_raw_sparql(QUERY)
+    assert client.executed == 5
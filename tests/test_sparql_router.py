@@ -0,0 +1,63 @@
+import csv
+from io import StringIO
+import pytest
+import rdflib
+from fakes import FakeHanaClient
+from sparql_router import TemplateRouter
+
+@pytest.fixture(scope="module")
+def hana_client():
+    return FakeHanaClient(latency=0)
+
+def rows(hana_client, query):
+    return list(csv.DictReader(StringIO(hana_client.execute_raw_sparql(query)[0])))
+
+def test_country_risk_and_type_are_filtered(hana_client):
+    intent, query = TemplateRouter(hana_client).route("Which high risk manufacturers are in Russia?")
+    assert intent == "country+risk+type"
+    result = rows(hana_client, query)
+    assert result
+    assert all(row["country"].endswith("/Russia") and row["risk"] == "High"
+               and row["supplierType"] == "Manufacturer" for row in result)
+
+def test_supplier_names_match_with_spaces_or_underscores(hana_client):
+    router = TemplateRouter(hana_client)
+    intent, query = router.route("What is the email address of VisionCam DE?")
+    assert intent == "supplier"
+    assert "rag:VisionCam_DE" in query
+    assert [row["email"] for row in rows(hana_client, query)] == ["info@visioncam.de"]
+
+@pytest.mark.parametrize("question", [
+    "How many suppliers are in Germany?",
+    "Which suppliers are not in Germany?",
+    "What is the weather like today?",
+])
+def test_unsupported_questions_go_to_the_llm(hana_client, question):
+    assert TemplateRouter(hana_client).route(question) is None
+
+def test_routing_is_disabled_while_the_entities_cannot_be_loaded():
+    class FailingClient:
+        calls = 0
+
+        def execute_raw_sparql(self, query):
+            self.calls += 1
+            raise RuntimeError("HANA is down")
+
+    client = FailingClient()
+    router = TemplateRouter(client, retry_interval=300)
+    assert router.route("Suppliers in Germany") is None
+    assert router.route("Suppliers in Germany") is None
+    assert client.calls == 1
+    assert router.warm_up() is False
+
+def test_suppliers_with_missing_attributes_are_still_returned():
+    hana_client = FakeHanaClient(latency=0)
+    supplier = rdflib.URIRef("http://sap.com/rag/VisionCam_DE")
+    hana_client.graph.remove((supplier, rdflib.URIRef("http://sap.com/rag/hasPhone"), None))
+    country = hana_client.graph.value(supplier, rdflib.URIRef("http://sap.com/rag/locatedIn"))
+    hana_client.graph.remove((country, rdflib.URIRef("http://sap.com/rag/hasGeopoliticalRisk"), None))
+
+    _, query = TemplateRouter(hana_client).route("What is the email address of VisionCam DE?")
+    [row] = rows(hana_client, query)
+    assert row["email"] == "info@visioncam.de"
+    assert row["phone"] == "" and row["risk"] == ""
@@ -0,0 +1,46 @@
+from sparql_validation import SparqlValidator
+
+PREFIX = "PREFIX rag: <http://sap.com/rag/>\n"
+
+def test_missing_graph_is_added_as_from():
+    query, fixes, errors = SparqlValidator("g").validate(PREFIX + "SELECT ?s WHERE { ?s rag:locatedIn ?c . }")
+    assert "FROM <g>" in query and "graph" in " ".join(fixes) and not errors
+
+def test_graph_variable_queries_get_no_from_clause():
+    original = PREFIX + "SELECT ?s ?g WHERE { GRAPH ?g { ?s rag:locatedIn ?c . } }"
+    query, fixes, errors = SparqlValidator("g").validate(original)
+    assert query == original and not fixes and not errors
+
+def test_unbound_variables_are_bound_inside_the_group_of_their_subject():
+    original = PREFIX + "SELECT ?supplier ?supplierName ?email WHERE { GRAPH <g> { ?supplier rag:locatedIn ?c . } }"
+    query, fixes, errors = SparqlValidator("g").validate(original)
+    assert fixes == ["unbound_variable"] and not errors
+    inner = query[query.index("GRAPH <g> {"):query.rindex("}")]
+    assert "BIND(?supplier AS ?supplierName)" in inner
+    assert "OPTIONAL { ?supplier rag:hasEmail ?email . }" in inner
+
+def test_bindings_are_not_put_into_a_trailing_values_block():
+    original = (PREFIX + "SELECT ?supplier ?city FROM <g> WHERE { ?supplier rag:locatedIn ?country . } "
+                "VALUES ?country { rag:Germany }")
+    query, _, errors = SparqlValidator("g").validate(original)
+    assert not errors
+    assert query.index("rag:locatedInCity") < query.index("VALUES")
+
+def test_outcomes_are_memoized_by_normalized_query():
+    validator = SparqlValidator("g")
+    first = validator.validate(PREFIX + "SELECT ?s WHERE { ?s rag:locatedIn ?c . }")
+    second = validator.validate(PREFIX + "select ?s\nwhere { ?s rag:locatedIn ?c . }")
+    assert second == first
+    assert len(validator._memo) == 1
+
+def test_selected_variables_that_cannot_be_bound_are_errors():
+    _, _, errors = SparqlValidator("g").validate(PREFIX + "SELECT ?s ?revenue WHERE { ?s rag:locatedIn ?c . }")
+    assert errors == ["Variable ?revenue is selected but never bound in WHERE"]
+
+def test_unknown_predicates_are_errors():
+    _, _, errors = SparqlValidator("g").validate(PREFIX + "SELECT ?s WHERE { ?s rag:hasRevenue ?r . }")
+    assert len(errors) == 1 and errors[0].startswith("Unknown predicate rag:hasRevenue")
+
+def test_syntax_errors_are_errors():
+    _, _, errors = SparqlValidator("g").validate(PREFIX + "SELECT ?s WHERE { ?s rag:locatedIn }")
+    assert len(errors) == 1
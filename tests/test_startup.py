@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from startup import LazyInitializer
+
+def test_concurrent_callers_share_one_creation():
+    started, release = threading.Event(), threading.Event()
+    created = []
+
+    def factory():
+        started.set()
+        release.wait(5)
+        created.append(object())
+        return created[-1]
+
+    initializer = LazyInitializer(factory)
+    assert initializer.status()["state"] == "not_started"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(initializer.get())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    assert initializer.status()["state"] == "initializing" and not initializer.ready
+    assert initializer.peek() is None
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(created) == 1 and results == created * 4
+    assert initializer.ready and initializer.peek() is created[0]
+
+def test_a_failed_creation_is_retried_by_the_next_caller():
+    attempts = []
+
+    def factory():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise RuntimeError("AI Core unreachable")
+        return "retriever"
+
+    initializer = LazyInitializer(factory)
+    with pytest.raises(RuntimeError):
+        initializer.get()
+    assert initializer.status()["state"] == "failed"
+    assert initializer.status()["error"] == "AI Core unreachable"
+    assert initializer.get() == "retriever"
+    assert initializer.status()["state"] == "ready" and initializer.status()["error"] is None
+
+def test_start_creates_and_warms_up_in_the_background():
+    warming, release = threading.Event(), threading.Event()
+
+    def warm_up(instance):
+        warming.set()
+        release.wait(5)
+        return {"sparql_templates": 0.5}
+
+    initializer = LazyInitializer(lambda: "retriever", warm_up=warm_up)
+    initializer.start()
+    warming.wait(5)
+    # Requests may use the object while it warms up, but the process is not ready yet
+    assert initializer.status()["state"] == "warming_up" and not initializer.ready
+    assert initializer.get() == "retriever"
+    release.set()
+    initializer._thread.join(5)
+    status = initializer.status()
+    assert initializer.ready
+    assert set(status["timings"]) == {"initialize", "warm_up", "sparql_templates"}
+
+def test_a_failed_warm_up_still_leaves_the_object_ready():
+    def warm_up(instance):
+        raise RuntimeError("HANA is down")
+
+    initializer = LazyInitializer(lambda: "retriever", warm_up=warm_up)
+    initializer.start()
+    initializer._thread.join(5)
+    assert initializer.ready and initializer.get() == "retriever"
+
+def test_set_replaces_the_object_without_the_factory():
+    initializer = LazyInitializer(lambda: pytest.fail("the factory must not run"))
+    initializer.set("fake retriever")
+    initializer.start()
+    assert initializer.ready and initializer.get() == "fake retriever"
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from tenants import TenantRegistry, UnknownTenantError, tenant_names
+
+class Resources:
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+@pytest.fixture
+def closed():
+    return []
+
+@pytest.fixture
+def registry(closed):
+    return TenantRegistry(Resources, max_size=2, on_evict=lambda resources: closed.append(resources.tenant))
+
+def test_least_recently_used_tenants_are_evicted_and_closed(registry, closed):
+    for tenant in ("a", "b", "a", "c"):
+        with registry.lease(tenant):
+            pass
+    assert registry.tenants() == ["a", "c"]
+    assert closed == ["b"]
+
+def test_resources_evicted_while_leased_are_closed_on_the_last_release(registry, closed):
+    first = registry.acquire("a")
+    second = registry.acquire("a")
+    with registry.lease("b"), registry.lease("c"):
+        pass
+    assert "a" not in registry.tenants() and closed == []
+    registry.release(first)
+    assert closed == []
+    registry.release(second)
+    assert closed == ["a"]
+
+def test_concurrent_requests_share_one_creation():
+    started, release = threading.Event(), threading.Event()
+    created = []
+
+    def factory(tenant):
+        created.append(tenant)
+        started.set()
+        release.wait(5)
+        return Resources(tenant)
+
+    registry = TenantRegistry(factory)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.acquire("a"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert created == ["a"]
+    assert len(results) == 3 and all(resources is results[0] for resources in results)
+
+def test_a_failed_creation_is_not_remembered():
+    attempts = []
+
+    def factory(tenant):
+        attempts.append(tenant)
+        if len(attempts) == 1:
+            raise RuntimeError("graph not loaded")
+        return Resources(tenant)
+
+    registry = TenantRegistry(factory)
+    with pytest.raises(RuntimeError):
+        registry.acquire("a")
+    assert registry.tenants() == []
+    with registry.lease("a") as resources:
+        assert resources.tenant == "a"
+    assert attempts == ["a", "a"]
+
+def test_close_closes_idle_tenants_now_and_leased_ones_on_release(registry, closed):
+    leased = registry.acquire("a")
+    with registry.lease("b"):
+        pass
+    registry.close()
+    assert registry.tenants() == [] and closed == ["b"]
+    registry.release(leased)
+    assert closed == ["b", "a"]
+
+def test_tenant_names(monkeypatch):
+    monkeypatch.delenv("TENANTS", raising=False)
+    monkeypatch.delenv("TENANT_GRAPH_TEMPLATE", raising=False)
+    monkeypatch.setenv("TENANT_TABLE_TEMPLATE", "EMBED_{tenant}")
+    assert tenant_names("acme") == ("rag_suppliers_acme", "EMBED_acme")
+    assert tenant_names("acme", {"acme": {"graph": "g"}}) == ("g", "EMBED_acme")
+    with pytest.raises(UnknownTenantError):
+        tenant_names("other", {"acme": {}})
+    with pytest.raises(UnknownTenantError):
+        tenant_names("acme> } DROP ALL {")
@@ -0,0 +1,103 @@
+import json
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from vector_replica import DocumentStore, VectorReplica
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+        self.result = []
+
+    def execute(self, statement, parameters=None):
+        if "IS NULL" in statement:
+            self.result = []
+        elif " IN (" in statement:
+            self.table.fetched.extend(parameters)
+            self.result = [(chunk_id, *self.table.rows[chunk_id]) for chunk_id in parameters]
+        else:
+            self.result = [(chunk_id,) for chunk_id in self.table.rows]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+class FakeTable:
+    """
+    Vector table rows by chunk id, as (content, metadata JSON, vector).
+    """
+    def __init__(self):
+        self.rows = {}
+        self.fetched = []
+
+    def add(self, chunk_id, vector):
+        self.rows[chunk_id] = (f"text of {chunk_id}", json.dumps({"chunk_id": chunk_id}), vector)
+
+    @contextmanager
+    def connect(self):
+        yield self
+
+    def cursor(self):
+        return FakeCursor(self)
+
+@pytest.fixture
+def table():
+    table = FakeTable()
+    rng = np.random.default_rng(0)
+    for i in range(20):
+        table.add(f"c{i:02d}", rng.normal(size=8).astype(np.float32).tolist())
+    return table
+
+def test_search_reads_documents_from_the_mapped_file(tmp_path, table):
+    replica = VectorReplica(str(tmp_path), "T", table.connect, nprobe=64)
+    replica.sync()
+    assert isinstance(replica._state[3], DocumentStore)
+
+    ids, documents, scores = replica.search(table.rows["c07"][2], k=1)
+    assert ids == ["c07"]
+    assert documents[0].page_content == "text of c07"
+    assert documents[0].metadata == {"chunk_id": "c07"}
+    assert scores[0] == pytest.approx(1.0)
+
+    # Another worker process loads the same build from disk
+    other = VectorReplica(str(tmp_path), "T", table.connect)
+    assert other._state[2] == replica._state[2]
+    assert other._state[3][7] == documents[0]
+
+def test_sync_fetches_only_new_rows(tmp_path, table):
+    replica = VectorReplica(str(tmp_path), "T", table.connect, nprobe=64)
+    assert replica.sync() is True
+    assert sorted(table.fetched) == sorted(table.rows)
+
+    table.fetched.clear()
+    assert replica.sync() is False
+    assert table.fetched == []
+
+    del table.rows["c03"]
+    table.add("c20", [1.0] * 8)
+    assert replica.sync() is True
+    assert table.fetched == ["c20"]
+    assert replica._state[2] == sorted(table.rows)
+    assert [document.page_content for document in replica._state[3]] == [
+        f"text of {chunk_id}" for chunk_id in sorted(table.rows)
+    ]
+    assert replica.search([1.0] * 8, k=1)[0] == ["c20"]
+
+def test_search_ids_scores_the_given_chunks_exactly(tmp_path, table):
+    replica = VectorReplica(str(tmp_path), "T", table.connect)
+    replica.sync()
+    documents, scores = replica.search_ids(table.rows["c11"][2], ["c02", "c11", "unknown"], k=5)
+    assert [document.metadata["chunk_id"] for document in documents] == ["c11", "c02"]
+    assert scores[0] == pytest.approx(1.0)
+
+def test_empty_document_store(tmp_path):
+    path = tmp_path / "documents.jsonl"
+    path.write_text("")
+    assert len(DocumentStore(str(path))) == 0
+    path.write_text(json.dumps({"id": "a", "content": "x", "metadata": {}}) + "\n")
+    assert DocumentStore(str(path))[0] == Document(page_content="x", metadata={})
@@ -0,0 +1,458 @@
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+def current_build(directory):
+    """
+    Returns the build directory that directory/CURRENT points to, or None if there is none.
+    """
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return os.path.join(directory, "builds", f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def new_build(directory):
+    """
+    Creates and returns an empty build directory under directory/builds. Names sort by age.
+    """
+    path = os.path.join(directory, "builds", f"{time.time_ns():020d}-{os.getpid()}")
+    os.makedirs(path)
+    return path
+
+def publish_build(directory, path, keep=2):
+    """
+    Points directory/CURRENT at a complete build with a single rename, so readers see either
+    the previous build or this one, never a mix. Only the keep newest builds are left on disk;
+    the previous one stays for readers that resolved CURRENT just before the switch.
+    """
+    pointer = os.path.join(directory, "CURRENT")
+    with open(f"{pointer}.{os.getpid()}.tmp", "w") as f:
+        f.write(os.path.basename(path))
+    os.replace(f"{pointer}.{os.getpid()}.tmp", pointer)
+    builds = os.path.join(directory, "builds")
+    older = [name for name in sorted(os.listdir(builds)) if name != os.path.basename(path)]
+    for name in older[:max(len(older) - keep + 1, 0)]:
+        shutil.rmtree(os.path.join(builds, name), ignore_errors=True)
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized vectors for approximate cosine search.
+
+    Vectors are clustered with spherical k-means into nlist cells. A search scores the
+    centroids, scans only the nprobe closest cells exactly and returns the best rows.
+    """
+    def __init__(self, centroids, offsets, rows, trained_rows):
+        self.centroids = centroids  # (nlist, dim)
+        self.offsets = offsets      # cell i holds rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows            # row numbers grouped by cell
+        self.trained_rows = trained_rows  # number of vectors when the centroids were trained
+
+    @classmethod
+    def train(cls, vectors, nlist=None, iterations=10, sample_size=20000, seed=0):
+        count = len(vectors)
+        nlist = nlist or int(np.clip(np.sqrt(count), 1, 1024))
+        nlist = min(nlist, count)
+        rng = np.random.default_rng(seed)
+
+        sample = vectors[np.sort(rng.choice(count, size=min(sample_size, count), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            cells, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            # Empty cells keep their previous centroid
+            centroids[cells] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        return cls.assign(vectors, centroids.astype(np.float32), count)
+
+    @classmethod
+    def assign(cls, vectors, centroids, trained_rows):
+        """
+        Builds the index of vectors over existing centroids, without training.
+        """
+        assignment = cls._assign(vectors, centroids)
+        rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[rows], np.arange(len(centroids) + 1)).astype(np.int64)
+        return cls(centroids, offsets, rows, trained_rows)
+
+    @staticmethod
+    def _assign(vectors, centroids, batch_size=65536):
+        return np.concatenate([
+            np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), batch_size)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+    def search(self, vectors, query, k, nprobe):
+        """
+        Returns the row numbers and scores of the k best rows in the nprobe closest cells.
+        """
+        cells = np.argsort(-(self.centroids @ query))[:nprobe]
+        candidates = np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+        if len(candidates) == 0:
+            return candidates, np.zeros(0, dtype=np.float32)
+        # Sorted row numbers keep the memory-mapped reads sequential
+        candidates.sort()
+        scores = vectors[candidates] @ query
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return candidates[top], scores[top]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, offsets=self.offsets, rows=self.rows,
+                 trained_rows=self.trained_rows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["rows"], int(data["trained_rows"]))
+
+class DocumentStore:
+    """
+    Read-only sequence of the documents in a documents.jsonl file. The file is memory-mapped
+    and a row is parsed only when it is read, so a process keeps the line offsets in memory
+    rather than the content of every chunk.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # The mapping stays valid after the file is closed, or removed with an old build
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        offsets = [0]
+        while offsets[-1] < size:
+            end = self._data.find(b"\n", offsets[-1])
+            offsets.append(size if end < 0 else end + 1)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return Document(**self.record(row)[1])
+
+    def record(self, row):
+        """
+        Returns the chunk id and the Document arguments stored in a row.
+        """
+        record = json.loads(self._data[self.offsets[row]:self.offsets[row + 1]])
+        return record["id"], {"page_content": record["content"], "metadata": record["metadata"]}
+
+    def ids(self):
+        return [self.record(row)[0] for row in range(len(self))]
+
+class VectorReplica:
+    """
+    Read-only local copy of the HANA vector table, searched in-process.
+
+    Each build of the replica is a subdirectory of builds/ holding vectors.f32 (memory-mapped
+    float32 matrix, one normalized row per chunk), documents.jsonl (chunk id, content and
+    metadata per row, memory-mapped as well and parsed when a search returns the row), ivf.npz
+    (the IVF index) and meta.json (dimension, row count and change version); the file CURRENT
+    names the build in use and is replaced atomically. Only the chunk ids, the IVF index and
+    the line offsets of the documents are held in memory by each process.
+    sync() compares the chunk ids in HANA with the local ones and only fetches new rows,
+    so refreshing an unchanged table costs a single id scan. The rows of a sync are assigned
+    to the existing IVF centroids; k-means runs again once the row count has doubled or halved
+    since the centroids were trained. HANA remains the source of truth: callers fall back to
+    it whenever the replica is not ready or older than max_staleness.
+    """
+    def __init__(self, directory, table_name, connection_factory=None, nprobe=8, nlist=None,
+                 refresh_interval=300, max_staleness=3600):
+        self.directory = directory
+        self.table_name = table_name
+        self.connection_factory = connection_factory
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._state = None  # (vectors, index, ids, documents), swapped atomically
+        self._rows_by_id = None  # (state, {chunk id: row}), built on the first search_ids
+        self.version = None
+        self.synced_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        with self._file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _file_lock(self, operation):
+        """
+        Holds the lock shared by the worker processes using the directory: shared while a build
+        is read, exclusive while one is written or old builds are removed.
+        """
+        with open(self._path(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        build = current_build(self.directory)
+        if build is None:
+            return
+        try:
+            with open(os.path.join(build, "meta.json")) as f:
+                meta = json.load(f)
+            vectors = np.memmap(os.path.join(build, "vectors.f32"), dtype=np.float32, mode="r",
+                                shape=(meta["count"], meta["dim"])) if meta["count"] else None
+            documents = DocumentStore(os.path.join(build, "documents.jsonl"))
+            ids = documents.ids()
+            index = IVFIndex.load(os.path.join(build, "ivf.npz")) if vectors is not None else None
+            with self._lock:
+                self._state = (vectors, index, ids, documents)
+                self.version = meta["version"]
+                # The files on disk may be arbitrarily old; only a sync makes the replica fresh
+                self.synced_at = meta.get("synced_at")
+            logger.info("Loaded vector replica with %d rows from %s", len(ids), self.directory)
+        except Exception as e:
+            logger.warning("Could not load vector replica from %s: %s", self.directory, e)
+
+    @property
+    def ready(self):
+        """
+        True if the replica holds rows and was synced within max_staleness seconds.
+        """
+        return (self._state is not None and self._state[0] is not None and self.synced_at is not None
+                and time.time() - self.synced_at <= self.max_staleness)
+
+    def search(self, embedding, k=4, nprobe=None):
+        """
+        Returns the chunk ids, documents and cosine similarities of the k nearest rows.
+        """
+        vectors, index, ids, documents = self._state
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        rows, scores = index.search(vectors, query, k, nprobe or self.nprobe)
+        return [ids[row] for row in rows], [documents[row] for row in rows], scores
+
+    def search_ids(self, embedding, chunk_ids, k=4):
+        """
+        Returns the documents and cosine similarities of the k rows among chunk_ids that are
+        nearest to the embedding, scored exactly. Unknown chunk ids are ignored.
+        """
+        state = self._state
+        vectors, _, ids, documents = state
+        rows_by_id = self._rows_by_id
+        if rows_by_id is None or rows_by_id[0] is not state:
+            rows_by_id = self._rows_by_id = (state, {chunk_id: row for row, chunk_id in enumerate(ids)})
+        rows = np.array(sorted({rows_by_id[1][chunk_id] for chunk_id in chunk_ids if chunk_id in rows_by_id[1]}),
+                        dtype=np.int64)
+        if len(rows) == 0:
+            return [], np.zeros(0, dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = vectors[rows] @ query
+        top = np.argsort(-scores)[:k]
+        return [documents[row] for row in rows[top]], scores[top]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        """
+        Same contract as HanaDB.similarity_search_by_vector. The only supported metadata
+        filter is {"chunk_id": {"$in": [...]}}.
+        """
+        if filter:
+            condition = filter.get("chunk_id") if len(filter) == 1 else None
+            if not isinstance(condition, dict) or list(condition) != ["$in"]:
+                raise ValueError("Only chunk_id $in filters are supported by the vector replica")
+            return self.search_ids(embedding, condition["$in"], k)[0]
+        return self.search(embedding, k)[1]
+
+    def rebuild(self, ids, documents, vectors, version):
+        """
+        Writes a new replica from complete rows and swaps it in for searches.
+        documents may be any iterable with one Document per id; it is read once.
+        """
+        with self._sync_lock, self._file_lock(fcntl.LOCK_EX):
+            self._rebuild(ids, documents, vectors, version)
+
+    def _rebuild(self, ids, documents, vectors, version):
+        if not len(ids):
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        index = self._index(vectors) if len(ids) else None
+        synced_at = time.time()
+
+        build = new_build(self.directory)
+        with open(os.path.join(build, "vectors.f32"), "wb") as f:
+            f.write(vectors.tobytes())
+        with open(os.path.join(build, "documents.jsonl"), "w") as f:
+            for chunk_id, document in zip(ids, documents):
+                f.write(json.dumps({"id": chunk_id, "content": document.page_content,
+                                    "metadata": document.metadata}) + "\n")
+        if index is not None:
+            index.save(os.path.join(build, "ivf.npz"))
+        with open(os.path.join(build, "meta.json"), "w") as f:
+            json.dump({"dim": int(vectors.shape[1]) if len(ids) else 0, "count": len(ids),
+                       "version": version, "synced_at": synced_at}, f)
+        publish_build(self.directory, build)
+
+        mapped = np.memmap(os.path.join(build, "vectors.f32"), dtype=np.float32, mode="r",
+                           shape=vectors.shape) if len(ids) else None
+        with self._lock:
+            self._state = (mapped, index, list(ids), DocumentStore(os.path.join(build, "documents.jsonl")))
+            self.version = version
+            self.synced_at = synced_at
+
+    def _index(self, vectors):
+        """
+        Assigns the rows to the centroids of the current index, or trains new centroids if
+        there are none, the dimension changed or the row count has doubled or halved since.
+        """
+        previous = self._state[1] if self._state is not None else None
+        if (previous is not None and previous.centroids.shape[1] == vectors.shape[1]
+                and self.nlist in (None, len(previous.centroids))
+                and previous.trained_rows / 2 <= len(vectors) <= previous.trained_rows * 2):
+            return IVFIndex.assign(vectors, previous.centroids, previous.trained_rows)
+        return IVFIndex.train(vectors, self.nlist)
+
+    def sync(self):
+        """
+        Brings the replica up to date with the HANA table. Returns True if anything changed.
+
+        Worker processes sharing the directory take turns under a file lock; a process that
+        finds a newer replica on disk loads it instead of fetching the rows again.
+        """
+        with self._sync_lock, self._file_lock(fcntl.LOCK_EX):
+            if self._disk_version() != self.version:
+                self._load()
+            with self.connection_factory() as connection:
+                return self._sync(connection)
+
+    def _disk_version(self):
+        build = current_build(self.directory)
+        if build is None:
+            return None
+        try:
+            with open(os.path.join(build, "meta.json")) as f:
+                return json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _sync(self, connection):
+        remote_ids, legacy_rows = self._fetch_ids(connection)
+        version = hashlib.sha256("\n".join(sorted(remote_ids)).encode()).hexdigest()
+        if version == self.version:
+            self._touch()
+            return False
+
+        state = self._state
+        local = {} if state is None else {chunk_id: row for row, chunk_id in enumerate(state[2])}
+        missing = [chunk_id for chunk_id in remote_ids if chunk_id not in local and chunk_id not in legacy_rows]
+        fetched = dict(legacy_rows)
+        fetched.update(self._fetch_rows(connection, missing))
+
+        ids = sorted(remote_ids)
+        vectors = np.asarray([fetched[chunk_id][1] if chunk_id in fetched else state[0][local[chunk_id]]
+                              for chunk_id in ids], dtype=np.float32)
+        # Kept documents are copied from the current build one at a time
+        documents = (fetched[chunk_id][0] if chunk_id in fetched else state[3][local[chunk_id]] for chunk_id in ids)
+
+        removed = len(set(local) - remote_ids)
+        self._rebuild(ids, documents, vectors, version)
+        logger.info("Vector replica synced: %d rows, %d fetched, %d removed", len(ids), len(missing), removed)
+        return True
+
+    def _touch(self):
+        synced_at = time.time()
+        meta_path = os.path.join(current_build(self.directory), "meta.json")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta["synced_at"] = synced_at
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.synced_at = synced_at
+
+    def _fetch_ids(self, connection):
+        """
+        Returns the set of chunk ids in the table. Rows written before chunk ids existed are
+        identified by a hash of their content and fetched in full.
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f'SELECT JSON_VALUE("METADATA", \'$.chunk_id\') FROM "{self.table_name}"')
+            ids = {row[0] for row in cursor.fetchall() if row[0] is not None}
+            cursor.execute(
+                f'SELECT "CONTENT", "METADATA", "VECTOR" FROM "{self.table_name}" '
+                f'WHERE JSON_VALUE("METADATA", \'$.chunk_id\') IS NULL'
+            )
+            legacy_rows = {}
+            for content, metadata, vector in cursor.fetchall():
+                chunk_id = "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+                legacy_rows[chunk_id] = (Document(page_content=content, metadata=json.loads(metadata)),
+                                         parse_vector(vector))
+        finally:
+            cursor.close()
+        return ids | set(legacy_rows), legacy_rows
+
+    def _fetch_rows(self, connection, chunk_ids, batch_size=500):
+        rows = {}
+        cursor = connection.cursor()
+        try:
+            for start in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[start:start + batch_size]
+                cursor.execute(
+                    f'SELECT JSON_VALUE("METADATA", \'$.chunk_id\'), "CONTENT", "METADATA", "VECTOR" '
+                    f'FROM "{self.table_name}" WHERE JSON_VALUE("METADATA", \'$.chunk_id\') IN '
+                    f'({", ".join("?" * len(batch))})',
+                    batch
+                )
+                for chunk_id, content, metadata, vector in cursor.fetchall():
+                    rows[chunk_id] = (Document(page_content=content, metadata=json.loads(metadata)),
+                                      parse_vector(vector))
+        finally:
+            cursor.close()
+        return rows
+
+    def start_background_sync(self):
+        """
+        Syncs now and then every refresh_interval seconds on a daemon thread.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.warning("Vector replica sync failed, searches fall back to HANA when stale: %s", e)
+                self._stop.wait(self.refresh_interval)
+
+        self._thread = threading.Thread(target=run, name="vector-replica-sync", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+def parse_vector(value):
+    """
+    Converts a REAL_VECTOR value as returned by hdbcli (fvecs bytes: uint32 dimension followed
+    by float32 values, or a sequence of floats) into a float32 array.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        buffer = bytes(value)
+        dim = int.from_bytes(buffer[:4], "little")
+        return np.frombuffer(buffer, dtype="<f4", count=dim, offset=4)
+    return np.asarray(value, dtype=np.float32)